@@ -16,6 +16,8 @@ class PeriodicWorkerThread(object):
     The method `on_shutdown` will be called on worker shutdown. The worker will be shutdown when the program exits and
     can be waited for with the `exit_timeout` parameter.
 
+    The worker can be woken up with `awake` to call `run_periodic` without waiting for the end of the interval.
+
     """
 
     _DEFAULT_INTERVAL = 1.0
@@ -32,6 +34,7 @@ class PeriodicWorkerThread(object):
         self._thread = threading.Thread(target=self._target, name=name)
         self._thread.daemon = daemon
         self._stop = threading.Event()
+        self._wakeup = threading.Event()
         self.started = False
         self.interval = interval
         self.exit_timeout = exit_timeout
@@ -59,6 +62,11 @@ class PeriodicWorkerThread(object):
         """Stop the worker."""
         _LOG.debug("Stopping %s thread", self._thread.name)
         self._stop.set()
+        self._wakeup.set()
+
+    def awake(self):
+        """Run the periodic method as soon as possible, without waiting for the end of the interval."""
+        self._wakeup.set()
 
     def is_alive(self):
         return self._thread.is_alive()
@@ -67,7 +75,11 @@ class PeriodicWorkerThread(object):
         return self._thread.join(timeout)
 
     def _target(self):
-        while not self._stop.wait(self.interval):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
             self.run_periodic()
         self._on_shutdown()
 
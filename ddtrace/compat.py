@@ -53,6 +53,12 @@ if PYTHON_VERSION_INFO >= (3, 7):
 else:
     pattern_type = re._pattern_type
 
+# Dicts keep the insertion order since Python 3.7
+if PYTHON_VERSION_INFO >= (3, 7):
+    ordered_dict = dict
+else:
+    from collections import OrderedDict as ordered_dict  # noqa: F401
+
 
 def is_integer(obj):
     """Helper to determine if the provided ``obj`` is an integer type or not"""
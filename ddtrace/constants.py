@@ -13,6 +13,10 @@ SERVICE_KEY = "service.name"
 SERVICE_VERSION_KEY = "service.version"
 SPAN_KIND = "span.kind"
 SPAN_MEASURED_KEY = "_dd.measured"
+SPAN_SUMMARY_COUNT_KEY = "span_summary.count"
+SPAN_SUMMARY_DURATION_KEY = "span_summary.duration"
+SPAN_SUMMARY_ERRORS_KEY = "span_summary.errors"
+GC_TIME_KEY = "python.gc.time_ns"
 
 NUMERIC_TAGS = (ANALYTICS_SAMPLE_RATE_KEY,)
 
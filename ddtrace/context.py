@@ -2,10 +2,14 @@ import logging
 import threading
 
 from .constants import HOSTNAME_KEY, SAMPLING_PRIORITY_KEY, ORIGIN_KEY, LOG_SPAN_KEY
+from .constants import SPAN_SUMMARY_COUNT_KEY, SPAN_SUMMARY_DURATION_KEY, SPAN_SUMMARY_ERRORS_KEY
+from .compat import ordered_dict
 from .internal.logger import get_logger
 from .internal import hostname
+from .span import Span
 from .settings import config
 from .utils.formats import asbool, get_env
+from .vendor import six
 
 log = get_logger(__name__)
 
@@ -23,11 +27,16 @@ class Context(object):
     generates the job itself. On the other hand, if it's part of the same
     ``Context``, it will be related to the original trace.
 
-    This data structure is thread-safe.
+    This data structure is thread-safe. The lock only guards the changes made
+    to the trace when spans are added and closed: the accessors read or write a
+    single attribute, which is atomic, and do not take it.
     """
 
     _partial_flush_enabled = asbool(get_env("tracer", "partial_flush_enabled", default=False))
     _partial_flush_min_spans = int(get_env("tracer", "partial_flush_min_spans", default=500))
+    # Spans started past this number of spans in the trace are folded into
+    # summary spans per name and resource when they finish, 0 to disable.
+    _max_spans = int(get_env("trace", "max_spans_per_trace", default=0))
 
     def __init__(self, trace_id=None, span_id=None, sampling_priority=None, _dd_origin=None):
         """
@@ -36,10 +45,21 @@ class Context(object):
         :param int trace_id: trace_id of parent span
         :param int span_id: span_id of parent span
         """
-        self._trace = []
-        self._finished_spans = 0
+        # The spans of the trace that are not flushed yet by id, in the order
+        # they were added, and the first of them
+        self._spans = ordered_dict()
+        self._root_span = None
+        # The finished spans of the trace that are not flushed yet
+        self._finished_spans = []
+        # Set once a part of the trace is flushed
+        self._partially_flushed = False
         self._current_span = None
         self._lock = threading.Lock()
+        # Spans started past the span cap, by id, and the summary spans they are folded into
+        self._overflow_spans = {}
+        self._summary_spans = {}
+        # Spans started past the span cap of a trace flushed before they finished, by id
+        self._flushed_overflow_spans = {}
 
         self._parent_trace_id = trace_id
         self._parent_span_id = span_id
@@ -49,26 +69,22 @@ class Context(object):
     @property
     def trace_id(self):
         """Return current context trace_id."""
-        with self._lock:
-            return self._parent_trace_id
+        return self._parent_trace_id
 
     @property
     def span_id(self):
         """Return current context span_id."""
-        with self._lock:
-            return self._parent_span_id
+        return self._parent_span_id
 
     @property
     def sampling_priority(self):
         """Return current context sampling priority."""
-        with self._lock:
-            return self._sampling_priority
+        return self._sampling_priority
 
     @sampling_priority.setter
     def sampling_priority(self, value):
         """Set sampling priority."""
-        with self._lock:
-            self._sampling_priority = value
+        self._sampling_priority = value
 
     def clone(self):
         """
@@ -84,11 +100,16 @@ class Context(object):
             new_ctx._current_span = self._current_span
             return new_ctx
 
+    @property
+    def _trace(self):
+        """The spans of the trace that are not flushed yet, in the order they were added."""
+        return list(self._spans.values())
+
     def get_current_root_span(self):
         """
         Return the root span of the context or None if it does not exist.
         """
-        return self._trace[0] if len(self._trace) > 0 else None
+        return self._root_span
 
     def get_current_span(self):
         """
@@ -97,8 +118,7 @@ class Context(object):
         span in asynchronous environments, because some spans can be closed
         earlier while child spans still need to finish their traced execution.
         """
-        with self._lock:
-            return self._current_span
+        return self._current_span
 
     def _set_current_span(self, span):
         """
@@ -119,17 +139,51 @@ class Context(object):
         """
         with self._lock:
             self._set_current_span(span)
-
-            self._trace.append(span)
             span._context = self
 
+            parent = span._parent
+            if self._max_spans and (
+                len(self._spans) >= self._max_spans
+                # The children of a span past the cap are past the cap too, even if
+                # a partial flush made room in the trace, since it is never sent
+                or (self._overflow_spans and parent is not None and self._overflow_spans.get(id(parent)) is parent)
+            ):
+                self._overflow_spans[id(span)] = span
+                return
+            if (
+                self._flushed_overflow_spans
+                and parent is not None
+                and self._flushed_overflow_spans.get(id(parent)) is parent
+            ):
+                # The parent was dropped with its flushed trace, and so is its child
+                self._flushed_overflow_spans[id(span)] = span
+                return
+            if not self._spans:
+                self._root_span = span
+            self._spans[id(span)] = span
+
     def close_span(self, span):
         """
-        Mark a span as a finished, increasing the internal counter to prevent
-        cycles inside _trace list.
+        Mark a span as a finished, adding it to the finished spans of the trace
+        to prevent cycles inside the trace.
         """
         with self._lock:
-            self._finished_spans += 1
+            if self._overflow_spans and self._overflow_spans.pop(id(span), None) is span:
+                self._set_current_span(span._parent)
+                self._summarize_span(span)
+                return None, None
+
+            if self._flushed_overflow_spans and self._flushed_overflow_spans.pop(id(span), None) is span:
+                # The span was started past the span cap of a trace flushed before
+                # it finished, this context may hold another trace by now
+                if self._current_span is span:
+                    self._set_current_span(span._parent)
+                return None, None
+            if len(self._finished_spans) == len(self._spans):
+                # All the spans of the trace are finished, the span is not part of it
+                return None, None
+
+            self._finished_spans.append(span)
 
             # Safe-guard: prevent the last current span from being set to the parent
             # of any span but the top-level span.
@@ -139,7 +193,7 @@ class Context(object):
             # has already closed. The context will be reset but the current_span
             # will still point to that child's parent which would cause subsequent
             # spans to be parented incorrectly.
-            if self._finished_spans != len(self._trace) or span == self._trace[0]:
+            if len(self._finished_spans) != len(self._spans) or span == self._root_span:
                 self._set_current_span(span._parent)
 
             # notify if the trace is not closed properly; this check is executed only
@@ -149,71 +203,140 @@ class Context(object):
             # In asynchronous environments, it's legit to close the root span before
             # some children. On the other hand, asynchronous web frameworks still expect
             # to close the root span after all the children.
-            if span.tracer and span.tracer.log.isEnabledFor(logging.DEBUG) and span._parent is None:
+            if (
+                span._parent is None
+                and len(self._finished_spans) != len(self._spans)
+                and span.tracer
+                and span.tracer.log.isEnabledFor(logging.DEBUG)
+            ):
                 extra = {LOG_SPAN_KEY: span}
-                unfinished_spans = [x for x in self._trace if not x.finished]
-                if unfinished_spans:
-                    log.debug(
-                        'Root span "%s" closed, but the trace has %d unfinished spans:',
-                        span.name,
-                        len(unfinished_spans),
-                        extra=extra,
-                    )
-                    for wrong_span in unfinished_spans:
-                        log.debug("\n%s", wrong_span.pprint(), extra=extra)
-
-            if self._finished_spans == len(self._trace):
+                unfinished_spans = [x for x in six.itervalues(self._spans) if not x.finished]
+                log.debug(
+                    'Root span "%s" closed, but the trace has %d unfinished spans:',
+                    span.name,
+                    len(unfinished_spans),
+                    extra=extra,
+                )
+                for wrong_span in unfinished_spans:
+                    log.debug("\n%s", wrong_span.pprint(), extra=extra)
+
+            if len(self._finished_spans) == len(self._spans):
                 # get the trace
                 trace = self._trace
                 sampled = self._is_sampled()
                 sampling_priority = self._sampling_priority
-                # attach the sampling priority to the context root span
-                if sampled and sampling_priority is not None and trace:
-                    trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
-                origin = self._dd_origin
-                # attach the origin to the root span tag
-                if sampled and origin is not None and trace:
-                    trace[0].meta[ORIGIN_KEY] = str(origin)
-
-                # Set hostname tag if they requested it
-                if config.report_hostname:
-                    # DEV: `get_hostname()` value is cached
-                    trace[0].meta[HOSTNAME_KEY] = hostname.get_hostname()
+                # the trace is complete, the tail sampler can revise the sampling decision
+                # DEV: this happens before the trace is written, dropped traces are never encoded
+                tail_sampler = span.tracer._tail_sampler if span.tracer else None
+                if tail_sampler is not None:
+                    sampled, sampling_priority = tail_sampler.sample(trace, sampled, sampling_priority)
+                self._tag_chunk(trace, sampled, sampling_priority)
 
                 # clean the current state
-                self._trace = []
-                self._finished_spans = 0
+                self._spans = ordered_dict()
+                self._root_span = None
+                self._finished_spans = []
+                self._partially_flushed = False
+                if self._overflow_spans:
+                    # Drop the spans past the span cap that are still open
+                    # when they finish
+                    self._flushed_overflow_spans.update(self._overflow_spans)
+                    self._overflow_spans = {}
+                self._summary_spans = {}
                 self._parent_trace_id = None
                 self._parent_span_id = None
                 self._sampling_priority = None
                 return trace, sampled
-            elif self._partial_flush_enabled:
-                finished_spans = [t for t in self._trace if t.finished]
-                if len(finished_spans) >= self._partial_flush_min_spans:
-                    # partial flush when enabled and we have more than the minimal required spans
-                    trace = self._trace
-                    sampled = self._is_sampled()
-                    sampling_priority = self._sampling_priority
-                    # attach the sampling priority to the context root span
-                    if sampled and sampling_priority is not None and trace:
-                        trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
-                    origin = self._dd_origin
-                    # attach the origin to the root span tag
-                    if sampled and origin is not None and trace:
-                        trace[0].meta[ORIGIN_KEY] = str(origin)
-
-                    # Set hostname tag if they requested it
-                    if config.report_hostname:
-                        # DEV: `get_hostname()` value is cached
-                        trace[0].meta[HOSTNAME_KEY] = hostname.get_hostname()
-
-                    self._finished_spans = 0
-
-                    # Any open spans will remain as `self._trace`
-                    # Any finished spans will get returned to be flushed
-                    self._trace = [t for t in self._trace if not t.finished]
-                    return finished_spans, sampled
+            elif self._partial_flush_enabled and len(self._finished_spans) >= self._partial_flush_min_spans:
+                # partial flush when enabled and we have more than the minimal required spans
+                # DEV: the finished spans are collected as they are closed, the
+                #   trace is not scanned for them
+                trace = self._finished_spans
+                sampled = self._is_sampled()
+                # The sampling priority and the origin are set on the first chunk, and
+                # on the last one with the root span, not on every chunk in between
+                self._tag_chunk(trace, sampled, self._sampling_priority, sampling_tags=not self._partially_flushed)
+                self._partially_flushed = True
+
+                # Any open spans will remain in the trace
+                # Any finished spans will get returned to be flushed
+                # DEV: only the flushed spans are removed, the open spans are not visited
+                spans = self._spans
+                for t in trace:
+                    del spans[id(t)]
+                if id(self._root_span) not in spans:
+                    # The root span was flushed, the first open span takes its place
+                    self._root_span = next(six.itervalues(spans), None)
+                self._finished_spans = []
+                # Flushed summary spans must not be updated anymore
+                self._summary_spans = {}
+                return trace, sampled
             return None, None
 
+    def _summarize_span(self, span):
+        """
+        Fold a finished span started past the span cap into the summary span of
+        its name and resource.
+
+        Non-safe if not used with a lock. For internal Context usage only.
+        """
+        root = self._root_span
+        if root is None:
+            # The trace was flushed before the span finished
+            return
+
+        key = (span.name, span.resource)
+        duration_ns = span.duration_ns or 0
+        end_ns = span.start_ns + duration_ns
+        summary = self._summary_spans.get(key)
+        if summary is None:
+            summary = Span(
+                span.tracer,
+                span.name,
+                service=span.service,
+                resource=span.resource,
+                span_type=span.span_type,
+                trace_id=root.trace_id,
+                parent_id=root.span_id,
+            )
+            summary.start_ns = span.start_ns
+            summary.sampled = span.sampled
+            summary.duration_ns = 0
+            summary.set_metric(SPAN_SUMMARY_COUNT_KEY, 0)
+            summary.set_metric(SPAN_SUMMARY_DURATION_KEY, 0)
+            summary.set_metric(SPAN_SUMMARY_ERRORS_KEY, 0)
+            summary._context = self
+            summary._parent = root
+            self._summary_spans[key] = summary
+            # The summary span is finished as soon as it is created
+            self._spans[id(summary)] = summary
+            self._finished_spans.append(summary)
+
+        metrics = summary._metrics
+        metrics[SPAN_SUMMARY_COUNT_KEY] += 1
+        metrics[SPAN_SUMMARY_DURATION_KEY] += duration_ns
+        if span.error:
+            metrics[SPAN_SUMMARY_ERRORS_KEY] += 1
+            summary.error = 1
+        # The summary span covers all the spans folded into it
+        start_ns = min(summary.start_ns, span.start_ns)
+        summary.duration_ns = max(summary.start_ns + summary.duration_ns, end_ns) - start_ns
+        summary.start_ns = start_ns
+
+    def _tag_chunk(self, trace, sampled, sampling_priority, sampling_tags=True):
+        if sampling_tags:
+            # attach the sampling priority to the context root span
+            if sampled and sampling_priority is not None and trace:
+                trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
+            origin = self._dd_origin
+            # attach the origin to the root span tag
+            if sampled and origin is not None and trace:
+                trace[0].meta[ORIGIN_KEY] = str(origin)
+
+        # Set hostname tag if they requested it
+        if config.report_hostname:
+            # DEV: `get_hostname()` value is cached
+            trace[0].meta[HOSTNAME_KEY] = hostname.get_hostname()
+
     def _is_sampled(self):
-        return any(span.sampled for span in self._trace)
+        return any(span.sampled for span in six.itervalues(self._spans))
@@ -37,6 +37,10 @@ threads:
     * ``create_task(coro)``: creates a new asyncio ``Task`` that inherits the
       current active ``Context`` so that generated traces in the new task are
       attached to the main trace
+
+When the runtime metrics are enabled, the lag, the pending tasks and the slow
+callbacks of an event loop are reported once it is monitored with
+``monitor_event_loop(loop)``. See ``ddtrace.contrib.asyncio.runtime``.
 """
 from ...utils.importlib import require_modules
 
@@ -56,5 +60,13 @@ with require_modules(required_modules) as missing_modules:
 
         from .helpers import set_call_context, ensure_future, run_in_executor
         from .patch import patch
+        from .runtime import monitor_event_loop
 
-        __all__ = ["context_provider", "set_call_context", "ensure_future", "run_in_executor", "patch"]
+        __all__ = [
+            "context_provider",
+            "set_call_context",
+            "ensure_future",
+            "run_in_executor",
+            "patch",
+            "monitor_event_loop",
+        ]
@@ -3,14 +3,22 @@ import asyncio
 
 if hasattr(asyncio, "current_task"):
 
-    def asyncio_current_task():
+    def asyncio_current_task(loop=None):
         try:
-            return asyncio.current_task()
+            return asyncio.current_task(loop)
         except RuntimeError:
             return None
 
+    def asyncio_all_tasks(loop):
+        """Return the pending tasks of the loop."""
+        return asyncio.all_tasks(loop)
+
 
 else:
 
-    def asyncio_current_task():
-        return asyncio.Task.current_task()
+    def asyncio_current_task(loop=None):
+        return asyncio.Task.current_task(loop)
+
+    def asyncio_all_tasks(loop):
+        """Return the pending tasks of the loop."""
+        return {t for t in asyncio.Task.all_tasks(loop) if not t.done()}
@@ -0,0 +1,131 @@
+"""
+Runtime metrics of the asyncio event loops.
+
+An event loop blocked by a long callback delays all its tasks. Once the
+runtime metrics are enabled, the event loop is monitored with::
+
+    from ddtrace.contrib.asyncio.runtime import monitor_event_loop
+
+    monitor_event_loop(loop)
+
+The following runtime metrics are then reported:
+
+    * ``runtime.python.asyncio.loop.lag``: distribution of the delays, in
+      seconds, before the loop runs a callback scheduled by the monitor
+    * ``runtime.python.asyncio.tasks.pending``: number of pending tasks
+    * ``runtime.python.asyncio.slow_callback``: distribution of the durations,
+      in seconds, of the callbacks blocking the loop for longer than the
+      threshold, tagged with the coroutine name of the running task, if any
+"""
+import asyncio
+
+from ... import _worker
+from ... import compat
+from ...internal.logger import get_logger
+from ...internal.runtime.metric_collectors import EventLoopRuntimeMetricCollector
+from .compat import asyncio_all_tasks, asyncio_current_task
+
+log = get_logger(__name__)
+
+
+def _coroutine_name(task):
+    coro = task.get_coro() if hasattr(task, "get_coro") else task._coro
+    return getattr(coro, "__qualname__", None) or getattr(coro, "__name__", None) or type(coro).__name__
+
+
+class EventLoopMonitor(_worker.PeriodicWorkerThread):
+    """Monitor of the responsiveness of an asyncio event loop
+
+    Every ``interval`` seconds, the monitor thread schedules a callback in the
+    loop, and the delay until the loop runs it is the lag of the loop. While
+    the callback has not run for more than ``slow_callback_threshold``
+    seconds, the loop is blocked and the coroutine of its running task is
+    captured.
+
+    The pending tasks are counted in the loop once per flush of the metrics.
+    """
+
+    # Maximum number of lags and slow callbacks kept between two flushes
+    MAX_VALUES = 1000
+
+    def __init__(self, loop, interval=0.1, slow_callback_threshold=0.1):
+        super(EventLoopMonitor, self).__init__(interval=interval, name=self.__class__.__name__)
+        self._loop = loop
+        self._threshold_ns = int(slow_callback_threshold * 1e9)
+        self._sent_ns = None
+        self._blocking = None
+        self._count_tasks = True
+        self._pending_tasks = 0
+        self._lags = []
+        self._slow_callbacks = []
+
+    def _ping(self, sent_ns):
+        """Callback run in the loop"""
+        if sent_ns != self._sent_ns:
+            # Scheduled before the loop was stopped
+            return
+        lag_ns = compat.monotonic_ns() - sent_ns
+        if len(self._lags) < self.MAX_VALUES:
+            self._lags.append(lag_ns)
+        blocking = self._blocking
+        if blocking is not None and lag_ns >= self._threshold_ns and len(self._slow_callbacks) < self.MAX_VALUES:
+            self._slow_callbacks.append((lag_ns, blocking))
+        if self._count_tasks:
+            self._count_tasks = False
+            self._pending_tasks = len(asyncio_all_tasks(self._loop))
+        self._sent_ns = None
+
+    def run_periodic(self):
+        if not self._loop.is_running():
+            # The time the loop is stopped is not a lag
+            self._sent_ns = None
+            if self._loop.is_closed():
+                log.debug("stopping the monitor of the closed event loop %r", self._loop)
+                self.stop()
+            return
+
+        now = compat.monotonic_ns()
+        sent_ns = self._sent_ns
+        if sent_ns is None:
+            self._blocking = None
+            self._sent_ns = now
+            try:
+                self._loop.call_soon_threadsafe(self._ping, now)
+            except RuntimeError:
+                # The loop was closed in the meantime
+                self._sent_ns = None
+        elif self._blocking is None and now - sent_ns >= self._threshold_ns:
+            # The callback blocking the loop may not belong to a task
+            task = asyncio_current_task(self._loop)
+            self._blocking = _coroutine_name(task) if task is not None else ""
+
+    def on_shutdown(self):
+        EventLoopRuntimeMetricCollector.unregister(self)
+
+    def flush(self):
+        """Return the lags and the slow callbacks since the last flush, and the number of pending tasks."""
+        lags, self._lags = self._lags, []
+        slow_callbacks, self._slow_callbacks = self._slow_callbacks, []
+        self._count_tasks = True
+        return lags, self._pending_tasks, slow_callbacks
+
+    def __repr__(self):
+        return "{}(loop={!r}, interval={}, slow_callback_threshold={})".format(
+            self.__class__.__name__, self._loop, self.interval, self._threshold_ns / 1e9
+        )
+
+
+def monitor_event_loop(loop=None, interval=0.1, slow_callback_threshold=0.1):
+    """Report the runtime metrics of an event loop until it is closed.
+
+    :param loop: The event loop, the current event loop by default.
+    :param float interval: The interval in seconds between two measures of the lag of the loop.
+    :param float slow_callback_threshold: The duration in seconds from which a callback is reported as slow.
+    :returns: The monitor of the loop, which can be stopped with ``stop()``.
+    """
+    monitor = EventLoopMonitor(
+        loop or asyncio.get_event_loop(), interval=interval, slow_callback_threshold=slow_callback_threshold
+    )
+    EventLoopRuntimeMetricCollector.register(monitor)
+    monitor.start()
+    return monitor
@@ -1,7 +1,7 @@
 import json
 
 from .internal.logger import get_logger
-from .internal._encoding import MsgpackEncoder
+from .internal._encoding import BufferedEncoder, BufferedEncoderV05, MsgpackEncoder  # noqa: F401
 
 
 log = get_logger(__name__)
@@ -1,9 +1,114 @@
 import re
 
 from .ext import http
+from .vendor import six
 
 
-class FilterRequestsOnUrl(object):
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2: keep a bounded cache that is emptied once full.
+    def lru_cache(maxsize):
+        def w(f):
+            cache = {}
+
+            def cached(key):
+                try:
+                    return cache[key]
+                except KeyError:
+                    pass
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[key] = f(key)
+                return result
+
+            return cached
+
+        return w
+
+
+class TraceFilter(object):
+    """Base class for trace filters.
+
+    A filter is a stage of the trace processing pipeline. By default, filters
+    are run inline, by the thread that finishes the trace. Filters that do
+    not need to run inline (e.g. tag scrubbing or enrichment) can set
+    ``deferred`` to ``True`` to be run by the writer on its background thread,
+    on whole batches of traces. Deferred filters always run after the inline
+    ones. Filters that make decisions that must be known when the trace
+    finishes (e.g. dropping traces) should run inline.
+    """
+
+    deferred = False
+
+    def process_trace(self, trace):
+        """Process a trace (list of spans).
+
+        Return the trace to be fed to the next filter, or ``None`` to discard
+        the trace.
+        """
+        raise NotImplementedError
+
+    def process_traces(self, traces):
+        """Process a batch of traces.
+
+        Return the list of traces to be fed to the next filter. Discarded
+        traces are removed from the list.
+        """
+        processed = []
+        for trace in traces:
+            trace = self.process_trace(trace)
+            if trace:
+                processed.append(trace)
+        return processed
+
+
+class _RegexpMatcher(object):
+    """Match strings against a list of regular expressions in a single pass.
+
+    The patterns are combined into a single alternation so that a string is
+    scanned once whatever the number of patterns. Patterns that cannot be
+    combined safely (i.e. those with groups, which could be referred to by
+    number, or with flags) are tried one after the other. The most recent
+    results are cached.
+    """
+
+    _DEFAULT_FLAGS = re.compile("").flags
+
+    def __init__(self, regexps, cache_size=1024):
+        if isinstance(regexps, six.string_types):
+            regexps = [regexps]
+        self._regexps = [re.compile(regexp) for regexp in regexps]
+
+        combined = []
+        self._fallback = []
+        for regexp in self._regexps:
+            if regexp.groups or regexp.flags != self._DEFAULT_FLAGS:
+                self._fallback.append(regexp)
+            else:
+                combined.append("(?:%s)" % regexp.pattern)
+        self._combined = re.compile("|".join(combined)) if combined else None
+
+        self.match = lru_cache(maxsize=cache_size)(self._match) if cache_size else self._match
+
+    def _match(self, value):
+        if self._combined is not None and self._combined.match(value):
+            return True
+        for regexp in self._fallback:
+            if regexp.match(value):
+                return True
+        return False
+
+
+def _root_span(trace):
+    # The root span is most likely the first span of the trace
+    for span in trace:
+        if span.parent_id is None:
+            return span
+    return None
+
+
+class FilterRequestsOnUrl(TraceFilter):
     r"""Filter out traces from incoming http requests based on the request's url.
 
     This class takes as argument a list of regular expression patterns
@@ -12,8 +117,12 @@ class FilterRequestsOnUrl(object):
     the provided regular expression using the standard python regexp match
     semantic (https://docs.python.org/2/library/re.html#re.match).
 
+    The regular expressions are combined and matched in a single pass, and the
+    decisions for the most recent urls are cached.
+
     :param list regexps: a list of regular expressions (or a single string) defining
                          the urls that should be filtered out.
+    :param int cache_size: the number of url decisions to cache, 0 to disable the cache.
 
     Examples:
     To filter out http calls to domain api.example.com::
@@ -29,10 +138,12 @@ class FilterRequestsOnUrl(object):
         FilterRequestOnUrl([r'http://test\\.example\\.com', r'http://example\\.com/healthcheck'])
     """
 
-    def __init__(self, regexps):
-        if isinstance(regexps, str):
-            regexps = [regexps]
-        self._regexps = [re.compile(regexp) for regexp in regexps]
+    def __init__(self, regexps, cache_size=1024):
+        self._matcher = _RegexpMatcher(regexps, cache_size=cache_size)
+
+    @property
+    def _regexps(self):
+        return self._matcher._regexps
 
     def process_trace(self, trace):
         """
@@ -41,10 +152,47 @@ class FilterRequestsOnUrl(object):
         be fed to the next filter in the list. If process_trace returns None,
         the whole trace is discarded.
         """
-        for span in trace:
-            if span.parent_id is None and span.get_tag(http.URL) is not None:
-                url = span.get_tag(http.URL)
-                for regexp in self._regexps:
-                    if regexp.match(url):
-                        return None
+        root = _root_span(trace)
+        if root is not None:
+            url = root.get_tag(http.URL)
+            if url is not None and self._matcher.match(url):
+                return None
+        return trace
+
+
+class FilterRequestsOnResource(TraceFilter):
+    r"""Filter out traces based on the resource or the name of their root span.
+
+    A trace will be excluded if the resource of its root span matches any of
+    the ``resources`` regular expressions, or if the name of its root span
+    matches any of the ``names`` regular expressions, using the standard python
+    regexp match semantic.
+
+    :param list resources: a list of regular expressions (or a single string) defining
+                           the resources that should be filtered out.
+    :param list names: a list of regular expressions (or a single string) defining
+                       the span names that should be filtered out.
+    :param int cache_size: the number of decisions to cache, 0 to disable the cache.
+
+    Examples:
+    To filter out health checks handled by any web framework::
+
+        FilterRequestsOnResource(resources=r'GET /health')
+
+    To filter out all the traces of a background job::
+
+        FilterRequestsOnResource(names=r'celery\\.run', resources=r'tasks\\.cleanup')
+    """
+
+    def __init__(self, resources=None, names=None, cache_size=1024):
+        self._resources = _RegexpMatcher(resources or [], cache_size=cache_size)
+        self._names = _RegexpMatcher(names or [], cache_size=cache_size)
+
+    def process_trace(self, trace):
+        root = _root_span(trace)
+        if root is not None:
+            if root.resource is not None and self._resources.match(root.resource):
+                return None
+            if root.name is not None and self._names.match(root.name):
+                return None
         return trace
@@ -1,8 +1,12 @@
 from cpython cimport *
 from cpython.bytearray cimport PyByteArray_Check
+from cpython.pythread cimport PyThread_get_thread_ident
+from libc.string cimport memcpy
 import struct
+import threading
 
 from ..span import Span
+from .buffer import BufferFull, BufferItemTooLarge
 
 
 cdef extern from "Python.h":
@@ -24,7 +28,9 @@ cdef extern from "pack.h":
     int msgpack_pack_map(msgpack_packer* pk, size_t l)
     int msgpack_pack_raw(msgpack_packer* pk, size_t l)
     int msgpack_pack_raw_body(msgpack_packer* pk, char* body, size_t l)
+    int msgpack_pack_bin(msgpack_packer* pk, size_t l)
     int msgpack_pack_unicode(msgpack_packer* pk, object o, long long limit)
+    int msgpack_pack_write(msgpack_packer* pk, const char *data, size_t l)
 
 cdef extern from "buff_converter.h":
     object buff_to_buff(char *, Py_ssize_t)
@@ -32,6 +38,17 @@ cdef extern from "buff_converter.h":
 
 cdef long long ITEM_LIMIT = (2**32)-1
 
+# Initial size of the packer buffer. The buffer grows on demand while packing
+# and is shrunk back to this size once a payload larger than
+# MAX_RETAINED_BUFFER_SIZE has been packed, so that a single large trace does
+# not pin memory for the lifetime of the packer.
+cdef size_t INITIAL_BUFFER_SIZE = 64 * 1024
+cdef size_t MAX_RETAINED_BUFFER_SIZE = 1024 * 1024
+
+# Space reserved at the beginning of a payload buffer for the msgpack array
+# header, which can only be written once the number of traces is known.
+cdef size_t ARRAY_HEADER_MAX_SIZE = 5
+
 
 cdef inline int PyBytesLike_Check(object o):
     return PyBytes_Check(o) or PyByteArray_Check(o)
@@ -61,26 +78,30 @@ cdef class Packer(object):
     :param callable default:
         Convert user type to builtin type that Packer supports.
         See also simplejson's document.
+    :param bool use_bin_type:
+        Use bin type introduced in msgpack spec 2.0 for bytes.
+        Bytes are packed as raw strings otherwise.
     """
     cdef msgpack_packer pk
     cdef object _default
+    cdef bint use_bin_type
     cdef object _berrors
     cdef const char *encoding
     cdef const char *unicode_errors
 
     def __cinit__(self):
-        cdef int buf_size = 1024*1024
-        self.pk.buf = <char*> PyMem_Malloc(buf_size)
+        self.pk.buf = <char*> PyMem_Malloc(INITIAL_BUFFER_SIZE)
         if self.pk.buf == NULL:
             raise MemoryError("Unable to allocate internal buffer.")
-        self.pk.buf_size = buf_size
+        self.pk.buf_size = INITIAL_BUFFER_SIZE
         self.pk.length = 0
 
-    def __init__(self, default=None):
+    def __init__(self, default=None, use_bin_type=False):
         if default is not None:
             if not PyCallable_Check(default):
                 raise TypeError("default must be a callable.")
         self._default = default
+        self.use_bin_type = use_bin_type
 
         if PY_MAJOR_VERSION < 3:
             self.encoding = "utf-8"
@@ -136,7 +157,10 @@ cdef class Packer(object):
                 if L > ITEM_LIMIT:
                     PyErr_Format(ValueError, b"%.200s object is too large", Py_TYPE(o).tp_name)
                 rawval = o
-                ret = msgpack_pack_raw(&self.pk, L)
+                if self.use_bin_type:
+                    ret = msgpack_pack_bin(&self.pk, L)
+                else:
+                    ret = msgpack_pack_raw(&self.pk, L)
                 if ret == 0:
                     ret = msgpack_pack_raw_body(&self.pk, rawval, L)
             elif PyUnicode_Check(o):
@@ -189,8 +213,10 @@ cdef class Packer(object):
 
             elif isinstance(o, Span):
                 has_span_type = <bint>(o.span_type is not None)
-                has_meta = <bint>(len(o.meta) > 0)
-                has_metrics = <bint>(len(o.metrics) > 0)
+                # DEV: read the underlying attributes to avoid allocating
+                # the dicts of spans without tags
+                has_meta = <bint>(o._meta is not None and len(o._meta) > 0)
+                has_metrics = <bint>(o._metrics is not None and len(o._metrics) > 0)
 
                 L = 12 - (1 - has_span_type) - (1 - has_meta) - (1 - has_metrics)
 
@@ -251,13 +277,13 @@ cdef class Packer(object):
                     if has_meta:
                         ret = pack_bytes(&self.pk, <char *>b"meta", 4)
                         if ret != 0: return ret
-                        ret = self._pack(o.meta)
+                        ret = self._pack(o._meta)
                         if ret != 0: return ret
 
                     if has_metrics:
                         ret = pack_bytes(&self.pk, <char *>b"metrics", 7)
                         if ret != 0: return ret
-                        ret = self._pack(o.metrics)
+                        ret = self._pack(o._metrics)
                         if ret != 0: return ret
             else:
                 PyErr_Format(TypeError, b"can not serialize '%.200s' object", Py_TYPE(o).tp_name)
@@ -267,17 +293,44 @@ cdef class Packer(object):
         cdef int ret
         try:
             ret = self._pack(obj)
-        except:
+            if ret:  # should not happen.
+                raise RuntimeError("internal error")
+            return PyBytes_FromStringAndSize(self.pk.buf, self.pk.length)
+        finally:
+            # Reset the buffer, also on errors since the packer is reused.
             self.pk.length = 0
-            raise
-        if ret:  # should not happen.
-            raise RuntimeError("internal error")
-
-        # Reset the buffer.
-        buf = PyBytes_FromStringAndSize(self.pk.buf, self.pk.length)
+            self._shrink()
+
+    cdef _shrink(self):
+        """Give back the memory acquired to pack a large object."""
+        cdef char* new_buf
+        if self.pk.buf_size <= MAX_RETAINED_BUFFER_SIZE:
+            return
+        new_buf = <char*> PyMem_Realloc(self.pk.buf, INITIAL_BUFFER_SIZE)
+        if new_buf == NULL:
+            # Keep using the current buffer, it is still valid.
+            return
+        self.pk.buf = new_buf
+        self.pk.buf_size = INITIAL_BUFFER_SIZE
+
+    cdef char* _detach_buffer(self) except NULL:
+        """Transfer the ownership of the internal buffer to the caller.
+
+        A new buffer is allocated for the packer.
+        """
+        cdef char* buf = <char*> PyMem_Malloc(INITIAL_BUFFER_SIZE)
+        if buf == NULL:
+            raise MemoryError("Unable to allocate internal buffer.")
+        buf, self.pk.buf = self.pk.buf, buf
+        self.pk.buf_size = INITIAL_BUFFER_SIZE
         self.pk.length = 0
         return buf
 
+    @property
+    def buffer_size(self):
+        """Return the size of the internal buffer."""
+        return self.pk.buf_size
+
     def bytes(self):
         """Return internal buffer contents as bytes object"""
         return PyBytes_FromStringAndSize(self.pk.buf, self.pk.length)
@@ -290,6 +343,20 @@ cdef class Packer(object):
 cdef class MsgpackEncoder(object):
     content_type = "application/msgpack"
 
+    # Packers are not thread-safe: keep one per thread and reuse it across
+    # calls instead of allocating a new buffer for every trace.
+    cdef object _packers
+
+    def __cinit__(self):
+        self._packers = threading.local()
+
+    cdef Packer _get_packer(self):
+        try:
+            return self._packers.packer
+        except AttributeError:
+            packer = self._packers.packer = Packer()
+            return packer
+
     cpdef _decode(self, data):
         import msgpack
         if msgpack.version[:2] < (0, 6):
@@ -297,10 +364,10 @@ cdef class MsgpackEncoder(object):
         return msgpack.unpackb(data, raw=True)
 
     cpdef encode_trace(self, list trace):
-        return Packer().pack(trace)
+        return self._get_packer().pack(trace)
 
     cpdef encode_traces(self, traces):
-        return Packer().pack(traces)
+        return self._get_packer().pack(traces)
 
     cpdef join_encoded(self, objs):
         """Join a list of encoded objects together as a msgpack array"""
@@ -314,3 +381,458 @@ cdef class MsgpackEncoder(object):
             return struct.pack(">BH", 0xdc, count) + buf
         else:
             return struct.pack(">BI", 0xdd, count) + buf
+
+
+cdef class _EncodedPayload(object):
+    """Read-only view over a sealed payload buffer.
+
+    The payload owns the underlying memory, which is released when the last
+    reference to the payload (or to a memoryview of it) goes away.
+    """
+    cdef char* _buf
+    cdef char* _data
+    cdef Py_ssize_t _length
+
+    def __dealloc__(self):
+        PyMem_Free(self._buf)
+        self._buf = NULL
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self._data, self._length, 1, flags)
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    def __len__(self):
+        return self._length
+
+
+cdef int write_array_header(char* buf, size_t count):
+    """Write a msgpack array header at the end of a slot of
+    ARRAY_HEADER_MAX_SIZE bytes.
+
+    Return the offset of the beginning of the header in the slot.
+    """
+    cdef unsigned char* hdr = <unsigned char*> buf
+    if count <= 0xf:
+        hdr[4] = 0x90 + count
+        return 4
+    elif count <= 0xffff:
+        hdr[2] = 0xdc
+        hdr[3] = (count >> 8) & 0xff
+        hdr[4] = count & 0xff
+        return 2
+    else:
+        hdr[0] = 0xdd
+        hdr[1] = (count >> 24) & 0xff
+        hdr[2] = (count >> 16) & 0xff
+        hdr[3] = (count >> 8) & 0xff
+        hdr[4] = count & 0xff
+        return 0
+
+
+cdef _EncodedPayload make_payload(Packer packer, size_t offset):
+    """Seal the content of the packer buffer from ``offset`` into a payload."""
+    cdef _EncodedPayload payload = _EncodedPayload()
+    cdef size_t length = packer.pk.length
+    payload._buf = packer._detach_buffer()
+    payload._data = payload._buf + offset
+    payload._length = length - offset
+    return payload
+
+
+cdef class _Shard(object):
+    """A segment of a payload buffer, with its own lock."""
+    cdef Packer packer
+    cdef object lock
+    cdef Py_ssize_t count
+    cdef size_t saved_length
+
+    def __cinit__(self):
+        self.packer = Packer()
+        self.packer.pk.length = ARRAY_HEADER_MAX_SIZE
+        self.lock = threading.Lock()
+        self.count = 0
+
+    cdef size_t size(self):
+        return self.packer.pk.length - ARRAY_HEADER_MAX_SIZE
+
+
+cdef class BufferedEncoder(object):
+    """Encode traces directly into a growable payload buffer.
+
+    Traces are appended to the payload in place as they are put in the
+    buffer. The msgpack array header is written when the payload is sealed
+    by :meth:`encode`, which hands over the buffer without copying it.
+
+    The payload is a msgpack array of traces, as expected by the v0.3 and
+    v0.4 trace endpoints of the agent.
+
+    The buffer can be split in shards to reduce the contention between
+    threads putting traces concurrently: each thread encodes its traces in
+    the shard selected by its identifier. The size of the payload is
+    accounted for globally. Shards are concatenated when the payload is
+    sealed, which copies all of them but the first one.
+
+    :param max_size: The maximum size (in bytes) of the payload.
+    :param max_item_size: The maximum size of any encoded trace. It is
+        necessary to have an item limit as traces cannot be divided across
+        trace payloads.
+    :param shards: The number of shards of the buffer.
+    """
+    content_type = "application/msgpack"
+
+    cdef readonly size_t max_size
+    cdef readonly size_t max_item_size
+    cdef size_t _size
+    cdef Py_ssize_t _count
+    cdef list _shards
+    cdef size_t _n_shards
+    # Serializes the creation of shards and the sealing of payloads
+    cdef object _lock
+
+    def __cinit__(self, size_t max_size, size_t max_item_size, size_t shards=1):
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self._size = 0
+        self._count = 0
+        self._n_shards = max(shards, 1)
+        # Shards are created lazily by the threads using them
+        self._shards = [None] * self._n_shards
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of traces in the payload."""
+        return self._count
+
+    @property
+    def size(self):
+        """Return the size in bytes of the encoded traces."""
+        return self._size
+
+    @property
+    def shards(self):
+        """Return the number of shards of the buffer."""
+        return self._n_shards
+
+    cdef _Shard _get_shard(self):
+        cdef unsigned long long ident = PyThread_get_thread_ident()
+        # Thread identifiers are usually aligned addresses: mix the bits to
+        # spread threads across shards.
+        cdef size_t i = ((ident * <unsigned long long> 0x9E3779B97F4A7C15) >> 32) % self._n_shards
+        shard = self._shards[i]
+        if shard is None:
+            with self._lock:
+                shard = self._shards[i]
+                if shard is None:
+                    shard = self._shards[i] = _Shard()
+        return shard
+
+    cdef _save(self, _Shard shard):
+        shard.saved_length = shard.packer.pk.length
+
+    cdef _restore(self, _Shard shard):
+        shard.packer.pk.length = shard.saved_length
+
+    cdef int _pack_trace(self, _Shard shard, list trace) except -1:
+        return shard.packer._pack(trace)
+
+    cdef size_t _encode_trace(self, _Shard shard, list trace) except? 0:
+        """Encode a trace at the end of the shard and return its size."""
+        cdef size_t length = shard.packer.pk.length
+        cdef int ret
+
+        self._save(shard)
+        try:
+            ret = self._pack_trace(shard, trace)
+        except Exception:
+            self._restore(shard)
+            raise
+        if ret:  # should not happen.
+            self._restore(shard)
+            raise RuntimeError("internal error")
+        return shard.packer.pk.length - length
+
+    cpdef put(self, list trace):
+        """Encode a trace (list of spans) at the end of the payload.
+
+        :raises BufferItemTooLarge: if the encoded trace is larger than
+            ``max_item_size`` or ``max_size``. The exception argument is the
+            size of the encoded trace.
+        :raises BufferFull: if the encoded trace does not fit in the payload.
+            The exception argument is the size of the encoded trace.
+        """
+        cdef _Shard shard = self._get_shard()
+        cdef size_t item_len
+
+        with shard.lock:
+            item_len = self._encode_trace(shard, trace)
+            if item_len > self.max_item_size or item_len > self.max_size:
+                self._restore(shard)
+                raise BufferItemTooLarge(item_len)
+            # The global size is updated atomically since the GIL is held and
+            # no Python code is run between the check and the update.
+            if self._size + item_len > self.max_size:
+                self._restore(shard)
+                raise BufferFull(item_len)
+            self._size += item_len
+            self._count += 1
+            shard.count += 1
+
+    cdef _EncodedPayload _drain(self, _Shard shard):
+        """Detach the encoded traces of a shard and reset it."""
+        cdef _EncodedPayload payload = make_payload(shard.packer, ARRAY_HEADER_MAX_SIZE)
+        shard.packer.pk.length = ARRAY_HEADER_MAX_SIZE
+        self._size -= payload._length
+        self._count -= shard.count
+        shard.count = 0
+        return payload
+
+    cdef tuple _seal(self):
+        """Drain all the shards in a single pass and concatenate them into a
+        payload.
+
+        Return the payload and the number of traces it contains.
+        """
+        cdef _EncodedPayload payload = None
+        cdef _EncodedPayload other
+        cdef _Shard shard
+        cdef list others = []
+        cdef size_t count = 0
+        cdef size_t length
+        cdef char* buf
+        cdef int offset
+
+        for shard in self._shards:
+            if shard is None:
+                continue
+            with shard.lock:
+                if shard.count == 0:
+                    continue
+                count += shard.count
+                if payload is None:
+                    payload = self._drain(shard)
+                else:
+                    others.append(self._drain(shard))
+
+        if payload is None:
+            return None, 0
+
+        if others:
+            length = payload._length
+            for other in others:
+                length += other._length
+            buf = <char*> PyMem_Realloc(payload._buf, ARRAY_HEADER_MAX_SIZE + length)
+            if buf == NULL:
+                raise MemoryError("Unable to allocate payload buffer.")
+            payload._buf = buf
+            length = ARRAY_HEADER_MAX_SIZE + payload._length
+            for other in others:
+                memcpy(buf + length, other._data, other._length)
+                length += other._length
+            payload._length = length - ARRAY_HEADER_MAX_SIZE
+
+        offset = write_array_header(payload._buf, count)
+        payload._data = payload._buf + offset
+        payload._length += ARRAY_HEADER_MAX_SIZE - offset
+        return payload, count
+
+    cpdef encode(self):
+        """Seal the payload and reset the buffer.
+
+        Return a tuple with a read-only memoryview of the payload and the
+        number of traces it contains, or ``(None, 0)`` if the buffer is empty.
+        """
+        with self._lock:
+            if self._count == 0:
+                return None, 0
+            payload, count = self._seal()
+
+        if payload is None:
+            return None, 0
+        return memoryview(payload), count
+
+
+cdef class BufferedEncoderV05(BufferedEncoder):
+    """Encode traces in the v0.5 format of the agent trace endpoint.
+
+    Strings are deduplicated in a string table that is sent along with the
+    traces, and spans are encoded as arrays of fixed length where strings are
+    replaced by their index in the string table::
+
+        [
+            [string, ...],
+            [[[service, name, resource, trace_id, span_id, parent_id, start,
+               duration, error, {meta}, {metrics}, type], ...], ...],
+        ]
+
+    The string table is built in its own buffer while traces are encoded.
+    When the payload is sealed, the traces are appended to the string table
+    buffer, which is handed over as the payload.
+
+    The string table is shared by all the traces of the payload, so the
+    buffer is never sharded.
+    """
+    # The string table buffer starts with a slot for the payload header (a
+    # fixed array of 2 elements) and the string table array header.
+    cdef _Shard _shard
+    cdef Packer _packer
+    cdef Packer _st_packer
+    cdef dict _string_table
+    cdef list _strings
+    cdef size_t _saved_st_length
+    cdef Py_ssize_t _saved_n_strings
+
+    def __cinit__(self, *args, **kwargs):
+        self._shard = _Shard()
+        self._packer = self._shard.packer
+        self._shards = [self._shard]
+        self._n_shards = 1
+        self._st_packer = Packer()
+        self._string_table = {}
+        self._strings = []
+        self._reset_string_table()
+
+    cdef _reset_string_table(self):
+        self._st_packer.pk.length = 1 + ARRAY_HEADER_MAX_SIZE
+        self._string_table.clear()
+        del self._strings[:]
+        # The empty string always has index 0
+        self._add_string("")
+
+    cdef _Shard _get_shard(self):
+        return self._shard
+
+    cdef _save(self, _Shard shard):
+        BufferedEncoder._save(self, shard)
+        self._saved_st_length = self._st_packer.pk.length
+        self._saved_n_strings = len(self._strings)
+
+    cdef _restore(self, _Shard shard):
+        BufferedEncoder._restore(self, shard)
+        self._st_packer.pk.length = self._saved_st_length
+        while len(self._strings) > self._saved_n_strings:
+            del self._string_table[self._strings.pop()]
+
+    cdef size_t _encode_trace(self, _Shard shard, list trace) except? 0:
+        # Strings added to the string table count toward the size of the trace
+        cdef size_t st_length = self._st_packer.pk.length
+        cdef size_t item_len = BufferedEncoder._encode_trace(self, shard, trace)
+        return item_len + self._st_packer.pk.length - st_length
+
+    cdef Py_ssize_t _add_string(self, object s) except -1:
+        cdef Py_ssize_t i = len(self._strings)
+        self._st_packer._pack(s)
+        self._strings.append(s)
+        self._string_table[s] = i
+        return i
+
+    cdef int _pack_string(self, object s) except -1:
+        cdef Py_ssize_t i
+        if s is None:
+            i = 0
+        else:
+            if not PyUnicode_Check(s) and not PyBytesLike_Check(s):
+                s = str(s)
+            index = self._string_table.get(s)
+            if index is None:
+                i = self._add_string(s)
+            else:
+                i = index
+        return msgpack_pack_long(&self._packer.pk, i)
+
+    cdef int _pack_span(self, object span) except -1:
+        cdef msgpack_packer* pk = &self._packer.pk
+        cdef dict d
+        cdef int ret
+
+        if not isinstance(span, Span):
+            PyErr_Format(TypeError, b"can not serialize '%.200s' object", Py_TYPE(span).tp_name)
+
+        ret = msgpack_pack_array(pk, 12)
+        if ret != 0: return ret
+
+        ret = self._pack_string(span.service)
+        if ret != 0: return ret
+        ret = self._pack_string(span.name)
+        if ret != 0: return ret
+        ret = self._pack_string(span.resource)
+        if ret != 0: return ret
+
+        ret = self._packer._pack(span.trace_id)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.span_id)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.parent_id or 0)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.start_ns)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.duration_ns)
+        if ret != 0: return ret
+        ret = msgpack_pack_long(pk, 1 if span.error else 0)
+        if ret != 0: return ret
+
+        d = span._meta or {}
+        ret = msgpack_pack_map(pk, len(d))
+        if ret != 0: return ret
+        for k, v in d.items():
+            ret = self._pack_string(k)
+            if ret != 0: return ret
+            ret = self._pack_string(v)
+            if ret != 0: return ret
+
+        d = span._metrics or {}
+        ret = msgpack_pack_map(pk, len(d))
+        if ret != 0: return ret
+        for k, v in d.items():
+            ret = self._pack_string(k)
+            if ret != 0: return ret
+            ret = self._packer._pack(v)
+            if ret != 0: return ret
+
+        return self._pack_string(span.span_type)
+
+    cdef int _pack_trace(self, _Shard shard, list trace) except -1:
+        cdef int ret
+        cdef Py_ssize_t L = len(trace)
+        if L > ITEM_LIMIT:
+            raise ValueError("list is too large")
+
+        ret = msgpack_pack_array(&self._packer.pk, L)
+        if ret != 0: return ret
+        for span in trace:
+            ret = self._pack_span(span)
+            if ret != 0: return ret
+        return 0
+
+    cdef tuple _seal(self):
+        cdef msgpack_packer* st = &self._st_packer.pk
+        cdef _EncodedPayload payload
+        cdef size_t count
+        cdef int offset
+        cdef int ret
+
+        with self._shard.lock:
+            count = self._shard.count
+            if count == 0:
+                return None, 0
+
+            offset = 1 + write_array_header(st.buf + 1, len(self._strings))
+            # Payload header: [string_table, traces]
+            offset -= 1
+            st.buf[offset] = <char> 0x92
+
+            ret = msgpack_pack_array(st, count)
+            if ret == 0:
+                ret = msgpack_pack_write(st, self._packer.pk.buf + ARRAY_HEADER_MAX_SIZE, self._shard.size())
+            if ret != 0:
+                raise MemoryError("Unable to allocate payload buffer.")
+            payload = make_payload(self._st_packer, offset)
+
+            self._packer.pk.length = ARRAY_HEADER_MAX_SIZE
+            self._shard.count = 0
+            self._size = 0
+            self._count = 0
+            self._reset_string_table()
+
+        return payload, count
@@ -0,0 +1,131 @@
+"""Aggregation of the tracer health metrics
+
+The DogStatsd client sends a datagram per metric, and its buffering is not
+thread-safe (https://github.com/DataDog/datadogpy/issues/439). The metrics are
+aggregated here between flushes instead, formatted in the DogStatsD datagram
+format, and then packed into as few datagrams as the maximum payload size of
+the transport allows and sent with the socket of the client.
+"""
+import os
+import threading
+
+from ..vendor import six
+from ..vendor.dogstatsd.base import UDP_OPTIMAL_PAYLOAD_LENGTH
+from ..vendor.dogstatsd.base import UDS_OPTIMAL_PAYLOAD_LENGTH
+from ..vendor.dogstatsd.format import normalize_tags
+from .logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class MetricsAggregator(object):
+    """Thread-safe aggregator of metrics sent with a DogStatsd client
+
+    Counters are summed, the last value of gauges is kept and every value of
+    distributions is kept, by metric name and tags. The metrics are serialized
+    by the client and sent by ``flush``.
+    """
+
+    COUNT = "c"
+    GAUGE = "g"
+    DISTRIBUTION = "d"
+
+    def __init__(self, statsd_client, max_payload_size=None):
+        self.statsd_client = statsd_client
+        if max_payload_size is None:
+            max_payload_size = (
+                UDS_OPTIMAL_PAYLOAD_LENGTH if statsd_client.socket_path is not None else UDP_OPTIMAL_PAYLOAD_LENGTH
+            )
+        self.max_payload_size = max_payload_size
+        # Like the client, do not send anything when DogStatsD is disabled
+        self._enabled = os.environ.get("DD_DOGSTATSD_DISABLE") not in ("True", "true", "yes", "1")
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._counts = {}
+        self._gauges = {}
+        self._distributions = {}
+
+    def increment(self, metric, value=1, tags=None):
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + value
+
+    def gauge(self, metric, value, tags=None):
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            self._gauges[key] = value
+
+    def distribution(self, metric, value, tags=None):
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            values = self._distributions.get(key)
+            if values is None:
+                self._distributions[key] = [value]
+            else:
+                values.append(value)
+
+    def _format(self, metric_type, metric, value, tags):
+        client = self.statsd_client
+        tags = list(tags) + client.constant_tags if client.constant_tags else tags
+        return "%s%s:%s|%s%s" % (
+            (client.namespace + ".") if client.namespace else "",
+            metric,
+            value,
+            metric_type,
+            ("|#" + ",".join(normalize_tags(tags))) if tags else "",
+        )
+
+    def _serialize(self, counts, gauges, distributions):
+        metrics = [(self.COUNT, key, value) for key, value in six.iteritems(counts)]
+        metrics.extend((self.GAUGE, key, value) for key, value in six.iteritems(gauges))
+        metrics.extend(
+            (self.DISTRIBUTION, key, value) for key, values in six.iteritems(distributions) for value in values
+        )
+        for metric_type, (metric, tags), value in metrics:
+            yield self._format(metric_type, metric, value, tags)
+
+    def _packets(self, lines):
+        """Pack the lines into packets of at most ``max_payload_size`` bytes.
+
+        A line larger than the maximum payload size is sent on its own.
+        """
+        max_size = self.max_payload_size
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) > max_size:
+                yield "\n".join(packet)
+                packet = []
+                size = 0
+            packet.append(line)
+            # Include the line break separating the lines
+            size += len(line) + 1
+        if packet:
+            yield "\n".join(packet)
+
+    def flush(self):
+        """Send the metrics aggregated since the last flush."""
+        with self._lock:
+            counts, gauges, distributions = self._counts, self._gauges, self._distributions
+            self._reset()
+
+        if not (counts or gauges or distributions) or not self._enabled:
+            return
+
+        for packet in self._packets(self._serialize(counts, gauges, distributions)):
+            self._send(packet)
+
+    def _send(self, packet):
+        client = self.statsd_client
+        try:
+            client.get_socket().send(packet.encode(client.encoding))
+        except Exception:
+            # The packet is dropped, like the client does, and the socket is opened again for the next one
+            log.debug("failed to send metrics packet", exc_info=True)
+            client.close_socket()
+
+    def __repr__(self):
+        return "{}(statsd_client={!r})".format(self.__class__.__name__, self.statsd_client)
@@ -1,4 +1,5 @@
 from __future__ import division
+import itertools
 import threading
 
 from .. import compat
@@ -147,3 +148,175 @@ class RateLimiter(object):
         )
 
     __str__ = __repr__
+
+
+class _TokenBucket(object):
+    __slots__ = ("lock", "rate", "max_tokens", "tokens", "last_update", "allowed", "total")
+
+    def __init__(self, rate, now):
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.total = 0
+        self.last_update = now
+        self.tokens = 0
+        self.set_rate(rate)
+        self.tokens = self.max_tokens
+
+    def set_rate(self, rate):
+        self.rate = rate
+        # A bucket must be able to hold at least one token
+        self.max_tokens = max(rate, 1)
+        self.tokens = min(self.tokens, self.max_tokens)
+
+    def take(self, now):
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ShardedRateLimiter(object):
+    """
+    A token bucket rate limiter whose budget is split across shards
+
+    Threads are assigned a shard each, in turn, and only contend on the lock of
+    their shard. Every second, the budget is redistributed across the shards
+    according to the number of requests each of them received in the previous
+    second.
+
+    The global rate limit holds within a tolerance: each shard can always hold
+    one token, so at most ``shards`` additional requests can be allowed per
+    second. A shard whose demand grows within a second is limited to its
+    current share of the budget until the next rebalancing, so fewer requests
+    than the rate limit may be allowed when the demand moves between threads.
+    """
+
+    __slots__ = (
+        "_buckets",
+        "_local",
+        "_lock",
+        "_next_bucket",
+        "current_window",
+        "prev_window_rate",
+        "rate_limit",
+    )
+
+    def __init__(self, rate_limit, shards=4):
+        """
+        Constructor for ShardedRateLimiter
+
+        :param rate_limit: The rate limit to apply for number of requests per second.
+            rate limit > 0 max number of requests to allow per second,
+            rate limit == 0 to disallow all requests,
+            rate limit < 0 to allow all requests
+        :type rate_limit: :obj:`int`
+        :param shards: The number of shards to split the rate limit across.
+        :type shards: :obj:`int`
+        """
+        self.rate_limit = rate_limit
+        now = compat.monotonic()
+        shards = max(1, shards)
+        self._buckets = [_TokenBucket(max(rate_limit, 0) / shards, now) for _ in range(shards)]
+        self._local = threading.local()
+        self._next_bucket = itertools.count()
+        self._lock = threading.Lock()
+        self.current_window = now
+        self.prev_window_rate = None
+
+    def _bucket(self):
+        try:
+            return self._local.bucket
+        except AttributeError:
+            bucket = self._local.bucket = self._buckets[next(self._next_bucket) % len(self._buckets)]
+            return bucket
+
+    def is_allowed(self):
+        """
+        Check whether the current request is allowed or not
+
+        This method will also reduce the number of available tokens by 1
+
+        :returns: Whether the current request is allowed or not
+        :rtype: :obj:`bool`
+        """
+        now = compat.monotonic()
+        if now - self.current_window >= 1.0:
+            self._rebalance(now)
+
+        bucket = self._bucket()
+        with bucket.lock:
+            if self.rate_limit == 0:
+                allowed = False
+            elif self.rate_limit < 0:
+                allowed = True
+            else:
+                allowed = bucket.take(now)
+            if allowed:
+                bucket.allowed += 1
+            bucket.total += 1
+        return allowed
+
+    def _rebalance(self, now):
+        # Only one thread rebalances the shards, the others carry on
+        if not self._lock.acquire(False):
+            return
+        try:
+            if now - self.current_window < 1.0:
+                # Already done by another thread
+                return
+
+            allowed = total = 0
+            demands = []
+            for bucket in self._buckets:
+                with bucket.lock:
+                    allowed += bucket.allowed
+                    total += bucket.total
+                    demands.append(bucket.total)
+                    bucket.allowed = bucket.total = 0
+            self.prev_window_rate = allowed / total if total else 1.0
+            self.current_window = now
+
+            if self.rate_limit > 0 and total:
+                # Keep a minimal share for idle shards so that they can pick up
+                # requests before the next rebalancing
+                floor = total / len(self._buckets) / 10.0
+                weights = [demand + floor for demand in demands]
+                total_weight = sum(weights)
+                for bucket, weight in zip(self._buckets, weights):
+                    with bucket.lock:
+                        bucket.set_rate(self.rate_limit * weight / total_weight)
+        finally:
+            self._lock.release()
+
+    @property
+    def effective_rate(self):
+        """
+        Return the effective sample rate of this rate limiter
+
+        :returns: Effective sample rate value 0.0 <= rate <= 1.0
+        :rtype: :obj:`float``
+        """
+        allowed = total = 0
+        for bucket in self._buckets:
+            allowed += bucket.allowed
+            total += bucket.total
+        # No tokens have been seen, effectively 100% sample rate
+        current_window_rate = allowed / total if total else 1.0
+
+        # If we have not had a previous window yet, return current rate
+        if self.prev_window_rate is None:
+            return current_window_rate
+
+        return (current_window_rate + self.prev_window_rate) / 2.0
+
+    def __repr__(self):
+        return "{}(rate_limit={!r}, shards={!r}, effective_rate={!r})".format(
+            self.__class__.__name__,
+            self.rate_limit,
+            len(self._buckets),
+            self.effective_rate,
+        )
+
+    __str__ = __repr__
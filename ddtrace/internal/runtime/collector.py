@@ -36,6 +36,9 @@ class ValueCollector(object):
     def _on_modules_load(self):
         """Hook triggered after all required_modules have been successfully loaded."""
 
+    def stop(self):
+        """Hook triggered when the collector is not used anymore."""
+
     def _load_modules(self):
         modules = {}
         try:
@@ -1,6 +1,11 @@
 GC_COUNT_GEN0 = "runtime.python.gc.count.gen0"
 GC_COUNT_GEN1 = "runtime.python.gc.count.gen1"
 GC_COUNT_GEN2 = "runtime.python.gc.count.gen2"
+GC_PAUSE_GEN0 = "runtime.python.gc.pause.gen0"
+GC_PAUSE_GEN1 = "runtime.python.gc.pause.gen1"
+GC_PAUSE_GEN2 = "runtime.python.gc.pause.gen2"
+GC_COLLECTED = "runtime.python.gc.collected"
+GC_UNCOLLECTABLE = "runtime.python.gc.uncollectable"
 
 THREAD_COUNT = "runtime.python.thread_count"
 MEM_RSS = "runtime.python.mem.rss"
@@ -10,13 +15,43 @@ CPU_PERCENT = "runtime.python.cpu.percent"
 CTX_SWITCH_VOLUNTARY = "runtime.python.cpu.ctx_switch.voluntary"
 CTX_SWITCH_INVOLUNTARY = "runtime.python.cpu.ctx_switch.involuntary"
 
+ASYNCIO_LOOP_LAG = "runtime.python.asyncio.loop.lag"
+ASYNCIO_TASKS_PENDING = "runtime.python.asyncio.tasks.pending"
+ASYNCIO_SLOW_CALLBACK = "runtime.python.asyncio.slow_callback"
+
+CGROUP_CPU_THROTTLED = "runtime.python.cgroup.cpu.throttled"
+CGROUP_CPU_THROTTLED_TIME = "runtime.python.cgroup.cpu.throttled_time"
+CGROUP_MEM_USAGE = "runtime.python.cgroup.mem.usage"
+CGROUP_MEM_LIMIT = "runtime.python.cgroup.mem.limit"
+
 GC_RUNTIME_METRICS = set([GC_COUNT_GEN0, GC_COUNT_GEN1, GC_COUNT_GEN2])
 
+GC_PAUSE_RUNTIME_METRICS = set([GC_PAUSE_GEN0, GC_PAUSE_GEN1, GC_PAUSE_GEN2, GC_COLLECTED, GC_UNCOLLECTABLE])
+
+ASYNCIO_RUNTIME_METRICS = set([ASYNCIO_LOOP_LAG, ASYNCIO_TASKS_PENDING, ASYNCIO_SLOW_CALLBACK])
+
+# The values of these metrics are lists of the values of a distribution, or
+# of ``(value, tags)`` tuples
+DISTRIBUTION_RUNTIME_METRICS = set(
+    [GC_PAUSE_GEN0, GC_PAUSE_GEN1, GC_PAUSE_GEN2, ASYNCIO_LOOP_LAG, ASYNCIO_SLOW_CALLBACK]
+)
+
 PSUTIL_RUNTIME_METRICS = set(
     [THREAD_COUNT, MEM_RSS, CTX_SWITCH_VOLUNTARY, CTX_SWITCH_INVOLUNTARY, CPU_TIME_SYS, CPU_TIME_USER, CPU_PERCENT]
 )
 
-DEFAULT_RUNTIME_METRICS = GC_RUNTIME_METRICS | PSUTIL_RUNTIME_METRICS
+# The process metrics are read from /proc when available, with psutil otherwise
+PROC_RUNTIME_METRICS = PSUTIL_RUNTIME_METRICS
+
+CGROUP_RUNTIME_METRICS = set([CGROUP_CPU_THROTTLED, CGROUP_CPU_THROTTLED_TIME, CGROUP_MEM_USAGE, CGROUP_MEM_LIMIT])
+
+DEFAULT_RUNTIME_METRICS = (
+    GC_RUNTIME_METRICS
+    | GC_PAUSE_RUNTIME_METRICS
+    | PSUTIL_RUNTIME_METRICS
+    | CGROUP_RUNTIME_METRICS
+    | ASYNCIO_RUNTIME_METRICS
+)
 
 SERVICE = "service"
 ENV = "env"
@@ -115,3 +115,73 @@ def get_container_info(pid="self"):
                     return info
     except Exception:
         log.debug("Failed to parse cgroup file for pid %r", pid, exc_info=True)
+
+
+CGROUP_MOUNT = "/sys/fs/cgroup"
+
+
+def get_cgroup_paths(pid="self"):
+    """
+    Helper to fetch the cgroup of each controller of a process
+
+    We will parse `/proc/{pid}/cgroup` for the path of the cgroup of each controller. The
+    cgroup of the unified (v2) hierarchy is stored with the empty controller name.
+
+    :param pid: The pid of the cgroup file to parse (default: 'self')
+    :type pid: str | int
+    :returns: The cgroup path by controller name
+    :rtype: dict
+    """
+    paths = {}
+    cgroup_file = "/proc/{0}/cgroup".format(pid)
+    try:
+        with open(cgroup_file, mode="r") as fp:
+            for line in fp:
+                info = CGroupInfo.from_line(line)
+                if info is None:
+                    continue
+                if not info.controllers:
+                    paths[""] = info.path
+                for controller in info.controllers:
+                    paths[controller] = info.path
+    except (IOError, OSError):
+        # The cgroup file does not exist on platforms other than Linux
+        pass
+    except Exception:
+        log.debug("Failed to parse cgroup file for pid %r", pid, exc_info=True)
+    return paths
+
+
+def get_cgroup_file(paths, controller, filename, mount=CGROUP_MOUNT):
+    """
+    Helper to find a file of the cgroup of a controller
+
+    The cgroup of the controller (v1) is looked up first, then the cgroup of the unified
+    hierarchy (v2). When the cgroup namespace of the process is not the root one, the
+    cgroup path is not visible and the file is looked up at the root of the mount.
+
+    :param paths: The cgroup paths as returned by :obj:`get_cgroup_paths`
+    :type paths: dict
+    :param controller: The name of the controller (e.g. 'cpu', 'memory')
+    :type controller: str
+    :param filename: The name of the file (e.g. 'cpu.stat')
+    :type filename: str
+    :returns: The path of the file if found, or else None
+    :rtype: str | None
+    """
+    candidates = []
+    if controller in paths:
+        root = os.path.join(mount, controller)
+        candidates.extend([os.path.join(root, paths[controller].lstrip("/")), root])
+    if "" in paths:
+        # The unified hierarchy is mounted on its own in the hybrid mode
+        root = os.path.join(mount, "unified")
+        if not os.path.isdir(root):
+            root = mount
+        candidates.extend([os.path.join(root, paths[""].lstrip("/")), root])
+
+    for directory in candidates:
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            return path
+    return None
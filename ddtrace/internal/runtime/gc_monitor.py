@@ -0,0 +1,78 @@
+"""Measurement of the garbage collections with ``gc.callbacks``
+
+More information at https://docs.python.org/3/library/gc.html#gc.callbacks
+"""
+import gc
+import threading
+
+from ... import compat
+
+
+class GCMonitor(object):
+    """Monitor of the pauses of the garbage collector
+
+    A single callback, shared by all the users of the monitor, is registered
+    in ``gc.callbacks`` while the monitor is started. It only adds up the
+    totals and keeps the pause durations, in nanoseconds, of each
+    generation until they are flushed.
+
+    The totals are only increased, the users of the monitor compute the
+    differences themselves, since a collection can happen at any allocation
+    and thus in the middle of a read of the monitor.
+    """
+
+    # Maximum number of pause durations kept per generation between two flushes
+    MAX_PAUSES = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._start_ns = 0
+        self._pauses = ([], [], [])
+        self.pause_ns = 0
+        self.collected = 0
+        self.uncollectable = 0
+
+    @staticmethod
+    def available():
+        return hasattr(gc, "callbacks")
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self._start_ns = compat.monotonic_ns()
+            return
+
+        pause_ns = compat.monotonic_ns() - self._start_ns
+        self.pause_ns += pause_ns
+        self.collected += info["collected"]
+        self.uncollectable += info["uncollectable"]
+        pauses = self._pauses[info["generation"]]
+        if len(pauses) < self.MAX_PAUSES:
+            pauses.append(pause_ns)
+
+    def start(self):
+        """Register the callback, return whether the monitor is available."""
+        if not self.available():
+            return False
+        with self._lock:
+            self._users += 1
+            if self._users == 1:
+                gc.callbacks.append(self._callback)
+        return True
+
+    def stop(self):
+        """Unregister the callback once all the users of the monitor stopped it."""
+        with self._lock:
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users == 0:
+                gc.callbacks.remove(self._callback)
+
+    def flush_pauses(self):
+        """Return the pause durations of each generation since the last flush."""
+        pauses, self._pauses = self._pauses, ([], [], [])
+        return pauses
+
+
+gc_monitor = GCMonitor()
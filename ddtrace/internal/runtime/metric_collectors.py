@@ -1,10 +1,22 @@
 import os
+import sys
 
+from ... import compat
+from . import container
+from .gc_monitor import gc_monitor
 from .collector import ValueCollector
 from .constants import (
+    ASYNCIO_LOOP_LAG,
+    ASYNCIO_SLOW_CALLBACK,
+    ASYNCIO_TASKS_PENDING,
     GC_COUNT_GEN0,
     GC_COUNT_GEN1,
     GC_COUNT_GEN2,
+    GC_PAUSE_GEN0,
+    GC_PAUSE_GEN1,
+    GC_PAUSE_GEN2,
+    GC_COLLECTED,
+    GC_UNCOLLECTABLE,
     THREAD_COUNT,
     MEM_RSS,
     CTX_SWITCH_VOLUNTARY,
@@ -12,6 +24,10 @@ from .constants import (
     CPU_TIME_SYS,
     CPU_TIME_USER,
     CPU_PERCENT,
+    CGROUP_CPU_THROTTLED,
+    CGROUP_CPU_THROTTLED_TIME,
+    CGROUP_MEM_USAGE,
+    CGROUP_MEM_LIMIT,
 )
 
 
@@ -41,6 +57,83 @@ class GCRuntimeMetricCollector(RuntimeMetricCollector):
         return metrics
 
 
+class GCPauseRuntimeMetricCollector(RuntimeMetricCollector):
+    """Collector for the pauses of the garbage collector
+
+    The pause durations, in seconds, of each generation are reported as
+    distributions, along with the number of collected and uncollectable
+    objects since the last collection. Requires ``gc.callbacks`` (Python 3.3+).
+    """
+
+    def _on_modules_load(self):
+        if not gc_monitor.start():
+            self.enabled = False
+            return
+        self._collected = gc_monitor.collected
+        self._uncollectable = gc_monitor.uncollectable
+
+    def stop(self):
+        if self.enabled:
+            gc_monitor.stop()
+            self.enabled = False
+
+    def collect_fn(self, keys):
+        gen0, gen1, gen2 = gc_monitor.flush_pauses()
+        collected, uncollectable = gc_monitor.collected, gc_monitor.uncollectable
+        metrics = [
+            (GC_PAUSE_GEN0, [pause / 1e9 for pause in gen0]),
+            (GC_PAUSE_GEN1, [pause / 1e9 for pause in gen1]),
+            (GC_PAUSE_GEN2, [pause / 1e9 for pause in gen2]),
+            (GC_COLLECTED, collected - self._collected),
+            (GC_UNCOLLECTABLE, uncollectable - self._uncollectable),
+        ]
+        self._collected, self._uncollectable = collected, uncollectable
+        return metrics
+
+
+class EventLoopRuntimeMetricCollector(RuntimeMetricCollector):
+    """Collector for the metrics of the monitored asyncio event loops
+
+    The event loops are monitored on demand with
+    :obj:`ddtrace.contrib.asyncio.runtime.monitor_event_loop`, which
+    registers the monitors here. Nothing is collected without a monitor.
+    """
+
+    monitors = []
+
+    @classmethod
+    def register(cls, monitor):
+        cls.monitors.append(monitor)
+
+    @classmethod
+    def unregister(cls, monitor):
+        try:
+            cls.monitors.remove(monitor)
+        except ValueError:
+            pass
+
+    def collect_fn(self, keys):
+        if not self.monitors:
+            return []
+
+        lags = []
+        pending_tasks = 0
+        slow_callbacks = []
+        for monitor in list(self.monitors):
+            monitor_lags, monitor_pending_tasks, monitor_slow_callbacks = monitor.flush()
+            lags.extend(lag / 1e9 for lag in monitor_lags)
+            pending_tasks += monitor_pending_tasks
+            slow_callbacks.extend(
+                (duration / 1e9, ["coroutine:%s" % name] if name else None) for duration, name in monitor_slow_callbacks
+            )
+
+        return [
+            (ASYNCIO_LOOP_LAG, lags),
+            (ASYNCIO_TASKS_PENDING, pending_tasks),
+            (ASYNCIO_SLOW_CALLBACK, slow_callbacks),
+        ]
+
+
 class PSUtilRuntimeMetricCollector(RuntimeMetricCollector):
     """Collector for psutil metrics.
 
@@ -92,3 +185,191 @@ class PSUtilRuntimeMetricCollector(RuntimeMetricCollector):
             ]
 
             return metrics
+
+
+class _FileRuntimeMetricCollector(RuntimeMetricCollector):
+    """Base collector for metrics read from the files of the pseudo file systems of Linux"""
+
+    def __init__(self, *args, **kwargs):
+        # The files are read into the same buffer at every collection
+        self._buffer = bytearray(4096)
+        super(_FileRuntimeMetricCollector, self).__init__(*args, **kwargs)
+
+    def _read(self, path):
+        while True:
+            with open(path, "rb", 0) as f:
+                size = f.readinto(self._buffer)
+            if size < len(self._buffer):
+                return self._buffer[:size]
+            self._buffer = bytearray(2 * len(self._buffer))
+
+
+class ProcRuntimeMetricCollector(_FileRuntimeMetricCollector):
+    """Collector for the process metrics read from /proc on Linux.
+
+    Provides the metrics of :class:`PSUtilRuntimeMetricCollector`, with a
+    single read of ``/proc/self/stat`` and ``/proc/self/status`` per
+    collection. See ``man 5 proc`` for the format of the files.
+    """
+
+    STAT_PATH = "/proc/self/stat"
+    STATUS_PATH = "/proc/self/status"
+
+    # Indexes of the fields following the command name in /proc/self/stat
+    STAT_UTIME = 11
+    STAT_STIME = 12
+    STAT_NUM_THREADS = 17
+    STAT_RSS = 21
+
+    stored_value = dict(
+        CPU_TIME_SYS_TOTAL=0,
+        CPU_TIME_USER_TOTAL=0,
+        CTX_SWITCH_VOLUNTARY_TOTAL=0,
+        CTX_SWITCH_INVOLUNTARY_TOTAL=0,
+    )
+
+    def _on_modules_load(self):
+        if not sys.platform.startswith("linux") or not os.path.isfile(self.STAT_PATH):
+            self.enabled = False
+            return
+        self._clock_ticks = float(os.sysconf("SC_CLK_TCK"))
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._last_collect = None
+
+    def _status_field(self, status, name):
+        _, found, value = status.partition(name)
+        if not found:
+            return 0
+        return int(value.split(b"\n", 1)[0])
+
+    def collect_fn(self, keys):
+        stat = self._read(self.STAT_PATH)
+        # The command name, in parenthesis, can contain spaces
+        fields = stat.rpartition(b") ")[2].split(b" ", self.STAT_RSS + 1)
+        cpu_time_user_total = int(fields[self.STAT_UTIME]) / self._clock_ticks
+        cpu_time_sys_total = int(fields[self.STAT_STIME]) / self._clock_ticks
+
+        metrics = [
+            (THREAD_COUNT, int(fields[self.STAT_NUM_THREADS])),
+            (MEM_RSS, int(fields[self.STAT_RSS]) * self._page_size),
+            (CPU_TIME_SYS, cpu_time_sys_total - self.stored_value["CPU_TIME_SYS_TOTAL"]),
+            (CPU_TIME_USER, cpu_time_user_total - self.stored_value["CPU_TIME_USER_TOTAL"]),
+        ]
+
+        # Same as psutil.Process.cpu_percent(), 0 on the first collection
+        now = compat.monotonic()
+        cpu_percent = 0.0
+        if self._last_collect is not None and now > self._last_collect:
+            cpu_time = (
+                cpu_time_sys_total
+                + cpu_time_user_total
+                - self.stored_value["CPU_TIME_SYS_TOTAL"]
+                - self.stored_value["CPU_TIME_USER_TOTAL"]
+            )
+            cpu_percent = round(100 * cpu_time / (now - self._last_collect), 1)
+        self._last_collect = now
+        metrics.append((CPU_PERCENT, cpu_percent))
+
+        stored_value = dict(
+            self.stored_value,
+            CPU_TIME_SYS_TOTAL=cpu_time_sys_total,
+            CPU_TIME_USER_TOTAL=cpu_time_user_total,
+        )
+
+        if not keys or CTX_SWITCH_VOLUNTARY in keys or CTX_SWITCH_INVOLUNTARY in keys:
+            status = self._read(self.STATUS_PATH)
+            ctx_switch_voluntary_total = self._status_field(status, b"\nvoluntary_ctxt_switches:")
+            ctx_switch_involuntary_total = self._status_field(status, b"\nnonvoluntary_ctxt_switches:")
+            metrics.extend(
+                [
+                    (
+                        CTX_SWITCH_VOLUNTARY,
+                        ctx_switch_voluntary_total - self.stored_value["CTX_SWITCH_VOLUNTARY_TOTAL"],
+                    ),
+                    (
+                        CTX_SWITCH_INVOLUNTARY,
+                        ctx_switch_involuntary_total - self.stored_value["CTX_SWITCH_INVOLUNTARY_TOTAL"],
+                    ),
+                ]
+            )
+            stored_value.update(
+                CTX_SWITCH_VOLUNTARY_TOTAL=ctx_switch_voluntary_total,
+                CTX_SWITCH_INVOLUNTARY_TOTAL=ctx_switch_involuntary_total,
+            )
+
+        self.stored_value = stored_value
+        return metrics
+
+
+class CGroupRuntimeMetricCollector(_FileRuntimeMetricCollector):
+    """Collector for the CPU throttling and the memory limit of the cgroup of the process.
+
+    The files are looked up in the cgroups listed in ``/proc/self/cgroup``,
+    for both the cgroup v1 and v2 hierarchies. The throttling metrics are
+    counted since the last collection.
+    """
+
+    # Memory limits from this value on mean no limit (cgroup v1)
+    UNLIMITED_MEMORY = 2 ** 62
+
+    def _on_modules_load(self):
+        paths = container.get_cgroup_paths()
+        self._cpu_stat_path = container.get_cgroup_file(paths, "cpu", "cpu.stat")
+        self._mem_usage_path = container.get_cgroup_file(
+            paths, "memory", "memory.usage_in_bytes"
+        ) or container.get_cgroup_file(paths, "memory", "memory.current")
+        self._mem_limit_path = container.get_cgroup_file(
+            paths, "memory", "memory.limit_in_bytes"
+        ) or container.get_cgroup_file(paths, "memory", "memory.max")
+
+        if not (self._cpu_stat_path or self._mem_usage_path or self._mem_limit_path):
+            self.enabled = False
+            return
+        self._throttled = self._read_cpu_throttling()
+
+    def _read_cpu_throttling(self):
+        if self._cpu_stat_path is None:
+            return None
+        nr_throttled = throttled_time = None
+        for line in self._read(self._cpu_stat_path).split(b"\n"):
+            name, _, value = line.partition(b" ")
+            if name == b"nr_throttled":
+                nr_throttled = int(value)
+            elif name == b"throttled_time":
+                throttled_time = int(value)
+            elif name == b"throttled_usec":
+                throttled_time = int(value) * 1000
+        if nr_throttled is None or throttled_time is None:
+            return None
+        return nr_throttled, throttled_time
+
+    def _read_int(self, path):
+        if path is None:
+            return None
+        try:
+            return int(self._read(path))
+        except ValueError:
+            # "max" is the value of the memory limit when there is none (cgroup v2)
+            return None
+
+    def collect_fn(self, keys):
+        metrics = []
+
+        throttled = self._read_cpu_throttling()
+        if throttled is not None and self._throttled is not None:
+            metrics.extend(
+                [
+                    (CGROUP_CPU_THROTTLED, throttled[0] - self._throttled[0]),
+                    (CGROUP_CPU_THROTTLED_TIME, throttled[1] - self._throttled[1]),
+                ]
+            )
+        self._throttled = throttled
+
+        mem_usage = self._read_int(self._mem_usage_path)
+        if mem_usage is not None:
+            metrics.append((CGROUP_MEM_USAGE, mem_usage))
+        mem_limit = self._read_int(self._mem_limit_path)
+        if mem_limit is not None and mem_limit < self.UNLIMITED_MEMORY:
+            metrics.append((CGROUP_MEM_LIMIT, mem_limit))
+
+        return metrics
@@ -3,12 +3,18 @@ import itertools
 
 from ... import _worker
 from ..logger import get_logger
+from ..metrics import MetricsAggregator
 from .constants import (
     DEFAULT_RUNTIME_METRICS,
     DEFAULT_RUNTIME_TAGS,
+    DISTRIBUTION_RUNTIME_METRICS,
 )
 from .metric_collectors import (
+    CGroupRuntimeMetricCollector,
+    EventLoopRuntimeMetricCollector,
+    GCPauseRuntimeMetricCollector,
     GCRuntimeMetricCollector,
+    ProcRuntimeMetricCollector,
     PSUtilRuntimeMetricCollector,
 )
 from .tag_collectors import (
@@ -23,12 +29,25 @@ class RuntimeCollectorsIterable(object):
     def __init__(self, enabled=None):
         self._enabled = enabled or self.ENABLED
         # Initialize the collectors.
-        self._collectors = [c() for c in self.COLLECTORS]
+        # DEV: a tuple of collectors lists alternatives, the first enabled one is used
+        self._collectors = []
+        for collectors in self.COLLECTORS:
+            if not isinstance(collectors, tuple):
+                collectors = (collectors,)
+            for c in collectors:
+                collector = c()
+                if collector.enabled:
+                    break
+            self._collectors.append(collector)
 
     def __iter__(self):
         collected = (collector.collect(self._enabled) for collector in self._collectors)
         return itertools.chain.from_iterable(collected)
 
+    def stop(self):
+        for collector in self._collectors:
+            collector.stop()
+
     def __repr__(self):
         return "{}(enabled={})".format(
             self.__class__.__name__,
@@ -48,7 +67,11 @@ class RuntimeMetrics(RuntimeCollectorsIterable):
     ENABLED = DEFAULT_RUNTIME_METRICS
     COLLECTORS = [
         GCRuntimeMetricCollector,
-        PSUtilRuntimeMetricCollector,
+        GCPauseRuntimeMetricCollector,
+        # psutil is only loaded where /proc is not available
+        (ProcRuntimeMetricCollector, PSUtilRuntimeMetricCollector),
+        CGroupRuntimeMetricCollector,
+        EventLoopRuntimeMetricCollector,
     ]
 
 
@@ -62,16 +85,27 @@ class RuntimeWorker(_worker.PeriodicWorkerThread):
     def __init__(self, statsd_client, flush_interval=FLUSH_INTERVAL):
         super(RuntimeWorker, self).__init__(interval=flush_interval, name=self.__class__.__name__)
         self._statsd_client = statsd_client
+        self._metrics = MetricsAggregator(statsd_client)
         self._runtime_metrics = RuntimeMetrics()
 
     def flush(self):
-        with self._statsd_client:
-            for key, value in self._runtime_metrics:
-                log.debug("Writing metric %s:%s", key, value)
-                self._statsd_client.gauge(key, value)
+        for key, value in self._runtime_metrics:
+            log.debug("Writing metric %s:%s", key, value)
+            if key in DISTRIBUTION_RUNTIME_METRICS:
+                for v in value:
+                    if isinstance(v, tuple):
+                        self._metrics.distribution(key, v[0], tags=v[1])
+                    else:
+                        self._metrics.distribution(key, v)
+            else:
+                self._metrics.gauge(key, value)
+        self._metrics.flush()
 
     run_periodic = flush
-    on_shutdown = flush
+
+    def on_shutdown(self):
+        self.flush()
+        self._runtime_metrics.stop()
 
     def __repr__(self):
         return "{}(runtime_metrics={})".format(
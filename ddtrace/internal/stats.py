@@ -0,0 +1,278 @@
+"""Client-side computation of the trace metrics
+
+The metrics of the traces (hits, errors and latency distribution) are
+aggregated in the tracer and sent to the agent, which then does not need to
+receive every trace to compute them.
+"""
+import math
+import struct
+import threading
+
+import ddtrace
+from .. import _worker
+from .. import compat
+from ..constants import SPAN_MEASURED_KEY
+from ..ext import http
+from ..settings import config
+from ..vendor import six
+from . import hostname
+from ._encoding import Packer
+from .logger import get_logger
+from .runtime import get_runtime_id
+
+log = get_logger(__name__)
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _proto_double(field, value):
+    return bytearray([(field << 3) | 1]) + struct.pack("<d", value)
+
+
+def _proto_message(field, message):
+    return bytearray([(field << 3) | 2]) + _varint(len(message)) + message
+
+
+class DDSketch(object):
+    """Distribution of positive values with a relative accuracy guarantee
+
+    Values are counted in bins whose boundaries grow exponentially, so that any
+    quantile is estimated within ``relative_accuracy`` of its actual value. The
+    sketch is serialized with the protobuf format of the DDSketch libraries,
+    which the agent decodes.
+    """
+
+    __slots__ = ("relative_accuracy", "_gamma", "_ln_gamma", "_bins", "zero_count", "count")
+
+    # Values below this one (1 nanosecond for durations) are counted as zero
+    MIN_VALUE = 1.0
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._ln_gamma = math.log(self._gamma)
+        self._bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = int(math.ceil(math.log(value) / self._ln_gamma))
+        self._bins[index] = self._bins.get(index, 0) + 1
+
+    def quantile(self, q):
+        """Return an estimate of the ``q`` quantile of the values, ``None`` without any value."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self._bins):
+            seen += self._bins[index]
+            if rank < seen:
+                break
+        return 2 * self._gamma ** index / (1 + self._gamma)
+
+    def to_proto(self):
+        """Return the sketch serialized as a ``DDSketch`` protobuf message."""
+        mapping = _proto_double(1, self._gamma)
+        store = bytearray()
+        for index, count in six.iteritems(self._bins):
+            entry = bytearray([0x08]) + _varint(_zigzag(index) & 0xFFFFFFFF) + _proto_double(2, float(count))
+            store += _proto_message(1, entry)
+        sketch = _proto_message(1, mapping) + _proto_message(2, store)
+        if self.zero_count:
+            sketch += _proto_double(4, float(self.zero_count))
+        return bytes(sketch)
+
+
+def _text(value):
+    if value is None:
+        return u""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return six.text_type(value)
+
+
+def _status_code(span):
+    status = span._meta.get(http.STATUS_CODE) if span._meta else None
+    try:
+        return int(status) if status is not None else 0
+    except ValueError:
+        return 0
+
+
+def _is_top_level(span):
+    parent = span._parent
+    return parent is None or parent.service != span.service
+
+
+class _SpanAggrStats(object):
+    __slots__ = ("hits", "top_level_hits", "errors", "duration", "ok_distribution", "err_distribution")
+
+    def __init__(self):
+        self.hits = 0
+        self.top_level_hits = 0
+        self.errors = 0
+        self.duration = 0
+        self.ok_distribution = DDSketch()
+        self.err_distribution = DDSketch()
+
+
+class SpanStatsConcentrator(_worker.PeriodicWorkerThread):
+    """Worker aggregating the metrics of the finished spans and sending them to the agent
+
+    The metrics of the top-level spans, whose parent belongs to another service,
+    and of the measured spans are aggregated by service, name, resource, HTTP
+    status code and type, in buckets of ``bucket_duration`` seconds according
+    to the time the spans finished. A bucket is flushed once it is complete.
+    """
+
+    BUCKET_DURATION = 10
+    STATS_ENDPOINT = "/v0.6/stats"
+
+    def __init__(self, tracer, bucket_duration=BUCKET_DURATION):
+        super(SpanStatsConcentrator, self).__init__(interval=bucket_duration, name=self.__class__.__name__)
+        self._tracer = tracer
+        self._bucket_duration_ns = int(bucket_duration * 1e9)
+        self._lock = threading.Lock()
+        self._started_lock = threading.Lock()
+        self._buckets = {}
+        self._sequence = 0
+        # The sketches are bytes fields of the payload
+        self._packer = Packer(use_bin_type=True)
+
+    def add_trace(self, trace):
+        """Aggregate the metrics of the spans of a trace"""
+        # Start the concentrator with the first trace, like the AgentWriter.
+        # Starting it earlier might be an issue with gevent, see:
+        # https://github.com/DataDog/dd-trace-py/issues/1192
+        if self.started is False:
+            with self._started_lock:
+                if self.started is False:
+                    self.start()
+
+        bucket_duration_ns = self._bucket_duration_ns
+        with self._lock:
+            for span in trace:
+                if span.duration_ns is None:
+                    continue
+                top_level = _is_top_level(span)
+                if not (top_level or (span._metrics and span._metrics.get(SPAN_MEASURED_KEY))):
+                    continue
+
+                end = span.start_ns + span.duration_ns
+                bucket_start = end - end % bucket_duration_ns
+                bucket = self._buckets.get(bucket_start)
+                if bucket is None:
+                    bucket = self._buckets[bucket_start] = {}
+
+                key = (span.service, span.name, span.resource, _status_code(span), span.span_type)
+                stats = bucket.get(key)
+                if stats is None:
+                    stats = bucket[key] = _SpanAggrStats()
+
+                stats.hits += 1
+                if top_level:
+                    stats.top_level_hits += 1
+                stats.duration += span.duration_ns
+                if span.error:
+                    stats.errors += 1
+                    stats.err_distribution.add(span.duration_ns)
+                else:
+                    stats.ok_distribution.add(span.duration_ns)
+
+    def _flush_buckets(self, force=False):
+        """Remove and return the complete buckets, all the buckets if ``force`` is set."""
+        now = compat.time_ns()
+        with self._lock:
+            flushed = [
+                (start, bucket)
+                for start, bucket in self._buckets.items()
+                if force or start + self._bucket_duration_ns <= now
+            ]
+            for start, _ in flushed:
+                del self._buckets[start]
+        return sorted(flushed, key=lambda item: item[0])
+
+    def _encode(self, buckets):
+        self._sequence += 1
+        return self._packer.pack(
+            {
+                u"Hostname": _text(hostname.get_hostname() if config.report_hostname else None),
+                u"Env": _text(config.env),
+                u"Version": _text(config.version),
+                u"Lang": u"python",
+                u"TracerVersion": _text(ddtrace.__version__),
+                u"RuntimeID": _text(get_runtime_id()),
+                u"Sequence": self._sequence,
+                u"Stats": [
+                    {
+                        u"Start": start,
+                        u"Duration": self._bucket_duration_ns,
+                        u"Stats": [
+                            {
+                                u"Service": _text(service),
+                                u"Name": _text(name),
+                                u"Resource": _text(resource),
+                                u"HTTPStatusCode": status,
+                                u"Type": _text(span_type),
+                                u"Hits": stats.hits,
+                                u"TopLevelHits": stats.top_level_hits,
+                                u"Errors": stats.errors,
+                                u"Duration": stats.duration,
+                                u"OkSummary": stats.ok_distribution.to_proto(),
+                                u"ErrorSummary": stats.err_distribution.to_proto(),
+                            }
+                            for (service, name, resource, status, span_type), stats in bucket.items()
+                        ],
+                    }
+                    for start, bucket in buckets
+                ],
+            }
+        )
+
+    def flush(self, force=False):
+        buckets = self._flush_buckets(force)
+        if not buckets:
+            return
+
+        writer = self._tracer.writer
+        send_stats = getattr(writer, "_send_stats", None)
+        if send_stats is None:
+            log.debug("dropping span stats, the writer %r can not send them", writer)
+            return
+
+        try:
+            payload = self._encode(buckets)
+        except Exception:
+            log.error("failed to encode span stats", exc_info=True)
+            return
+        send_stats(self.STATS_ENDPOINT, payload)
+
+    def run_periodic(self):
+        self.flush()
+
+    def on_shutdown(self):
+        self.flush(force=True)
+
+    def __repr__(self):
+        return "{}(bucket_duration={})".format(self.__class__.__name__, self._bucket_duration_ns / 1e9)
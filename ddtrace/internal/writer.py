@@ -1,5 +1,8 @@
 from collections import defaultdict
+from collections import deque
 import logging
+import os
+import socket
 import sys
 import threading
 
@@ -9,11 +12,12 @@ from .. import compat
 from .. import _worker
 from ..compat import httplib
 from ..sampler import BasePrioritySampler
-from ..encoding import Encoder, JSONEncoderV2
+from ..encoding import BufferedEncoder, BufferedEncoderV05, JSONEncoderV2
 from ..utils.time import StopWatch
 from .logger import get_logger
+from .metrics import MetricsAggregator
 from .runtime import container
-from .buffer import BufferFull, BufferItemTooLarge, TraceBuffer
+from .buffer import BufferFull, BufferItemTooLarge
 from .uds import UDSHTTPConnection
 
 log = get_logger(__name__)
@@ -21,6 +25,13 @@ log = get_logger(__name__)
 DEFAULT_TIMEOUT = 5
 LOG_ERR_INTERVAL = 60
 
+# Encoder used for each version of the agent trace API
+_API_VERSION_ENCODERS = {
+    "v0.3": BufferedEncoder,
+    "v0.4": BufferedEncoder,
+    "v0.5": BufferedEncoderV05,
+}
+
 
 def _human_size(nbytes):
     """Return a human-readable size."""
@@ -77,20 +88,51 @@ class AgentWriter(_worker.PeriodicWorkerThread):
         sampler=None,
         priority_sampler=None,
         processing_interval=1,
-        # Match the payload size since there is no functionality
-        # to flush dynamically.
+        min_processing_interval=None,
+        max_processing_interval=None,
+        flush_threshold=0.5,
+        # Match the payload size since the buffer is flushed in a single
+        # payload.
         buffer_size=8 * 1000000,
         max_payload_size=8 * 1000000,
+        buffer_shards=None,
         timeout=2,
         dogstatsd=None,
         report_metrics=False,
+        api_version=None,
+        max_in_flight_requests=None,
+        max_pending_traces=10000,
     ):
         super(AgentWriter, self).__init__(
             interval=processing_interval, exit_timeout=shutdown_timeout, name=self.__class__.__name__
         )
         self._buffer_size = buffer_size
         self._max_payload_size = max_payload_size
-        self._buffer = TraceBuffer(max_size=self._buffer_size, max_item_size=self._max_payload_size)
+        # Sharding the buffer reduces the contention between threads writing
+        # traces. It applies to the default v0.3 and v0.4 APIs, but not to the
+        # opt-in v0.5 API, whose payloads have a single string table.
+        if buffer_shards is None:
+            buffer_shards = int(os.getenv("DD_TRACE_WRITER_BUFFER_SHARDS", 4))
+        self._buffer_shards = buffer_shards
+
+        # The flush interval adapts to the traffic: it backs off up to
+        # max_processing_interval while no traces are written and shrinks down
+        # to min_processing_interval while the buffer fills up faster than it
+        # is flushed. A flush is also triggered as soon as the buffer is
+        # filled past flush_threshold.
+        if min_processing_interval is None:
+            min_processing_interval = float(
+                os.getenv("DD_TRACE_WRITER_MIN_INTERVAL_SECONDS", processing_interval / 4.0)
+            )
+        if max_processing_interval is None:
+            max_processing_interval = float(
+                os.getenv("DD_TRACE_WRITER_MAX_INTERVAL_SECONDS", processing_interval * 5.0)
+            )
+        self._processing_interval = processing_interval
+        self._min_processing_interval = min(min_processing_interval, processing_interval)
+        self._max_processing_interval = max(max_processing_interval, processing_interval)
+        self._flush_threshold = flush_threshold
+        self._flush_threshold_size = int(buffer_size * flush_threshold)
         self._sampler = sampler
         self._priority_sampler = priority_sampler
         self._hostname = hostname
@@ -105,10 +147,20 @@ class AgentWriter(_worker.PeriodicWorkerThread):
         }
         self._timeout = timeout
 
-        if priority_sampler is not None:
-            self._endpoint = "/v0.4/traces"
-        else:
-            self._endpoint = "/v0.3/traces"
+        # Connections to the agent are kept open and reused across flushes.
+        # Up to max_in_flight_requests payloads can be sent concurrently, each
+        # on its own connection by a pool of sender threads, so that a slow
+        # agent does not delay the next flush.
+        if max_in_flight_requests is None:
+            max_in_flight_requests = int(os.getenv("DD_TRACE_WRITER_MAX_IN_FLIGHT_REQUESTS", 1))
+        self._max_in_flight_requests = max(1, max_in_flight_requests)
+        self._in_flight = threading.BoundedSemaphore(self._max_in_flight_requests)
+        self._send_queue = None
+        self._senders = []
+        self._senders_pid = None
+        self._conn_lock = threading.Lock()
+        self._conn_pool = []
+        self._conn_pid = os.getpid()
 
         self._container_info = container.get_container_info()
         if self._container_info and self._container_info.container_id:
@@ -118,24 +170,52 @@ class AgentWriter(_worker.PeriodicWorkerThread):
                 }
             )
 
-        self._encoder = Encoder()
+        # The encoder is replaced when the API version is downgraded. With the
+        # v0.5 API, which can be downgraded, traces are encoded under this lock.
+        self._lock = threading.Lock()
+        if api_version is None:
+            api_version = os.getenv("DD_TRACE_API_VERSION")
+        if api_version is None:
+            api_version = "v0.4" if priority_sampler is not None else "v0.3"
+        self._set_api_version(api_version)
         self._headers.update({"Content-Type": self._encoder.content_type})
 
+        # Traces waiting for the deferred filters, which are run on the writer
+        # thread before encoding. They are only queued when there are deferred
+        # filters, otherwise traces are encoded as soon as they are written.
+        self._filters = []
+        self._max_pending_traces = max_pending_traces
+        self._pending = deque()
+
+        # Set when the tracer computes the trace metrics and sends them on its
+        # own, so that the agent does not compute them again from the traces.
+        self._client_computed_stats = False
+
         self._started = False
         self._started_lock = threading.Lock()
         self.dogstatsd = dogstatsd
         self._report_metrics = report_metrics
+        # The metrics are updated by the application threads writing traces
+        # and by the sender threads.
+        self._metrics_lock = threading.Lock()
+        self._metrics = None
         self._metrics_reset()
 
     def _metrics_dist(self, name, count=1, tags=None):
         if self._report_metrics:
-            self._metrics[name]["count"] += count
-            if tags:
-                self._metrics[name]["tags"].extend(tags)
+            with self._metrics_lock:
+                metric = self._metrics[name]
+                metric["count"] += count
+                if tags:
+                    metric["tags"].extend(tags)
 
     def _metrics_reset(self):
+        """Reset the metrics and return the ones recorded since the last reset."""
         if self._report_metrics:
-            self._metrics = defaultdict(lambda: {"count": 0, "tags": []})
+            with self._metrics_lock:
+                metrics = self._metrics
+                self._metrics = defaultdict(lambda: {"count": 0, "tags": []})
+            return metrics
 
     def recreate(self):
         writer = self.__class__(
@@ -145,30 +225,115 @@ class AgentWriter(_worker.PeriodicWorkerThread):
             https=self._https,
             shutdown_timeout=self.exit_timeout,
             priority_sampler=self._priority_sampler,
+            processing_interval=self._processing_interval,
+            min_processing_interval=self._min_processing_interval,
+            max_processing_interval=self._max_processing_interval,
+            flush_threshold=self._flush_threshold,
+            buffer_size=self._buffer_size,
+            max_payload_size=self._max_payload_size,
+            buffer_shards=self._buffer_shards,
+            api_version=self._api_version,
+            max_in_flight_requests=self._max_in_flight_requests,
+            max_pending_traces=self._max_pending_traces,
         )
-        writer._encoder = self._encoder
         writer._headers = self._headers
-        writer._endpoint = self._endpoint
+        writer._filters = self._filters
+        writer._client_computed_stats = self._client_computed_stats
         return writer
 
-    def _put(self, data, headers):
+    def _set_api_version(self, api_version):
+        # Must be called with the lock held once the writer is in use
+        try:
+            encoder_cls = _API_VERSION_ENCODERS[api_version]
+        except KeyError:
+            raise ValueError(
+                "unsupported trace API version %r, expected one of %s"
+                % (api_version, ", ".join(sorted(_API_VERSION_ENCODERS)))
+            )
+        # Set the encoder first: threads not taking the lock check the API
+        # version before using the encoder.
+        self._encoder = encoder_cls(
+            max_size=self._buffer_size, max_item_size=self._max_payload_size, shards=self._buffer_shards
+        )
+        self._endpoint = "/%s/traces" % api_version
+        self._api_version = api_version
+
+    def _new_connection(self):
         if self._uds_path is None:
             if self._https:
-                conn = httplib.HTTPSConnection(self._hostname, self._port, timeout=self._timeout)
-            else:
-                conn = httplib.HTTPConnection(self._hostname, self._port, timeout=self._timeout)
+                return httplib.HTTPSConnection(self._hostname, self._port, timeout=self._timeout)
+            return httplib.HTTPConnection(self._hostname, self._port, timeout=self._timeout)
+        return UDSHTTPConnection(self._uds_path, self._https, self._hostname, self._port, timeout=self._timeout)
+
+    def _get_connection(self, reuse=True):
+        """Return a connection to the agent and whether it has been used before.
+
+        Idle connections are reused unless ``reuse`` is ``False``. A new
+        connection is opened otherwise.
+        """
+        with self._conn_lock:
+            pid = os.getpid()
+            if self._conn_pid != pid:
+                # Connections inherited from the parent process share their
+                # socket with it and must not be used in a child process.
+                self._conn_pool = []
+                self._conn_pid = pid
+            elif reuse and self._conn_pool:
+                return self._conn_pool.pop(), True
+
+        conn = self._new_connection()
+        with StopWatch() as sw:
+            conn.connect()
+        self._metrics_dist("http.connections")
+        self._metrics_dist("http.connect.time_ms", int(sw.elapsed() * 1000))
+        return conn, False
+
+    def _release_connection(self, conn):
+        with self._conn_lock:
+            if self._conn_pid == os.getpid() and len(self._conn_pool) < self._max_in_flight_requests:
+                self._conn_pool.append(conn)
+                return
+        conn.close()
+
+    def _close_connections(self):
+        with self._conn_lock:
+            conns, self._conn_pool = self._conn_pool, []
+        for conn in conns:
+            conn.close()
+
+    def _request(self, data, headers, reuse=True, endpoint=None):
+        conn, reused = self._get_connection(reuse)
+        try:
+            with StopWatch() as sw:
+                conn.request("PUT", endpoint or self._endpoint, data, headers)
+                resp = compat.get_connection_response(conn)
+                response = Response.from_http_response(resp)
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.HTTPException, OSError, IOError):
+            conn.close()
+            if not reused:
+                raise
+            # The agent may have closed the connection while it was idle:
+            # retry once on a new connection.
+            log.debug("failed to send payload on a reused connection, reconnecting", exc_info=True)
+            return self._request(data, headers, reuse=False, endpoint=endpoint)
+
+        self._metrics_dist("http.send.time_ms", int(sw.elapsed() * 1000))
+        if resp.will_close:
+            conn.close()
         else:
-            conn = UDSHTTPConnection(self._uds_path, self._https, self._hostname, self._port, timeout=self._timeout)
+            self._release_connection(conn)
+        return response
 
+    def _put(self, data, headers, endpoint=None):
         with StopWatch() as sw:
             try:
-                conn.request("PUT", self._endpoint, data, headers)
-                resp = compat.get_connection_response(conn)
-                return Response.from_http_response(resp)
+                return self._request(data, headers, endpoint=endpoint)
             finally:
-                conn.close()
                 t = sw.elapsed()
-                if t >= self.interval:
+                if t >= self._processing_interval:
                     log_level = logging.WARNING
                 else:
                     log_level = logging.DEBUG
@@ -184,20 +349,42 @@ class AgentWriter(_worker.PeriodicWorkerThread):
             scheme = "http://"
         return "%s%s:%s" % (scheme, self._hostname, self._port)
 
-    def _downgrade(self, payload, response):
-        if self._endpoint == "/v0.4/traces":
-            self._endpoint = "/v0.3/traces"
-            return payload
+    def _downgrade(self, payload, response, endpoint=None):
+        with self._lock:
+            if endpoint is None:
+                endpoint = self._endpoint
+            if endpoint == "/v0.5/traces":
+                if self._api_version == "v0.5":
+                    self._set_api_version("v0.4")
+                # The payload cannot be sent to the downgraded endpoint as it is
+                # encoded in a different format, so it is dropped.
+                log.warning(
+                    "dropping trace payload while downgrading from the v0.5 to the v0.4 trace API. "
+                    "The Datadog Agent does not support DD_TRACE_API_VERSION=v0.5"
+                )
+                return None
+            if endpoint == "/v0.4/traces":
+                if self._api_version == "v0.4":
+                    # v0.3 and v0.4 payloads share the same format
+                    self._api_version = "v0.3"
+                    self._endpoint = "/v0.3/traces"
+                return payload
         raise ValueError
 
-    def _send_payload(self, payload, count):
+    def _send_payload(self, payload, count, endpoint=None):
+        # The endpoint the payload was encoded for, which may differ from the
+        # current one if the API version was downgraded in the meantime.
+        if endpoint is None:
+            endpoint = self._endpoint
         headers = self._headers.copy()
         headers["X-Datadog-Trace-Count"] = str(count)
+        if self._client_computed_stats:
+            headers["Datadog-Client-Computed-Stats"] = "yes"
 
         self._metrics_dist("http.requests")
 
         try:
-            response = self._put(payload, headers)
+            response = self._put(payload, headers, endpoint=endpoint)
         except (httplib.HTTPException, OSError, IOError):
             log.error("failed to send traces to Datadog Agent at %s", self.agent_url, exc_info=True)
             if self._report_metrics:
@@ -210,17 +397,19 @@ class AgentWriter(_worker.PeriodicWorkerThread):
                 self._metrics_dist("http.sent.bytes", len(payload))
 
             if response.status in [404, 415]:
-                log.debug("calling endpoint '%s' but received %s; downgrading API", self._endpoint, response.status)
+                log.debug("calling endpoint '%s' but received %s; downgrading API", endpoint, response.status)
                 try:
-                    payload = self._downgrade(payload, response)
+                    downgraded_payload = self._downgrade(payload, response, endpoint)
                 except ValueError:
                     log.error(
                         "unsupported endpoint '%s': received response %s from Datadog Agent",
-                        self._endpoint,
+                        endpoint,
                         response.status,
                     )
                 else:
-                    return self._send_payload(payload, count)
+                    if downgraded_payload is not None:
+                        return self._send_payload(downgraded_payload, count)
+                    self._metrics_dist("http.dropped.bytes", len(payload))
             elif response.status >= 400:
                 log.error(
                     "failed to send traces to Datadog Agent at %s: HTTP error status %s, reason %s",
@@ -241,6 +430,25 @@ class AgentWriter(_worker.PeriodicWorkerThread):
                             result_traces_json["rate_by_service"],
                         )
 
+    def _send_stats(self, endpoint, payload):
+        headers = self._headers.copy()
+        headers["Content-Type"] = "application/msgpack"
+
+        try:
+            response = self._put(payload, headers, endpoint=endpoint)
+        except (httplib.HTTPException, OSError, IOError):
+            log.error("failed to send stats to Datadog Agent at %s", self.agent_url, exc_info=True)
+            self._metrics_dist("stats.http.errors", tags=["type:err"])
+        else:
+            if response.status >= 400:
+                log.error(
+                    "failed to send stats to Datadog Agent at %s: HTTP error status %s, reason %s",
+                    self.agent_url,
+                    response.status,
+                    response.reason,
+                )
+                self._metrics_dist("stats.http.errors", tags=["type:%s" % response.status])
+
     def write(self, spans):
         # Start the AgentWriter on first write.
         # Starting it earlier might be an issue with gevent, see:
@@ -253,58 +461,159 @@ class AgentWriter(_worker.PeriodicWorkerThread):
         if not spans:
             return
 
-        try:
-            encoded = self._encoder.encode_trace(spans)
-        except Exception:
-            log.warning("failed to encode trace with encoder %r", self._encoder, exc_info=True)
+        if self._filters:
+            if len(self._pending) >= self._max_pending_traces:
+                log.warning("pending trace queue (%d traces) is full, dropping trace", len(self._pending))
+                self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:full"])
+                self.awake()
+                return
+            self._pending.append(spans)
+            if len(self._pending) >= self._max_pending_traces // 2:
+                self.awake()
+            return
 
+        self._encode(spans)
+
+    def _encode(self, spans):
         try:
-            self._buffer.put(encoded)
-        except BufferItemTooLarge:
+            if self._api_version == "v0.5":
+                with self._lock:
+                    self._encoder.put(spans)
+            else:
+                self._encoder.put(spans)
+        except BufferItemTooLarge as e:
+            payload_size = e.args[0]
             log.warning(
                 "trace (%db) larger than payload limit (%db), dropping",
-                len(encoded),
+                payload_size,
                 self._max_payload_size,
             )
             self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:t_too_big"])
-            self._metrics_dist("buffer.dropped.bytes", len(encoded), tags=["reason:t_too_big"])
-        except BufferFull:
+            self._metrics_dist("buffer.dropped.bytes", payload_size, tags=["reason:t_too_big"])
+        except BufferFull as e:
+            payload_size = e.args[0]
             log.warning(
                 "trace buffer (%s traces %db/%db) cannot fit trace of size %db, dropping",
-                len(self._buffer),
-                self._buffer.size,
-                self._buffer.max_size,
-                len(encoded),
+                len(self._encoder),
+                self._encoder.size,
+                self._encoder.max_size,
+                payload_size,
             )
             self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:full"])
-            self._metrics_dist("buffer.dropped.bytes", len(encoded), tags=["reason:full"])
+            self._metrics_dist("buffer.dropped.bytes", payload_size, tags=["reason:full"])
+            self.awake()
+        except Exception:
+            log.warning("failed to encode trace with encoder %r", self._encoder, exc_info=True)
         else:
             self._metrics_dist("buffer.accepted.traces", 1)
             self._metrics_dist("buffer.accepted.spans", len(spans))
+            if self._encoder.size >= self._flush_threshold_size:
+                self.awake()
+
+    def _update_interval(self, payload_size):
+        if not payload_size:
+            self.interval = min(self.interval * 2, self._max_processing_interval)
+        elif payload_size >= self._flush_threshold_size:
+            self.interval = max(self.interval / 2.0, self._min_processing_interval)
+        else:
+            self.interval = self._processing_interval
+
+    def _process_pending(self):
+        # Only take the traces queued so far: traces written concurrently are
+        # processed on the next flush.
+        traces = [self._pending.popleft() for _ in range(len(self._pending))]
+        for spans in self._apply_filters(traces):
+            self._encode(spans)
+
+    def _apply_filters(self, traces):
+        for filtr in self._filters:
+            if not traces:
+                break
+            try:
+                if hasattr(filtr, "process_traces"):
+                    traces = filtr.process_traces(traces)
+                else:
+                    traces = [t for t in (filtr.process_trace(t) for t in traces) if t]
+            except Exception:
+                log.error("error while applying filter %s to traces", filtr, exc_info=True)
+        return traces
 
     def flush_queue(self):
-        enc_traces = self._buffer.get()
-        if not enc_traces:
+        if self._pending:
+            self._process_pending()
+
+        with self._lock:
+            encoded, n_traces = self._encoder.encode()
+            endpoint = self._endpoint
+        self._update_interval(len(encoded) if n_traces else 0)
+        if not n_traces:
             return
 
-        encoded = self._encoder.join_encoded(enc_traces)
-        self._send_payload(encoded, len(enc_traces))
+        if self._max_in_flight_requests > 1:
+            self._send_payload_async(encoded, n_traces, endpoint)
+        else:
+            self._send_payload(encoded, n_traces, endpoint=endpoint)
 
         if self._report_metrics:
-            # Note that we cannot use the batching functionality of dogstatsd because
-            # it's not thread-safe.
-            # https://github.com/DataDog/datadogpy/issues/439
-            # This really isn't ideal as now we're going to do a ton of socket calls.
+            # The metrics are packed into as few datagrams as possible since the
+            # batching functionality of dogstatsd is not thread-safe.
+            writer_metrics = self._metrics_reset()
+            metrics = MetricsAggregator(self.dogstatsd)
+            metrics.increment("datadog.tracer.http.requests")
+            metrics.distribution("datadog.tracer.http.sent.bytes", len(encoded))
+            metrics.distribution("datadog.tracer.http.sent.traces", n_traces)
+            for name, metric in writer_metrics.items():
+                metrics.distribution("datadog.tracer.%s" % name, metric["count"], tags=metric["tags"])
+            metrics.flush()
+
+    def _start_senders(self):
+        pid = os.getpid()
+        if self._senders_pid == pid:
+            return
+        # The sender threads of the parent process do not exist after a fork
+        self._senders_pid = pid
+        self._send_queue = compat.Queue(maxsize=self._max_in_flight_requests)
+        self._senders = []
+        for _ in range(self._max_in_flight_requests):
+            thread = threading.Thread(
+                target=self._sender, args=(self._send_queue,), name="%s:send" % self.__class__.__name__
+            )
+            thread.daemon = True
+            thread.start()
+            self._senders.append(thread)
+
+    def _stop_senders(self):
+        if self._senders_pid == os.getpid():
+            for _ in self._senders:
+                self._send_queue.put(None)
+            for thread in self._senders:
+                thread.join(self._timeout)
+        self._senders = []
+        self._senders_pid = None
+
+    def _sender(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            payload, count, endpoint = item
             try:
-                self.dogstatsd.increment("datadog.tracer.http.requests")
-                self.dogstatsd.distribution("datadog.tracer.http.sent.bytes", len(encoded))
-                self.dogstatsd.distribution("datadog.tracer.http.sent.traces", len(enc_traces))
-                for name, metric in self._metrics.items():
-                    self.dogstatsd.distribution("datadog.tracer.%s" % name, metric["count"], tags=metric["tags"])
+                self._send_payload(payload, count, endpoint=endpoint)
+            except Exception:
+                log.error("failed to send traces to Datadog Agent at %s", self.agent_url, exc_info=True)
             finally:
-                self._metrics_reset()
+                self._in_flight.release()
+
+    def _send_payload_async(self, payload, count, endpoint=None):
+        # Block only when the maximum number of requests are in flight
+        self._in_flight.acquire()
+        self._start_senders()
+        self._send_queue.put((payload, count, endpoint))
 
     def run_periodic(self):
         self.flush_queue()
 
-    on_shutdown = run_periodic
+    def on_shutdown(self):
+        self.flush_queue()
+        self._stop_senders()
+        self._close_connections()
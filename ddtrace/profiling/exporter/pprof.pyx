@@ -73,7 +73,9 @@ class _PprofConverter(object):
 
     # A dict where key is a (Location, [Labels]) and value is a a dict.
     # This dict has sample-type (e.g. "cpu-time") as key and the numeric value.
-    _location_values = attr.ib(factory=lambda: collections.defaultdict(dict), init=False, repr=False)
+    _location_values = attr.ib(
+        factory=lambda: collections.defaultdict(lambda: collections.defaultdict(int)), init=False, repr=False
+    )
 
     def _to_Function(self, filename, funcname):
         try:
@@ -122,97 +124,114 @@ class _PprofConverter(object):
 
         return tuple(locations)
 
-    def convert_stack_event(
-        self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, samples
-    ):
-        location_key = (
-            self._to_locations(frames, nframes),
+    def _stack_sample(self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes):
+        """Return the values of the sample of a stack."""
+        return self._location_values[
             (
-                ("thread id", str(thread_id)),
-                ("thread native id", str(thread_native_id)),
-                ("thread name", thread_name),
-                ("trace id", trace_id),
-                ("span id", span_id),
-            ),
-        )
+                self._to_locations(frames, nframes),
+                (
+                    ("thread id", str(thread_id)),
+                    ("thread native id", str(thread_native_id)),
+                    ("thread name", thread_name),
+                    ("trace id", trace_id),
+                    ("span id", span_id),
+                ),
+            )
+        ]
 
-        self._location_values[location_key]["cpu-samples"] = len(samples)
-        self._location_values[location_key]["cpu-time"] = sum(s.cpu_time_ns for s in samples)
-        self._location_values[location_key]["wall-time"] = sum(s.wall_time_ns for s in samples)
+    def _memalloc_sample(self, thread_id, thread_native_id, thread_name, frames, nframes):
+        """Return the values of the sample of a memory allocation stack."""
+        return self._location_values[
+            (
+                self._to_locations(frames, nframes),
+                (
+                    ("thread id", str(thread_id)),
+                    ("thread native id", str(thread_native_id)),
+                    ("thread name", thread_name),
+                ),
+            )
+        ]
 
-    def convert_memalloc_event(self, thread_id, thread_native_id, thread_name, frames, nframes, events):
-        location_key = (
-            self._to_locations(frames, nframes),
+    def _lock_sample(self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes):
+        """Return the values of the sample of a lock stack."""
+        return self._location_values[
             (
-                ("thread id", str(thread_id)),
-                ("thread native id", str(thread_native_id)),
-                ("thread name", thread_name),
-            ),
-        )
+                self._to_locations(frames, nframes),
+                (
+                    ("thread id", str(thread_id)),
+                    ("thread name", thread_name),
+                    ("trace id", trace_id),
+                    ("span id", span_id),
+                    ("lock name", lock_name),
+                ),
+            )
+        ]
 
-        nevents = len(events)
-        sampling_ratio_avg = sum(event.capture_pct for event in events) / nevents / 100.0
-        total_alloc = sum(event.nevents for event in events)
+    def _stack_exception_sample(
+        self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, exc_type_name
+    ):
+        """Return the values of the sample of an exception stack."""
+        return self._location_values[
+            (
+                self._to_locations(frames, nframes),
+                (
+                    ("thread id", str(thread_id)),
+                    ("thread native id", str(thread_native_id)),
+                    ("thread name", thread_name),
+                    ("trace id", trace_id),
+                    ("span id", span_id),
+                    ("exception type", exc_type_name),
+                ),
+            )
+        ]
+
+    @staticmethod
+    def _set_memalloc_values(values, nevents, capture_pct_sum, total_alloc, size_sum):
+        sampling_ratio_avg = capture_pct_sum / nevents / 100.0
         number_of_alloc = total_alloc * sampling_ratio_avg
-        average_alloc_size = sum(event.size for event in events) / float(nevents)
+        average_alloc_size = size_sum / float(nevents)
 
-        self._location_values[location_key]["alloc-samples"] = nevents
-        self._location_values[location_key]["alloc-space"] = round(number_of_alloc * average_alloc_size)
+        values["alloc-samples"] = nevents
+        values["alloc-space"] = round(number_of_alloc * average_alloc_size)
 
-    def convert_lock_acquire_event(
-        self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes, events, sampling_ratio
+    def convert_stack_event(
+        self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, samples
     ):
-        location_key = (
-            self._to_locations(frames, nframes),
-            (
-                ("thread id", str(thread_id)),
-                ("thread name", thread_name),
-                ("trace id", trace_id),
-                ("span id", span_id),
-                ("lock name", lock_name),
-            ),
-        )
+        values = self._stack_sample(thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes)
+        values["cpu-samples"] = len(samples)
+        values["cpu-time"] = sum(s.cpu_time_ns for s in samples)
+        values["wall-time"] = sum(s.wall_time_ns for s in samples)
 
-        self._location_values[location_key]["lock-acquire"] = len(events)
-        self._location_values[location_key]["lock-acquire-wait"] = int(
-            sum(e.wait_time_ns for e in events) / sampling_ratio
+    def convert_memalloc_event(self, thread_id, thread_native_id, thread_name, frames, nframes, events):
+        self._set_memalloc_values(
+            self._memalloc_sample(thread_id, thread_native_id, thread_name, frames, nframes),
+            len(events),
+            sum(event.capture_pct for event in events),
+            sum(event.nevents for event in events),
+            sum(event.size for event in events),
         )
 
-    def convert_lock_release_event(
+    def convert_lock_acquire_event(
         self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes, events, sampling_ratio
     ):
-        location_key = (
-            self._to_locations(frames, nframes),
-            (
-                ("thread id", str(thread_id)),
-                ("thread name", thread_name),
-                ("trace id", trace_id),
-                ("span id", span_id),
-                ("lock name", lock_name),
-            ),
-        )
+        values = self._lock_sample(lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes)
+        values["lock-acquire"] = len(events)
+        values["lock-acquire-wait"] = int(sum(e.wait_time_ns for e in events) / sampling_ratio)
 
-        self._location_values[location_key]["lock-release"] = len(events)
-        self._location_values[location_key]["lock-release-hold"] = int(
-            sum(e.locked_for_ns for e in events) / sampling_ratio
-        )
+    def convert_lock_release_event(
+        self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes, events, sampling_ratio
+    ):
+        values = self._lock_sample(lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes)
+        values["lock-release"] = len(events)
+        values["lock-release-hold"] = int(sum(e.locked_for_ns for e in events) / sampling_ratio)
 
     def convert_stack_exception_event(
         self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, exc_type_name, events
     ):
-        location_key = (
-            self._to_locations(frames, nframes),
-            (
-                ("thread id", str(thread_id)),
-                ("thread native id", str(thread_native_id)),
-                ("thread name", thread_name),
-                ("trace id", trace_id),
-                ("span id", span_id),
-                ("exception type", exc_type_name),
-            ),
+        values = self._stack_exception_sample(
+            thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, exc_type_name
         )
-
-        self._location_values[location_key]["exception-samples"] = len(events)
+        values["exception-samples"] = len(events)
 
     def convert_memory_event(self, stats, sampling_ratio):
         location = tuple(self._to_Location(frame.filename, frame.lineno).id for frame in reversed(stats.traceback))
@@ -258,6 +277,134 @@ class _PprofConverter(object):
         )
 
 
+@attr.s
+class PprofAggregate(object):
+    """Aggregate recorder events in pprof format as they are pushed.
+
+    Used as the aggregate of a `ddtrace.profiling.recorder.Recorder`, the events of the types in ``EVENT_TYPES`` are
+    folded in a `_PprofConverter` as the collectors push them rather than stored until the export. The group key of
+    each event is interned to the values of its sample, so the locations and labels of a stack are only converted the
+    first time it is seen, and the export only has to build the final tables.
+    """
+
+    EVENT_TYPES = frozenset(
+        (
+            stack.StackSampleEvent,
+            stack.StackExceptionSampleEvent,
+            threading.LockAcquireEvent,
+            threading.LockReleaseEvent,
+            memalloc.MemoryAllocSampleEvent,
+        )
+    )
+
+    converter = attr.ib(init=False, factory=_PprofConverter)
+    sum_period = attr.ib(init=False, default=0)
+    nb_event = attr.ib(init=False, default=0)
+
+    # A dict where key is an event type and value is a dict of the group keys of the events to the values of their
+    # sample in the converter. For the lock and memory allocation events, the values are followed by the sums needed
+    # to compute the values once all the events are known.
+    _samples = attr.ib(init=False, factory=lambda: collections.defaultdict(dict), repr=False)
+    # A dict where key is a lock event type and value is the list of the number of events and their sum of sampling_pct
+    _lock_sampling = attr.ib(init=False, factory=lambda: collections.defaultdict(lambda: [0, 0]), repr=False)
+
+    def push_events(self, events):
+        """Aggregate events.
+
+        All the events MUST be of the same type, which MUST be in ``EVENT_TYPES``.
+
+        :param events: The event list to aggregate.
+        """
+        event_type = events[0].__class__
+        samples = self._samples[event_type]
+        if event_type is stack.StackSampleEvent:
+            self._push_stack_events(samples, events)
+        elif event_type is stack.StackExceptionSampleEvent:
+            self._push_stack_exception_events(samples, events)
+        elif event_type is threading.LockAcquireEvent:
+            self._push_lock_events(samples, events, "lock-acquire", "wait_time_ns")
+        elif event_type is threading.LockReleaseEvent:
+            self._push_lock_events(samples, events, "lock-release", "locked_for_ns")
+        else:
+            self._push_memalloc_events(samples, events)
+
+    def _push_stack_events(self, samples, events):
+        for event in events:
+            key = PprofExporter._stack_event_group_key(event)
+            try:
+                values = samples[key]
+            except KeyError:
+                values = samples[key] = self.converter._stack_sample(*key)
+            values["cpu-samples"] += 1
+            values["cpu-time"] += event.cpu_time_ns
+            values["wall-time"] += event.wall_time_ns
+            self.sum_period += event.sampling_period
+            self.nb_event += 1
+
+    def _push_stack_exception_events(self, samples, events):
+        for event in events:
+            key = PprofExporter._stack_exception_group_key(event)
+            try:
+                values = samples[key]
+            except KeyError:
+                values = samples[key] = self.converter._stack_exception_sample(*key)
+            values["exception-samples"] += 1
+
+    def _push_lock_events(self, samples, events, count_name, time_attr):
+        lock_sampling = self._lock_sampling[events[0].__class__]
+        for event in events:
+            key = PprofExporter._lock_event_group_key(event)
+            try:
+                sample = samples[key]
+            except KeyError:
+                sample = samples[key] = [self.converter._lock_sample(*key), 0]
+            sample[0][count_name] += 1
+            sample[1] += getattr(event, time_attr)
+            lock_sampling[0] += 1
+            lock_sampling[1] += event.sampling_pct
+
+    def _push_memalloc_events(self, samples, events):
+        for event in events:
+            key = PprofExporter._stack_event_group_key(event)
+            try:
+                sample = samples[key]
+            except KeyError:
+                thread_id, thread_native_id, thread_name, _, _, frames, nframes = key
+                sample = samples[key] = [
+                    self.converter._memalloc_sample(thread_id, thread_native_id, thread_name, frames, nframes),
+                    0,
+                    0,
+                    0,
+                    0,
+                ]
+            sample[1] += 1
+            sample[2] += event.capture_pct
+            sample[3] += event.nevents
+            sample[4] += event.size
+
+    def to_converter(self):
+        """Return the converter of the aggregated events.
+
+        The values depending on the sampling ratios are computed here, as they are averaged over all the events.
+        """
+        for event_type, time_name in (
+            (threading.LockAcquireEvent, "lock-acquire-wait"),
+            (threading.LockReleaseEvent, "lock-release-hold"),
+        ):
+            nb_events, sampling_pct_sum = self._lock_sampling[event_type]
+            if nb_events:
+                sampling_ratio_avg = sampling_pct_sum / (nb_events * 100.0)
+                for values, time_sum in self._samples[event_type].values():
+                    values[time_name] = int(time_sum / sampling_ratio_avg)
+
+        for values, nevents, capture_pct_sum, total_alloc, size_sum in self._samples[
+            memalloc.MemoryAllocSampleEvent
+        ].values():
+            self.converter._set_memalloc_values(values, nevents, capture_pct_sum, total_alloc, size_sum)
+
+        return self.converter
+
+
 class PprofExporter(exporter.Exporter):
     """Export recorder events to pprof format."""
 
@@ -296,14 +443,15 @@ class PprofExporter(exporter.Exporter):
             return "Anonymous Thread %d" % thread_id
         return thread_name
 
-    def _stack_event_group_key(self, event):
+    @classmethod
+    def _stack_event_group_key(cls, event):
         # If multiple traces were active, we pick only one :(
         return (
             event.thread_id,
             event.thread_native_id,
-            self._get_thread_name(event.thread_id, event.thread_name),
-            self._get_trace_id(event),
-            self._get_span_id(event),
+            cls._get_thread_name(event.thread_id, event.thread_name),
+            cls._get_trace_id(event),
+            cls._get_span_id(event),
             tuple(event.frames),
             event.nframes,
         )
@@ -314,13 +462,14 @@ class PprofExporter(exporter.Exporter):
             key=self._stack_event_group_key,
         )
 
-    def _lock_event_group_key(self, event):
+    @classmethod
+    def _lock_event_group_key(cls, event):
         return (
             event.lock_name,
             event.thread_id,
-            self._get_thread_name(event.thread_id, event.thread_name),
-            self._get_trace_id(event),
-            self._get_span_id(event),
+            cls._get_thread_name(event.thread_id, event.thread_name),
+            cls._get_trace_id(event),
+            cls._get_span_id(event),
             tuple(event.frames),
             event.nframes,
         )
@@ -331,15 +480,16 @@ class PprofExporter(exporter.Exporter):
             key=self._lock_event_group_key,
         )
 
-    def _stack_exception_group_key(self, event):
+    @classmethod
+    def _stack_exception_group_key(cls, event):
         exc_type = event.exc_type
         exc_type_name = exc_type.__module__ + "." + exc_type.__name__
         return (
             event.thread_id,
             event.thread_native_id,
-            self._get_thread_name(event.thread_id, event.thread_name),
-            self._get_trace_id(event),
-            self._get_span_id(event),
+            cls._get_thread_name(event.thread_id, event.thread_name),
+            cls._get_trace_id(event),
+            cls._get_span_id(event),
             tuple(event.frames),
             event.nframes,
             exc_type_name,
@@ -351,12 +501,13 @@ class PprofExporter(exporter.Exporter):
             key=self._stack_exception_group_key,
         )
 
-    def _exception_group_key(self, event):
+    @classmethod
+    def _exception_group_key(cls, event):
         exc_type = event.exc_type
         exc_type_name = exc_type.__module__ + "." + exc_type.__name__
         return (
             event.thread_id,
-            self._get_thread_name(event.thread_id, event.thread_name),
+            cls._get_thread_name(event.thread_id, event.thread_name),
             tuple(event.frames),
             event.nframes,
             exc_type_name,
@@ -396,10 +547,17 @@ class PprofExporter(exporter.Exporter):
         """
         program_name = self._get_program_name()
 
-        sum_period = 0
-        nb_event = 0
-
-        converter = _PprofConverter()
+        # Start from the events aggregated as they were recorded, if any
+        aggregates = events.get(PprofAggregate)
+        if aggregates:
+            (aggregate,) = aggregates
+            converter = aggregate.to_converter()
+            sum_period = aggregate.sum_period
+            nb_event = aggregate.nb_event
+        else:
+            converter = _PprofConverter()
+            sum_period = 0
+            nb_event = 0
 
         # Handle StackSampleEvent
         stack_events = []
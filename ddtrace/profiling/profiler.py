@@ -19,6 +19,7 @@ from ddtrace.profiling.collector import threading
 from ddtrace.profiling import exporter
 from ddtrace.profiling.exporter import file
 from ddtrace.profiling.exporter import http
+from ddtrace.profiling.exporter import pprof
 
 
 LOG = logging.getLogger(__name__)
@@ -257,6 +258,11 @@ class _ProfilerInstance(object):
                 ),
             },
             default_max_events=int(os.environ.get("DD_PROFILING_MAX_EVENTS", recorder.Recorder._DEFAULT_MAX_EVENTS)),
+            aggregate_factory=(
+                pprof.PprofAggregate
+                if formats.asbool(os.environ.get("DD_PROFILING_AGGREGATE_EVENTS", "false"))
+                else None
+            ),
         )
 
         if formats.asbool(os.environ.get("DD_PROFILING_MEMALLOC", "true")):
@@ -31,7 +31,14 @@ class Recorder(object):
     max_events = attr.ib(factory=dict)
     """A dict of {event_type_class: max events} to limit the number of events to record."""
 
+    aggregate_factory = attr.ib(default=None, repr=False)
+    """A callable returning an aggregate of events, e.g. `ddtrace.profiling.exporter.pprof.PprofAggregate`.
+
+    The events of the types in the ``EVENT_TYPES`` of the aggregate are passed to its ``push_events`` method as they are
+    pushed rather than stored. The aggregate is returned by `reset` as the only event of its type."""
+
     events = attr.ib(init=False, repr=False)
+    _aggregate = attr.ib(init=False, repr=False, default=None)
     _events_lock = attr.ib(init=False, repr=False, factory=_nogevent.DoubleLock)
     _pid = attr.ib(init=False, repr=False, factory=os.getpid)
 
@@ -60,14 +67,19 @@ class Recorder(object):
         if events and os.getpid() == self._pid:
             event_type = events[0].__class__
             with self._events_lock:
-                q = self.events[event_type]
-                q.extend(events)
+                if self._aggregate is not None and event_type in self._aggregate.EVENT_TYPES:
+                    self._aggregate.push_events(events)
+                else:
+                    q = self.events[event_type]
+                    q.extend(events)
 
     def _get_deque_for_event_type(self, event_type):
         return collections.deque(maxlen=self.max_events.get(event_type, self.default_max_events))
 
     def _reset_events(self):
         self.events = _defaultdictkey(self._get_deque_for_event_type)
+        if self.aggregate_factory is not None:
+            self._aggregate = self.aggregate_factory()
 
     def reset(self):
         """Reset the recorder.
@@ -79,5 +91,8 @@ class Recorder(object):
         """
         with self._events_lock:
             events = self.events
+            aggregate = self._aggregate
             self._reset_events()
+        if aggregate is not None:
+            events[aggregate.__class__] = [aggregate]
         return events
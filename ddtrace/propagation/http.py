@@ -1,5 +1,7 @@
 from ..context import Context
+from ..ext.priority import AUTO_KEEP, AUTO_REJECT, USER_KEEP
 from ..internal.logger import get_logger
+from ..settings import config
 
 from .utils import get_wsgi_header
 
@@ -28,6 +30,250 @@ POSSIBLE_HTTP_HEADER_ORIGIN = frozenset(
     [HTTP_HEADER_ORIGIN, get_wsgi_header(HTTP_HEADER_ORIGIN)]
 )
 
+# Propagation styles, set with DD_PROPAGATION_STYLE_EXTRACT and
+# DD_PROPAGATION_STYLE_INJECT.
+PROPAGATION_STYLE_DATADOG = 'datadog'
+PROPAGATION_STYLE_B3 = 'b3'
+PROPAGATION_STYLE_B3_SINGLE_HEADER = 'b3 single header'
+PROPAGATION_STYLE_TRACECONTEXT = 'tracecontext'
+
+HTTP_HEADER_B3_TRACE_ID = 'x-b3-traceid'
+HTTP_HEADER_B3_SPAN_ID = 'x-b3-spanid'
+HTTP_HEADER_B3_SAMPLED = 'x-b3-sampled'
+HTTP_HEADER_B3_FLAGS = 'x-b3-flags'
+HTTP_HEADER_B3_SINGLE = 'b3'
+HTTP_HEADER_TRACEPARENT = 'traceparent'
+
+
+class _HeaderTable(object):
+    """Look up a set of headers in a carrier in a single pass.
+
+    The values are returned in the order of the header names.
+    """
+
+    __slots__ = ('_canonical_names', '_indexes', '_lengths', '_size')
+
+    def __init__(self, *names):
+        # Canonical forms of the header names, that can be looked up directly.
+        self._canonical_names = (names, tuple(get_wsgi_header(name) for name in names))
+        # Lower case forms of the header names mapped to their index.
+        self._indexes = dict(
+            (name.lower(), index) for names in self._canonical_names for index, name in enumerate(names)
+        )
+        self._lengths = frozenset(len(name) for name in self._indexes)
+        self._size = len(names)
+
+    def extract(self, headers):
+        # Fast path for carriers holding the headers in one of their canonical
+        # forms (e.g. lower case names or case-insensitive mappings, and the
+        # WSGI environ). The first header is looked up to find the form used.
+        get = headers.get
+        for names in self._canonical_names:
+            value = get(names[0])
+            if value is not None:
+                values = [value] + [get(name) for name in names[1:]]
+                if None not in values:
+                    return values
+                # The other headers may be missing or use another case
+                break
+        else:
+            values = [None] * self._size
+
+        # Look for the missing headers in a single pass, only lowering the
+        # names that can match.
+        for header, value in headers.items():
+            if len(header) in self._lengths:
+                index = self._indexes.get(header.lower())
+                if index is not None and values[index] is None:
+                    values[index] = value
+        return values
+
+
+class _PropagatedIds(object):
+    """The ids of a span context, formatted once for all the injected styles."""
+
+    __slots__ = ('_trace_id', '_span_id', '_decimal', '_hex')
+
+    def __init__(self, span_context):
+        self._trace_id = span_context.trace_id
+        self._span_id = span_context.span_id
+        self._decimal = None
+        self._hex = None
+
+    @property
+    def decimal(self):
+        if self._decimal is None:
+            self._decimal = (str(self._trace_id), str(self._span_id))
+        return self._decimal
+
+    @property
+    def hex(self):
+        """The 128 bits trace id and the 64 bits span id as hexadecimal strings."""
+        if self._hex is None:
+            self._hex = ('%032x' % self._trace_id, '%016x' % self._span_id)
+        return self._hex
+
+
+def _hex_trace_id(value):
+    # Only the lower 64 bits of 128 bits trace ids are kept
+    return int(value[-16:], 16)
+
+
+class _DatadogStyle(object):
+    _headers = _HeaderTable(
+        HTTP_HEADER_TRACE_ID, HTTP_HEADER_PARENT_ID, HTTP_HEADER_SAMPLING_PRIORITY, HTTP_HEADER_ORIGIN
+    )
+
+    @classmethod
+    def extract(cls, headers):
+        trace_id, parent_span_id, sampling_priority, origin = cls._headers.extract(headers)
+        if trace_id is None and parent_span_id is None and sampling_priority is None and origin is None:
+            return None
+
+        return Context(
+            trace_id=int(trace_id) if trace_id is not None else 0,
+            span_id=int(parent_span_id) if parent_span_id is not None else 0,
+            sampling_priority=int(sampling_priority) if sampling_priority is not None else None,
+            _dd_origin=origin,
+        )
+
+    @staticmethod
+    def inject(span_context, ids, headers):
+        headers[HTTP_HEADER_TRACE_ID], headers[HTTP_HEADER_PARENT_ID] = ids.decimal
+        sampling_priority = span_context.sampling_priority
+        # Propagate priority only if defined
+        if sampling_priority is not None:
+            headers[HTTP_HEADER_SAMPLING_PRIORITY] = str(sampling_priority)
+        # Propagate origin only if defined
+        if span_context._dd_origin is not None:
+            headers[HTTP_HEADER_ORIGIN] = str(span_context._dd_origin)
+
+
+class _B3Style(object):
+    _headers = _HeaderTable(
+        HTTP_HEADER_B3_TRACE_ID, HTTP_HEADER_B3_SPAN_ID, HTTP_HEADER_B3_SAMPLED, HTTP_HEADER_B3_FLAGS
+    )
+
+    @staticmethod
+    def _sampling_priority(sampled, flags=None):
+        if flags == '1' or sampled == 'd':
+            return USER_KEEP
+        if sampled in ('1', 'true'):
+            return AUTO_KEEP
+        if sampled in ('0', 'false'):
+            return AUTO_REJECT
+        return None
+
+    @classmethod
+    def extract(cls, headers):
+        trace_id, span_id, sampled, flags = cls._headers.extract(headers)
+        if trace_id is None or span_id is None:
+            return None
+
+        return Context(
+            trace_id=_hex_trace_id(trace_id),
+            span_id=int(span_id, 16),
+            sampling_priority=cls._sampling_priority(sampled, flags),
+        )
+
+    @staticmethod
+    def inject(span_context, ids, headers):
+        trace_id, span_id = ids.hex
+        headers[HTTP_HEADER_B3_TRACE_ID] = trace_id[16:]
+        headers[HTTP_HEADER_B3_SPAN_ID] = span_id
+        sampling_priority = span_context.sampling_priority
+        if sampling_priority is not None:
+            headers[HTTP_HEADER_B3_SAMPLED] = '1' if sampling_priority > 0 else '0'
+
+
+class _B3SingleHeaderStyle(_B3Style):
+    _headers = _HeaderTable(HTTP_HEADER_B3_SINGLE)
+
+    @classmethod
+    def extract(cls, headers):
+        (value,) = cls._headers.extract(headers)
+        if value is None:
+            return None
+
+        # {trace_id}-{span_id}[-{sampling_state}[-{parent_span_id}]] or only {sampling_state}
+        parts = value.split('-')
+        if len(parts) == 1:
+            return Context(sampling_priority=cls._sampling_priority(parts[0]))
+
+        return Context(
+            trace_id=_hex_trace_id(parts[0]),
+            span_id=int(parts[1], 16),
+            sampling_priority=cls._sampling_priority(parts[2]) if len(parts) > 2 else None,
+        )
+
+    @staticmethod
+    def inject(span_context, ids, headers):
+        trace_id, span_id = ids.hex
+        sampling_priority = span_context.sampling_priority
+        if sampling_priority is None:
+            headers[HTTP_HEADER_B3_SINGLE] = '%s-%s' % (trace_id[16:], span_id)
+        else:
+            headers[HTTP_HEADER_B3_SINGLE] = '%s-%s-%s' % (trace_id[16:], span_id, 1 if sampling_priority > 0 else 0)
+
+
+class _TraceContextStyle(object):
+    _headers = _HeaderTable(HTTP_HEADER_TRACEPARENT)
+
+    @classmethod
+    def extract(cls, headers):
+        (value,) = cls._headers.extract(headers)
+        if value is None:
+            return None
+
+        # {version}-{trace_id}-{parent_id}-{trace_flags}
+        version, trace_id, span_id, flags = value.strip().split('-')[:4]
+        if version == 'ff' or len(trace_id) != 32 or len(span_id) != 16:
+            raise ValueError('invalid traceparent header %r' % value)
+
+        return Context(
+            trace_id=_hex_trace_id(trace_id),
+            span_id=int(span_id, 16),
+            sampling_priority=AUTO_KEEP if int(flags, 16) & 1 else AUTO_REJECT,
+        )
+
+    @staticmethod
+    def inject(span_context, ids, headers):
+        trace_id, span_id = ids.hex
+        sampling_priority = span_context.sampling_priority
+        # Traces without a sampling decision are kept by the tracer
+        sampled = sampling_priority is None or sampling_priority > 0
+        headers[HTTP_HEADER_TRACEPARENT] = '00-%s-%s-%s' % (trace_id, span_id, '01' if sampled else '00')
+
+
+_PROPAGATION_STYLES = {
+    PROPAGATION_STYLE_DATADOG: _DatadogStyle,
+    PROPAGATION_STYLE_B3: _B3Style,
+    PROPAGATION_STYLE_B3_SINGLE_HEADER: _B3SingleHeaderStyle,
+    PROPAGATION_STYLE_TRACECONTEXT: _TraceContextStyle,
+}
+
+# Resolved styles by configured names
+_resolved_styles = {}
+
+
+def _get_styles(names):
+    try:
+        return _resolved_styles[names]
+    except KeyError:
+        pass
+
+    styles = []
+    for name in names:
+        style = _PROPAGATION_STYLES.get(name.strip().lower())
+        if style is None:
+            log.warning(
+                'unsupported propagation style %r, expected one of %s', name, ', '.join(sorted(_PROPAGATION_STYLES))
+            )
+        elif style not in styles:
+            styles.append(style)
+    styles = _resolved_styles[names] = tuple(styles)
+    return styles
+
 
 class HTTPPropagator(object):
     """A HTTP Propagator using HTTP headers as carrier."""
@@ -51,15 +297,9 @@ class HTTPPropagator(object):
         :param Context span_context: Span context to propagate.
         :param dict headers: HTTP headers to extend with tracing attributes.
         """
-        headers[HTTP_HEADER_TRACE_ID] = str(span_context.trace_id)
-        headers[HTTP_HEADER_PARENT_ID] = str(span_context.span_id)
-        sampling_priority = span_context.sampling_priority
-        # Propagate priority only if defined
-        if sampling_priority is not None:
-            headers[HTTP_HEADER_SAMPLING_PRIORITY] = str(span_context.sampling_priority)
-        # Propagate origin only if defined
-        if span_context._dd_origin is not None:
-            headers[HTTP_HEADER_ORIGIN] = str(span_context._dd_origin)
+        ids = _PropagatedIds(span_context)
+        for style in _get_styles(config._propagation_style_inject):
+            style.inject(span_context, ids, headers)
 
     @staticmethod
     def extract_header_value(possible_header_names, headers, default=None):
@@ -119,29 +359,16 @@ class HTTPPropagator(object):
         if not headers:
             return Context()
 
-        try:
-            trace_id = HTTPPropagator.extract_trace_id(headers)
-            parent_span_id = HTTPPropagator.extract_parent_span_id(headers)
-            sampling_priority = HTTPPropagator.extract_sampling_priority(headers)
-            origin = HTTPPropagator.extract_origin(headers)
+        # The context is extracted from the first configured style found in
+        # the headers.
+        for style in _get_styles(config._propagation_style_extract):
+            try:
+                context = style.extract(headers)
+            # If headers are invalid and cannot be parsed, log the issue and try the next style.
+            except Exception:
+                log.debug('invalid %s headers: %r', style.__name__, headers, exc_info=True)
+                continue
+            if context is not None:
+                return context
 
-            if sampling_priority is not None:
-                sampling_priority = int(sampling_priority)
-
-            return Context(
-                trace_id=trace_id,
-                span_id=parent_span_id,
-                sampling_priority=sampling_priority,
-                _dd_origin=origin,
-            )
-        # If headers are invalid and cannot be parsed, return a new context and log the issue.
-        except Exception:
-            log.debug(
-                'invalid x-datadog-* headers, trace-id: %s, parent-id: %s, priority: %s, origin: %s',
-                headers.get(HTTP_HEADER_TRACE_ID, 0),
-                headers.get(HTTP_HEADER_PARENT_ID, 0),
-                headers.get(HTTP_HEADER_SAMPLING_PRIORITY),
-                headers.get(HTTP_HEADER_ORIGIN, ''),
-                exc_info=True,
-            )
-            return Context()
+        return Context()
@@ -10,6 +10,7 @@ from .constants import SAMPLING_AGENT_DECISION, SAMPLING_RULE_DECISION, SAMPLING
 from .ext.priority import AUTO_KEEP, AUTO_REJECT
 from .internal.logger import get_logger
 from .internal.rate_limiter import RateLimiter
+from .internal.rate_limiter import ShardedRateLimiter
 from .utils.formats import get_env
 from .vendor import six
 
@@ -66,11 +67,48 @@ class RateSampler(BaseSampler):
         return ((span.trace_id * KNUTH_FACTOR) % MAX_TRACE_ID) <= self.sampling_id_threshold
 
 
+class _RateByServiceTable(object):
+    """Immutable table of the samplers of a :class:`RateByServiceSampler`
+
+    ``samplers`` maps the keys used by the Datadog agent API to the samplers,
+    ``by_service`` maps the same samplers to ``(service, env)`` tuples so that
+    they can be looked up without formatting a key.
+    """
+
+    __slots__ = ("samplers", "by_service", "default")
+
+    def __init__(self, samplers, default_key):
+        self.samplers = samplers
+        self.default = samplers[default_key]
+        self.by_service = {}
+        for key, sampler in iteritems(samplers):
+            service_env = self._parse_key(key)
+            if service_env is not None:
+                self.by_service[service_env] = sampler
+
+    @staticmethod
+    def _parse_key(key):
+        # The keys are formatted as "service:<service>,env:<env>"
+        prefix, sep, service_env = key.partition("service:")
+        if prefix or not sep:
+            return None
+        service, sep, env = service_env.rpartition(",env:")
+        if not sep:
+            return None
+        return (service, env)
+
+    def get(self, service, env):
+        return self.by_service.get((service or "", env or ""), self.default)
+
+
 class RateByServiceSampler(BaseSampler, BasePrioritySampler):
     """Sampler based on a rate, by service
 
     Keep (100 * `sample_rate`)% of the traces.
     The sample rate is kept independently for each service/env tuple.
+
+    The samplers are stored in an immutable table which is replaced as a whole
+    when the rates are updated, so that :meth:`sample` never needs a lock.
     """
 
     @staticmethod
@@ -82,20 +120,25 @@ class RateByServiceSampler(BaseSampler, BasePrioritySampler):
 
     def __init__(self, sample_rate=1):
         self.sample_rate = sample_rate
-        self._by_service_samplers = self._get_new_by_service_sampler()
+        self._table = _RateByServiceTable(self._get_new_by_service_sampler(), self._default_key)
+
+    @property
+    def _by_service_samplers(self):
+        return self._table.samplers
 
     def _get_new_by_service_sampler(self):
         return {self._default_key: RateSampler(self.sample_rate)}
 
     def set_sample_rate(self, sample_rate, service="", env=""):
-        self._by_service_samplers[self._key(service, env)] = RateSampler(sample_rate)
+        samplers = dict(self._table.samplers)
+        samplers[self._key(service, env)] = RateSampler(sample_rate)
+        self._table = _RateByServiceTable(samplers, self._default_key)
 
     def sample(self, span):
         tags = span.tracer.tags
         env = tags[ENV_KEY] if ENV_KEY in tags else None
-        key = self._key(span.service, env)
 
-        sampler = self._by_service_samplers.get(key, self._by_service_samplers[self._default_key])
+        sampler = self._table.get(span.service, env)
         span.set_metric(SAMPLING_AGENT_DECISION, sampler.sample_rate)
         return sampler.sample(span)
 
@@ -104,7 +147,9 @@ class RateByServiceSampler(BaseSampler, BasePrioritySampler):
         for key, sample_rate in iteritems(rate_by_service):
             new_by_service_samplers[key] = RateSampler(sample_rate)
 
-        self._by_service_samplers = new_by_service_samplers
+        # DEV: the table is built before being swapped in, threads sampling
+        #   concurrently use either the previous or the new table.
+        self._table = _RateByServiceTable(new_by_service_samplers, self._default_key)
 
 
 # Default key for service with no specific rate
@@ -112,13 +157,13 @@ RateByServiceSampler._default_key = RateByServiceSampler._key()
 
 
 class DatadogSampler(BaseSampler, BasePrioritySampler):
-    __slots__ = ("default_sampler", "limiter", "rules")
+    __slots__ = ("default_sampler", "limiter", "_rules", "_rule_index", "_rule_index_revision")
 
     NO_RATE_LIMIT = -1
     DEFAULT_RATE_LIMIT = 100
     DEFAULT_SAMPLE_RATE = None
 
-    def __init__(self, rules=None, default_sample_rate=None, rate_limit=None):
+    def __init__(self, rules=None, default_sample_rate=None, rate_limit=None, rate_limit_shards=None):
         """
         Constructor for DatadogSampler sampler
 
@@ -130,6 +175,9 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         :param rate_limit: Global rate limit (traces per second) to apply to all traces regardless of the rules
             applied to them, (default: ``100``)
         :type rate_limit: :obj:`int`
+        :param rate_limit_shards: Number of shards to split the rate limit across to reduce lock contention
+            between threads, see :class:`ddtrace.internal.rate_limiter.ShardedRateLimiter` (default: ``1``)
+        :type rate_limit_shards: :obj:`int`
         """
         if default_sample_rate is None:
             # If no sample rate was provided explicitly in code, try to load from environment variable
@@ -157,13 +205,31 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         self.rules = rules
 
         # Configure rate limiter
-        self.limiter = RateLimiter(rate_limit)
+        if rate_limit_shards is not None and rate_limit_shards > 1:
+            self.limiter = ShardedRateLimiter(rate_limit, shards=rate_limit_shards)
+        else:
+            self.limiter = RateLimiter(rate_limit)
 
         # Default to previous default behavior of RateByServiceSampler
         self.default_sampler = RateByServiceSampler()
         if default_sample_rate is not None:
             self.default_sampler = SamplingRule(sample_rate=default_sample_rate)
 
+    @property
+    def rules(self):
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        # DEV: the rules are copied in a list tracking its modifications so
+        #   that they are indexed again when they are changed in place.
+        self._rules = _SamplingRules(rules)
+        self._index_rules()
+
+    def _index_rules(self):
+        self._rule_index = _SamplingRuleIndex(self._rules)
+        self._rule_index_revision = self._rules.revision
+
     def update_rate_by_service_sample_rates(self, sample_rates):
         # Pass through the call to our RateByServiceSampler
         if isinstance(self.default_sampler, RateByServiceSampler):
@@ -185,15 +251,13 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         :returns: Whether the span was sampled or not
         :rtype: :obj:`bool`
         """
-        # If there are rules defined, then iterate through them and find one that wants to sample
-        matching_rule = None
-        # Go through all rules and grab the first one that matched
+        if self._rule_index_revision != self._rules.revision:
+            self._index_rules()
+
+        # Grab the first rule that matches
         # DEV: This means rules should be ordered by the user from most specific to least specific
-        for rule in self.rules:
-            if rule.matches(span):
-                matching_rule = rule
-                break
-        else:
+        matching_rule = self._rule_index.match(span)
+        if matching_rule is None:
             # If this is the old sampler, sample and return
             if isinstance(self.default_sampler, RateByServiceSampler):
                 if self.default_sampler.sample(span):
@@ -359,3 +423,328 @@ class SamplingRule(BaseSampler):
         )
 
     __str__ = __repr__
+
+
+def _is_exact_pattern(pattern):
+    if pattern is SamplingRule.NO_RULE:
+        return True
+    if callable(pattern) or isinstance(pattern, pattern_type):
+        return False
+    try:
+        hash(pattern)
+    except TypeError:
+        return False
+    return True
+
+
+class _SamplingRules(list):
+    """The sampling rules of a :class:`DatadogSampler`.
+
+    The modifications are counted in ``revision`` so that the rules are
+    indexed again when they are changed in place.
+    """
+
+    __slots__ = ("revision",)
+
+    def __init__(self, *args):
+        super(_SamplingRules, self).__init__(*args)
+        self.revision = 0
+
+    def __setitem__(self, index, rule):
+        super(_SamplingRules, self).__setitem__(index, rule)
+        self.revision += 1
+
+    def __delitem__(self, index):
+        super(_SamplingRules, self).__delitem__(index)
+        self.revision += 1
+
+    def __iadd__(self, rules):
+        self.revision += 1
+        return super(_SamplingRules, self).__iadd__(rules)
+
+    def __imul__(self, n):
+        self.revision += 1
+        return super(_SamplingRules, self).__imul__(n)
+
+    def append(self, rule):
+        super(_SamplingRules, self).append(rule)
+        self.revision += 1
+
+    def extend(self, rules):
+        super(_SamplingRules, self).extend(rules)
+        self.revision += 1
+
+    def insert(self, index, rule):
+        super(_SamplingRules, self).insert(index, rule)
+        self.revision += 1
+
+    def pop(self, *args):
+        self.revision += 1
+        return super(_SamplingRules, self).pop(*args)
+
+    def remove(self, rule):
+        super(_SamplingRules, self).remove(rule)
+        self.revision += 1
+
+    def clear(self):
+        del self[:]
+
+    def reverse(self):
+        super(_SamplingRules, self).reverse()
+        self.revision += 1
+
+    def sort(self, *args, **kwargs):
+        super(_SamplingRules, self).sort(*args, **kwargs)
+        self.revision += 1
+
+
+class _SamplingRuleIndex(object):
+    """Find the first :class:`SamplingRule` matching a span.
+
+    Rules matching service and name exactly are indexed by the values they
+    match. The other rules (regular expressions, callables or custom rules)
+    are evaluated in order, only while they come before the first indexed
+    rule found. When the rules are deterministic, the rule matching each
+    ``(service, name)`` pair is cached.
+    """
+
+    __slots__ = ("_by_service_name", "_by_service", "_by_name", "_any", "_fallback", "_cache", "_cache_size")
+
+    def __init__(self, rules, cache_size=1024):
+        # Indexed rules are stored as (position, rule) to keep the first match
+        self._by_service_name = {}
+        self._by_service = {}
+        self._by_name = {}
+        self._any = None
+        self._fallback = []
+        cacheable = True
+
+        for position, rule in enumerate(rules):
+            entry = (position, rule)
+            if type(rule) is not SamplingRule or not (_is_exact_pattern(rule.service) and _is_exact_pattern(rule.name)):
+                self._fallback.append(entry)
+                # Only regular expressions are known to give the same result
+                # for the same service and name
+                if type(rule) is not SamplingRule or callable(rule.service) or callable(rule.name):
+                    cacheable = False
+            elif rule.service is SamplingRule.NO_RULE and rule.name is SamplingRule.NO_RULE:
+                if self._any is None:
+                    self._any = entry
+            elif rule.name is SamplingRule.NO_RULE:
+                self._by_service.setdefault(rule.service, entry)
+            elif rule.service is SamplingRule.NO_RULE:
+                self._by_name.setdefault(rule.name, entry)
+            else:
+                self._by_service_name.setdefault((rule.service, rule.name), entry)
+
+        self._cache = {} if cacheable else None
+        self._cache_size = cache_size
+
+    def match(self, span):
+        """Return the first rule matching the span or ``None``."""
+        if self._cache is None:
+            return self._match(span)
+
+        key = (span.service, span.name)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Values that cannot be hashed are not cached
+            return self._match(span)
+
+        rule = self._match(span)
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[key] = rule
+        return rule
+
+    def _match(self, span):
+        service = span.service
+        name = span.name
+
+        first = self._any
+        try:
+            candidates = (
+                self._by_service_name.get((service, name)),
+                self._by_service.get(service),
+                self._by_name.get(name),
+            )
+        except TypeError:
+            # Values that cannot be hashed cannot be equal to indexed patterns
+            candidates = ()
+        for candidate in candidates:
+            if candidate is not None and (first is None or candidate[0] < first[0]):
+                first = candidate
+
+        for position, rule in self._fallback:
+            if first is not None and position > first[0]:
+                break
+            if rule.matches(span):
+                return rule
+
+        return first[1] if first is not None else None
+
+
+class TailSamplingRule(object):
+    """
+    Definition of a rule used by :class:`TailSampler` for applying a sample rate on a complete trace
+    """
+
+    __slots__ = ("_rule", "min_duration", "error", "min_spans")
+
+    def __init__(self, sample_rate, min_duration=None, error=None, min_spans=None):
+        """
+        Configure a new :class:`TailSamplingRule`
+
+        A trace matches the rule when it matches all of the conditions set.
+
+        .. code:: python
+
+            TailSampler([
+                # Keep all the traces with an error
+                TailSamplingRule(sample_rate=1.0, error=True),
+
+                # Keep half of the traces lasting more than 2 seconds
+                TailSamplingRule(sample_rate=0.5, min_duration=2.0),
+
+                # Keep all the traces with at least 100 spans
+                TailSamplingRule(sample_rate=1.0, min_spans=100),
+            ])
+
+        :param sample_rate: The sample rate to apply to any matching trace
+        :type sample_rate: :obj:`float` greater than or equal to 0.0 and less than or equal to 1.0
+        :param min_duration: Minimal duration of the root span of the trace in seconds, default no rule defined
+        :type min_duration: :obj:`float`
+        :param error: Whether the trace must have an erroneous span (``True``) or none (``False``),
+            default no rule defined
+        :type error: :obj:`bool`
+        :param min_spans: Minimal number of spans in the trace, default no rule defined
+        :type min_spans: :obj:`int`
+        """
+        self._rule = SamplingRule(sample_rate=sample_rate)
+        self.min_duration = min_duration
+        self.error = error
+        self.min_spans = min_spans
+
+    @property
+    def sample_rate(self):
+        return self._rule.sample_rate
+
+    def matches(self, trace):
+        """
+        Return if this complete trace matches this rule
+
+        :param trace: The spans of the trace, the root span being the first one
+        :type trace: :obj:`list` of :class:`ddtrace.span.Span`
+        :returns: Whether this trace matches or not
+        :rtype: :obj:`bool`
+        """
+        if self.min_spans is not None and len(trace) < self.min_spans:
+            return False
+        if self.min_duration is not None and (trace[0].duration or 0) < self.min_duration:
+            return False
+        if self.error is not None and any(span.error for span in trace) is not bool(self.error):
+            return False
+        return True
+
+    def sample(self, span):
+        """
+        Return if this rule chooses to sample the trace of the span
+
+        :param span: The root span of the trace
+        :type span: :class:`ddtrace.span.Span`
+        :returns: Whether this trace was sampled
+        :rtype: :obj:`bool`
+        """
+        return self._rule.sample(span)
+
+    def __repr__(self):
+        return "{}(sample_rate={!r}, min_duration={!r}, error={!r}, min_spans={!r})".format(
+            self.__class__.__name__,
+            self.sample_rate,
+            self.min_duration,
+            self.error,
+            self.min_spans,
+        )
+
+    __str__ = __repr__
+
+
+class TailSampler(object):
+    """
+    Sampler deciding whether to keep a trace once all of its spans are finished
+
+    The sampling decision made when the root span started is kept unless one of
+    the rules matches the complete trace, in which case the first matching rule
+    decides. Only the automatic sampling priorities (``AUTO_KEEP`` and
+    ``AUTO_REJECT``) are changed, the priorities set by the user are left
+    untouched.
+
+    Services called by the trace received the sampling priority decided when
+    the root span started: a decision changed when the trace completes only
+    applies to the spans of this service.
+    """
+
+    __slots__ = ("rules", "limiter", "drop_rejected")
+
+    def __init__(self, rules=None, rate_limit=None, drop_rejected=False):
+        """
+        Constructor for TailSampler
+
+        :param rules: List of :class:`TailSamplingRule` rules to apply to every complete trace, default no rules
+        :type rules: :obj:`list` of :class:`TailSamplingRule`
+        :param rate_limit: Rate limit (traces per second) to apply to the traces kept by the rules,
+            default no rate limit
+        :type rate_limit: :obj:`int`
+        :param drop_rejected: Whether to drop the traces with the ``AUTO_REJECT`` sampling priority
+            instead of sending them to the agent. The agent then computes its metrics without them.
+        :type drop_rejected: :obj:`bool`
+        """
+        rules = rules or []
+        for rule in rules:
+            if not isinstance(rule, TailSamplingRule):
+                raise TypeError("Rule {!r} must be a sub-class of type ddtrace.sampler.TailSamplingRule".format(rule))
+        self.rules = rules
+        self.limiter = RateLimiter(rate_limit) if rate_limit is not None else None
+        self.drop_rejected = drop_rejected
+
+    def _keep(self, trace):
+        for rule in self.rules:
+            if rule.matches(trace):
+                if not rule.sample(trace[0]):
+                    return False
+                return self.limiter is None or self.limiter.is_allowed()
+        return None
+
+    def sample(self, trace, sampled, sampling_priority):
+        """
+        Decide whether the complete trace should be kept or not
+
+        :param trace: The spans of the trace, the root span being the first one
+        :type trace: :obj:`list` of :class:`ddtrace.span.Span`
+        :param sampled: Whether the trace was sampled when the root span started
+        :type sampled: :obj:`bool`
+        :param sampling_priority: The sampling priority of the trace, ``None`` without priority sampling
+        :type sampling_priority: :obj:`int`
+        :returns: Whether the trace is sampled and its sampling priority
+        :rtype: :obj:`tuple` of (:obj:`bool`, :obj:`int`)
+        """
+        if not trace or sampling_priority not in (None, AUTO_KEEP, AUTO_REJECT):
+            return sampled, sampling_priority
+
+        keep = self._keep(trace)
+        if sampling_priority is None:
+            return (sampled if keep is None else keep), None
+
+        if keep is not None:
+            sampling_priority = AUTO_KEEP if keep else AUTO_REJECT
+        if sampling_priority == AUTO_REJECT and self.drop_rejected:
+            return False, sampling_priority
+        return sampled, sampling_priority
+
+    def __repr__(self):
+        return "{}(rules={!r}, drop_rejected={!r})".format(self.__class__.__name__, self.rules, self.drop_rejected)
+
+    __str__ = __repr__
@@ -32,6 +32,12 @@ def _deepmerge(source, destination):
     return destination
 
 
+def _parse_propagation_styles(value):
+    if not value:
+        return ("datadog",)
+    return tuple(style.strip() for style in value.split(",") if style.strip())
+
+
 class Config(object):
     """Configuration object that exposes an API to set and retrieve
     global settings for each integration. All integrations must use
@@ -73,6 +79,23 @@ class Config(object):
 
         self.health_metrics_enabled = asbool(get_env("trace", "health_metrics_enabled", default=False))
 
+        # Compute the trace metrics in the tracer instead of the agent
+        self._compute_stats = asbool(get_env("trace", "compute_stats", default=False))
+
+        # Tag the local root spans with the time spent in the garbage collector
+        self._gc_span_tag = asbool(get_env("runtime_metrics", "gc_span_tag", default=False))
+
+        # Comma-separated lists of the distributed tracing header formats to
+        # extract (first match wins) and to inject.
+        self._propagation_style_extract = _parse_propagation_styles(os.getenv("DD_PROPAGATION_STYLE_EXTRACT"))
+        self._propagation_style_inject = _parse_propagation_styles(os.getenv("DD_PROPAGATION_STYLE_INJECT"))
+
+    def __setattr__(self, name, value):
+        super(Config, self).__setattr__(name, value)
+        # Keep track of changes so that values derived from the global
+        # settings (e.g. span templates) can be recomputed.
+        self.__dict__["_revision"] = self.__dict__.get("_revision", 0) + 1
+
     def __getattr__(self, name):
         if name not in self._config:
             self._config[name] = IntegrationConfig(self, name)
@@ -6,6 +6,7 @@ from typing import Optional, List
 from .vendor import six
 from .compat import StringIO, stringify, iteritems, numeric_types, time_ns, is_integer
 from .constants import (
+    GC_TIME_KEY,
     NUMERIC_TAGS,
     MANUAL_DROP_KEY,
     MANUAL_KEEP_KEY,
@@ -31,9 +32,9 @@ class Span(object):
         "span_id",
         "trace_id",
         "parent_id",
-        "meta",
+        "_meta",
         "error",
-        "metrics",
+        "_metrics",
         "_span_type",
         "start_ns",
         "duration_ns",
@@ -87,9 +88,11 @@ class Span(object):
         self.span_type = span_type
 
         # tags / metadata
-        self.meta = {}
+        # DEV: many spans never get any tag, the dicts are only allocated on
+        # first access to ``meta`` and ``metrics``.
+        self._meta = None
         self.error = 0
-        self.metrics = {}
+        self._metrics = None
 
         # timing
         self.start_ns = time_ns() if start is None else int(start * 1e9)
@@ -108,6 +111,30 @@ class Span(object):
         self._parent = None
         self._ignored_exceptions = None  # type: Optional[List[Exception]]
 
+    @property
+    def meta(self):
+        """The string tags of the span."""
+        meta = self._meta
+        if meta is None:
+            meta = self._meta = {}
+        return meta
+
+    @meta.setter
+    def meta(self, value):
+        self._meta = value
+
+    @property
+    def metrics(self):
+        """The numeric tags of the span."""
+        metrics = self._metrics
+        if metrics is None:
+            metrics = self._metrics = {}
+        return metrics
+
+    @metrics.setter
+    def metrics(self, value):
+        self._metrics = value
+
     def _ignore_exception(self, exc):
         # type: (Exception) -> None
         if self._ignored_exceptions is None:
@@ -174,10 +201,23 @@ class Span(object):
             # be defensive so we don't die if start isn't set
             self.duration_ns = ft - (self.start_ns or ft)
 
+        if self._parent is None and self._metrics and GC_TIME_KEY in self._metrics:
+            # The metric holds the time spent in the garbage collector when the span started
+            gc_monitor = self.tracer._gc_monitor if self.tracer else None
+            if gc_monitor is None:
+                # The pauses are not measured anymore
+                del self._metrics[GC_TIME_KEY]
+            else:
+                self._metrics[GC_TIME_KEY] = gc_monitor.pause_ns - self._metrics[GC_TIME_KEY]
+
         if self._context:
             trace, sampled = self._context.close_span(self)
-            if self.tracer and trace and sampled:
-                self.tracer.write(trace)
+            if self.tracer and trace:
+                if sampled:
+                    self.tracer.write(trace)
+                else:
+                    # The stats are computed from all the traces, sampled or not
+                    self.tracer._add_stats(trace)
 
     def set_tag(self, key, value=None):
         """Set a tag key/value pair on the span.
@@ -255,8 +295,8 @@ class Span(object):
 
         try:
             self.meta[key] = stringify(value)
-            if key in self.metrics:
-                del self.metrics[key]
+            if self._metrics and key in self._metrics:
+                del self._metrics[key]
         except Exception:
             log.warning("error setting tag %s, ignoring it", key, exc_info=True)
 
@@ -265,12 +305,14 @@ class Span(object):
         self.meta[key] = stringify(value)
 
     def _remove_tag(self, key):
-        if key in self.meta:
-            del self.meta[key]
+        if self._meta and key in self._meta:
+            del self._meta[key]
 
     def get_tag(self, key):
         """Return the given tag or None if it doesn't exist."""
-        return self.meta.get(key, None)
+        if self._meta is None:
+            return None
+        return self._meta.get(key, None)
 
     def set_tags(self, tags):
         """Set a dictionary of tags on the given span. Keys and values
@@ -314,8 +356,8 @@ class Span(object):
             log.debug("ignoring not real metric %s:%s", key, value)
             return
 
-        if key in self.meta:
-            del self.meta[key]
+        if self._meta and key in self._meta:
+            del self._meta[key]
         self.metrics[key] = value
 
     def set_metrics(self, metrics):
@@ -324,7 +366,9 @@ class Span(object):
                 self.set_metric(k, v)
 
     def get_metric(self, key):
-        return self.metrics.get(key)
+        if self._metrics is None:
+            return None
+        return self._metrics.get(key)
 
     def to_dict(self):
         d = {
@@ -350,11 +394,11 @@ class Span(object):
         if self.duration_ns:
             d["duration"] = self.duration_ns
 
-        if self.meta:
-            d["meta"] = self.meta
+        if self._meta:
+            d["meta"] = self._meta
 
-        if self.metrics:
-            d["metrics"] = self.metrics
+        if self._metrics:
+            d["metrics"] = self._metrics
 
         if self.span_type:
             d["type"] = self.span_type
@@ -6,12 +6,15 @@ import sys
 
 from ddtrace.vendor import debtcollector
 
-from .constants import FILTERS_KEY, SAMPLE_RATE_METRIC_KEY, VERSION_KEY, ENV_KEY
+from .constants import FILTERS_KEY, GC_TIME_KEY, SAMPLE_RATE_METRIC_KEY, VERSION_KEY, ENV_KEY
+from .constants import MANUAL_DROP_KEY, MANUAL_KEEP_KEY, SERVICE_KEY
 from .ext import system
 from .ext.priority import AUTO_REJECT, AUTO_KEEP
 from .internal import debug
 from .internal.logger import get_logger, hasHandlers
 from .internal.runtime import RuntimeTags, RuntimeWorker, get_runtime_id
+from .internal.runtime.gc_monitor import gc_monitor
+from .internal.stats import SpanStatsConcentrator
 from .internal.writer import AgentWriter, LogWriter
 from .internal import _rand
 from .provider import DefaultContextProvider
@@ -64,6 +67,58 @@ def _parse_dogstatsd_url(url):
 
 _INTERNAL_APPLICATION_SPAN_TYPES = ["custom", "template", "web", "worker"]
 
+# Kinds of spans sharing the same tags
+_CHILD_SPAN = 0
+_LOCAL_ROOT_SPAN = 1
+_ROOT_SPAN = 2
+_ROOT_SPAN_RUNTIME_METRICS = 3
+
+# Tags that cannot be copied from a span template as setting them has side
+# effects on the span or its context.
+_SPAN_TEMPLATE_EXCLUDED_TAGS = frozenset([MANUAL_KEEP_KEY, MANUAL_DROP_KEY, SERVICE_KEY])
+
+
+class _TracerTags(dict):
+    """The global tags of a tracer.
+
+    The modifications are counted in ``revision`` so that the span templates
+    built from the tags are reset when the dict is modified in place.
+    """
+
+    __slots__ = ("revision",)
+
+    def __init__(self, *args, **kwargs):
+        super(_TracerTags, self).__init__(*args, **kwargs)
+        self.revision = 0
+
+    def __setitem__(self, key, value):
+        super(_TracerTags, self).__setitem__(key, value)
+        self.revision += 1
+
+    def __delitem__(self, key):
+        super(_TracerTags, self).__delitem__(key)
+        self.revision += 1
+
+    def clear(self):
+        super(_TracerTags, self).clear()
+        self.revision += 1
+
+    def pop(self, *args):
+        self.revision += 1
+        return super(_TracerTags, self).pop(*args)
+
+    def popitem(self):
+        self.revision += 1
+        return super(_TracerTags, self).popitem()
+
+    def setdefault(self, key, default=None):
+        self.revision += 1
+        return super(_TracerTags, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super(_TracerTags, self).update(*args, **kwargs)
+        self.revision += 1
+
 
 class Tracer(object):
     """
@@ -78,6 +133,7 @@ class Tracer(object):
     """
 
     _RUNTIME_METRICS_INTERVAL = 10
+    _SPAN_TEMPLATES_MAX_SIZE = 1024
 
     DEFAULT_HOSTNAME = environ.get("DD_AGENT_HOST", environ.get("DATADOG_TRACE_AGENT_HOSTNAME", "localhost"))
     DEFAULT_PORT = int(environ.get("DD_TRACE_AGENT_PORT", 8126))
@@ -98,7 +154,10 @@ class Tracer(object):
         self.log = log
         self.sampler = None
         self.priority_sampler = None
+        self._tail_sampler = None
         self._runtime_worker = None
+        self._stats_concentrator = None
+        self._gc_monitor = None
         self._filters = []
 
         uds_path = None
@@ -152,6 +211,8 @@ class Tracer(object):
             context_provider=DefaultContextProvider(),
             dogstatsd_url=dogstatsd_url,
             writer=writer,
+            compute_stats=config._compute_stats,
+            gc_span_tag=config._gc_span_tag,
         )
 
         self._hooks = _hooks.Hooks()
@@ -195,6 +256,49 @@ class Tracer(object):
     def global_excepthook(self, tp, value, traceback):
         """The global tracer except hook."""
 
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = _TracerTags(tags)
+        self._reset_span_templates()
+
+    @property
+    def _filters(self):
+        return self.__filters
+
+    @_filters.setter
+    def _filters(self, filters):
+        self.__filters = filters
+        # Split the pipeline once so that ``write`` does not need to check
+        # each stage on every trace. Deferred stages run after inline ones.
+        self._inline_filters = [f for f in filters if not getattr(f, "deferred", False)]
+        self._deferred_filters = [f for f in filters if getattr(f, "deferred", False)]
+        self._configure_writer()
+
+    @property
+    def writer(self):
+        return self._writer
+
+    @writer.setter
+    def writer(self, writer):
+        self._writer = writer
+        self._configure_writer()
+
+    def _configure_writer(self):
+        """Hand the deferred filters and the stats settings over to the writer.
+
+        This is done whenever the writer, the filters or the stats concentrator
+        change, not on every trace.
+        """
+        writer = getattr(self, "_writer", None)
+        if isinstance(writer, AgentWriter):
+            # Deferred filters are run by the writer on its own thread
+            writer._filters = self._deferred_filters
+            writer._client_computed_stats = self._stats_concentrator is not None
+
     def get_call_context(self, *args, **kwargs):
         """
         Return the current active ``Context`` for this traced execution. This method is
@@ -237,6 +341,9 @@ class Tracer(object):
         dogstatsd_port=None,
         dogstatsd_url=None,
         writer=None,
+        tail_sampler=None,
+        compute_stats=None,
+        gc_span_tag=None,
     ):
         """
         Configure an existing Tracer the easy way.
@@ -261,6 +368,11 @@ class Tracer(object):
         :param str dogstatsd_host: Host for UDP connection to DogStatsD (deprecated: use dogstatsd_url)
         :param int dogstatsd_port: Port for UDP connection to DogStatsD (deprecated: use dogstatsd_url)
         :param str dogstatsd_url: URL for UDP or Unix socket connection to DogStatsD
+        :param object tail_sampler: A :class:`ddtrace.sampler.TailSampler` instance, deciding whether to
+            keep traces once they are complete. Pass ``False`` to disable tail sampling.
+        :param bool compute_stats: Whether to compute the trace metrics in the tracer instead of the agent.
+        :param bool gc_span_tag: Whether to tag the local root spans with the time spent in the garbage
+            collector while they were active.
         """
         if enabled is not None:
             self.enabled = enabled
@@ -280,6 +392,9 @@ class Tracer(object):
         if sampler is not None:
             self.sampler = sampler
 
+        if tail_sampler is not None:
+            self._tail_sampler = tail_sampler or None
+
         if dogstatsd_host is not None and dogstatsd_url is None:
             dogstatsd_url = "udp://{}:{}".format(dogstatsd_host, dogstatsd_port or self.DEFAULT_DOGSTATSD_PORT)
 
@@ -342,6 +457,22 @@ class Tracer(object):
         if (collect_metrics is None and runtime_metrics_was_running) or collect_metrics:
             self._start_runtime_worker()
 
+        if compute_stats and self._stats_concentrator is None:
+            self._create_stats_concentrator()
+        elif compute_stats is False and self._stats_concentrator is not None:
+            self._stop_stats_concentrator()
+
+        if gc_span_tag and self._gc_monitor is None:
+            if gc_monitor.start():
+                self._gc_monitor = gc_monitor
+            else:
+                log.warning("the time spent in the garbage collector can not be measured on this Python version")
+        elif gc_span_tag is False and self._gc_monitor is not None:
+            self._gc_monitor.stop()
+            self._gc_monitor = None
+
+        self._reset_span_templates()
+
         if debug_mode or asbool(environ.get("DD_TRACE_STARTUP_LOGS", False)):
             try:
                 info = debug.collect(self)
@@ -435,6 +566,9 @@ class Tracer(object):
             if parent:
                 span.sampled = parent.sampled
                 span._parent = parent
+                kind = _CHILD_SPAN
+            else:
+                kind = _LOCAL_ROOT_SPAN
 
         else:
             # this is the root span of a new trace
@@ -475,16 +609,22 @@ class Tracer(object):
                 span.sampled = True
 
             # add tags to root span to correlate trace with runtime metrics
-            # only applied to spans with types that are internal to applications
-            if self._runtime_worker and self._is_span_internal(span):
-                span.meta["language"] = "python"
+            kind = _ROOT_SPAN_RUNTIME_METRICS if self._runtime_worker else _ROOT_SPAN
 
-        # Apply default global tags.
-        if self.tags:
-            span.set_tags(self.tags)
-
-        if config.env:
-            span._set_str_tag(ENV_KEY, config.env)
+        # Apply the tags common to all the spans of the same kind
+        template = self._get_span_template(service, span_type, kind)
+        if template is None:
+            internal = self._apply_span_tags(span, kind)
+        else:
+            meta, metrics, internal = template
+            if meta:
+                if span._metrics:
+                    # The sampler may have set metrics that are overridden by tags
+                    for key in meta:
+                        span._metrics.pop(key, None)
+                span.meta.update(meta)
+            if metrics:
+                span.metrics.update(metrics)
 
         # Only set the version tag on internal spans.
         if config.version:
@@ -498,15 +638,15 @@ class Tracer(object):
             ):
                 span._set_str_tag(VERSION_KEY, config.version)
 
-        if not span._parent:
-            span.metrics[system.PID] = self._pid or getpid()
-            span.meta["runtime-id"] = get_runtime_id()
+        # The time spent in the garbage collector is set once the span finishes
+        if kind != _CHILD_SPAN and self._gc_monitor is not None:
+            span.metrics[GC_TIME_KEY] = self._gc_monitor.pause_ns
 
         # add it to the current context
         context.add_span(span)
 
         # update set of services handled by tracer
-        if service and service not in self._services and self._is_span_internal(span):
+        if service and internal and service not in self._services:
             self._services.add(service)
 
             # The constant tags for the dogstatsd client needs to updated with any new
@@ -517,6 +657,63 @@ class Tracer(object):
 
         return span
 
+    def _apply_span_tags(self, span, kind):
+        """Set the tags common to all the spans of the given kind.
+
+        Return whether the span is internal to the application.
+        """
+        internal = self._is_span_internal(span)
+
+        # only applied to spans with types that are internal to applications
+        if kind == _ROOT_SPAN_RUNTIME_METRICS and internal:
+            span.meta["language"] = "python"
+
+        # Apply default global tags.
+        if self.tags:
+            span.set_tags(self.tags)
+
+        if config.env:
+            span._set_str_tag(ENV_KEY, config.env)
+
+        if kind != _CHILD_SPAN:
+            span.metrics[system.PID] = self._pid or getpid()
+            span.meta["runtime-id"] = get_runtime_id()
+
+        return internal
+
+    def _get_span_template(self, service, span_type, kind):
+        """Return the ``(meta, metrics, internal)`` template for new spans.
+
+        The tags common to all the spans of the same service, type and kind
+        are computed once and copied in bulk to each new span. Templates are
+        reset when the tracer, its tags or the global configuration change. ``None`` is
+        returned when the global tags cannot be set from a template.
+        """
+        if (
+            self._span_templates_revision != config._revision
+            or self._span_templates_tags_revision != self._tags.revision
+        ):
+            self._reset_span_templates()
+
+        key = (service, span_type, kind)
+        template = self._span_templates.get(key)
+        if template is not None or self._span_templates_disabled:
+            return template
+
+        if len(self._span_templates) >= self._SPAN_TEMPLATES_MAX_SIZE:
+            self._span_templates = {}
+
+        span = Span(None, None, service=service, span_type=span_type, _check_pid=False)
+        internal = self._apply_span_tags(span, kind)
+        template = self._span_templates[key] = (span.meta, span.metrics, internal)
+        return template
+
+    def _reset_span_templates(self):
+        self._span_templates = {}
+        self._span_templates_revision = config._revision
+        self._span_templates_tags_revision = self._tags.revision
+        self._span_templates_disabled = any(key in _SPAN_TEMPLATE_EXCLUDED_TAGS for key in self.tags)
+
     def _update_dogstatsd_constant_tags(self):
         """Prepare runtime tags for ddstatsd."""
         # DEV: ddstatsd expects tags in the form ['key1:value1', 'key2:value2', ...]
@@ -528,6 +725,18 @@ class Tracer(object):
         self._runtime_worker = RuntimeWorker(self._dogstatsd_client, self._RUNTIME_METRICS_INTERVAL)
         self._runtime_worker.start()
 
+    def _create_stats_concentrator(self):
+        # The concentrator is started by the first trace it receives
+        self._stats_concentrator = SpanStatsConcentrator(self)
+        self._configure_writer()
+
+    def _stop_stats_concentrator(self, timeout=None):
+        concentrator, self._stats_concentrator = self._stats_concentrator, None
+        self._configure_writer()
+        concentrator.stop()
+        if concentrator.started:
+            concentrator.join(timeout=timeout)
+
     def _check_new_process(self):
         """Checks if the tracer is in a new process (was forked) and performs
         the necessary updates if it is a new process
@@ -559,9 +768,16 @@ class Tracer(object):
         # of the parent.
         self._services = set()
 
+        # The templates hold the pid and the runtime id of the parent process
+        self._reset_span_templates()
+
         if self._runtime_worker is not None:
             self._start_runtime_worker()
 
+        # The stats of the parent process are sent by the parent process
+        if self._stats_concentrator is not None:
+            self._create_stats_concentrator()
+
         # force an immediate update constant tags since we have reset services
         # and generated a new runtime id
         self._update_dogstatsd_constant_tags()
@@ -678,17 +894,48 @@ class Tracer(object):
                 self.log.debug("\n%s", span.pprint())
 
         if self.enabled and self.writer:
-            for filtr in self._filters:
-                try:
-                    spans = filtr.process_trace(spans)
-                except Exception:
-                    log.error("error while applying filter %s to traces", filtr, exc_info=True)
-                else:
-                    if not spans:
-                        return
+            if isinstance(self.writer, AgentWriter):
+                # Deferred filters were handed over to the writer
+                filters = self._inline_filters
+            else:
+                filters = self._inline_filters + self._deferred_filters
+
+            spans = self._apply_filters(spans, filters)
+            if not spans:
+                return
+
+            concentrator = self._stats_concentrator
+            if concentrator is not None:
+                concentrator.add_trace(spans)
 
             self.writer.write(spans=spans)
 
+    def _add_stats(self, spans):
+        """Compute the metrics of a trace that is not sampled, so not written.
+
+        Like for the written traces, the metrics are only computed when the
+        tracer is enabled and from the traces kept by the inline filters.
+        """
+        concentrator = self._stats_concentrator
+        if concentrator is None or not self.enabled:
+            return
+
+        spans = self._apply_filters(spans, self._inline_filters)
+        if spans:
+            concentrator.add_trace(spans)
+
+    @staticmethod
+    def _apply_filters(spans, filters):
+        for filtr in filters:
+            try:
+                spans = filtr.process_trace(spans)
+            except Exception:
+                log.error("error while applying filter %s to traces", filtr, exc_info=True)
+            else:
+                if not spans:
+                    return None
+        return spans
+
     @deprecated(message="Manually setting service info is no longer necessary", version="1.0.0")
     def set_service_info(self, *args, **kwargs):
         """Set the information about the given service."""
@@ -800,6 +1047,9 @@ class Tracer(object):
             before exiting or :obj:`None` to block until flushing has successfully completed (default: :obj:`None`)
         :type timeout: :obj:`int` | :obj:`float` | :obj:`None`
         """
+        if self._stats_concentrator is not None:
+            self._stop_stats_concentrator(timeout=timeout)
+
         if not self.writer.is_alive():
             return
 
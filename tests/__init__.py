@@ -82,6 +82,8 @@ def override_global_config(values):
         "env",
         "version",
         "service",
+        "_propagation_style_extract",
+        "_propagation_style_inject",
     ]
 
     # Grab the current values of all keys
@@ -392,6 +394,12 @@ class DummyWriter(AgentWriter):
         self.msgpack_encoder = MsgpackEncoder()
 
     def write(self, spans=None, services=None):
+        if spans and self._filters:
+            # run deferred filters right away so that tests can inspect the
+            # outcome without flushing the writer
+            filtered = self._apply_filters([spans])
+            spans = filtered[0] if filtered else None
+
         if spans:
             # the traces encoding expect a list of traces so we
             # put spans in a list like we do in the real execution path
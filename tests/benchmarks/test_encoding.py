@@ -1,8 +1,12 @@
+import threading
+import tracemalloc
+
 import msgpack
 from msgpack.fallback import Packer
 import pytest
 
-from ddtrace.encoding import _EncoderBase, MsgpackEncoder
+from ddtrace.encoding import _EncoderBase, BufferedEncoder, BufferedEncoderV05, MsgpackEncoder
+from ddtrace.internal._encoding import Packer as CPacker
 
 from tests.tracer.test_encoders import RefMsgpackEncoder, gen_trace
 
@@ -71,6 +75,35 @@ def test_encode_trace_small_multi_custom(benchmark):
     benchmark(trace_encoder.encode_traces, [trace_small for _ in range(50)])
 
 
+@pytest.mark.benchmark(group="encoding.small", min_time=0.005)
+def test_encode_trace_small_custom_new_packer(benchmark):
+    # Baseline for the pooled packer used by the encoder
+    benchmark(lambda: CPacker().pack(trace_small))
+
+
+def _traced_peak_memory(f, *args):
+    tracemalloc.start()
+    try:
+        f(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark(group="encoding.small.alloc", min_time=0.005)
+def test_encode_trace_small_custom_alloc(benchmark):
+    # Warm-up the per-thread packer so that its buffer is not accounted for
+    trace_encoder.encode_trace(trace_small)
+    benchmark.extra_info["peak_bytes"] = _traced_peak_memory(trace_encoder.encode_trace, trace_small)
+    benchmark(trace_encoder.encode_trace, trace_small)
+
+
+@pytest.mark.benchmark(group="encoding.small.alloc", min_time=0.005)
+def test_encode_trace_small_custom_new_packer_alloc(benchmark):
+    benchmark.extra_info["peak_bytes"] = _traced_peak_memory(lambda: CPacker().pack(trace_small))
+    benchmark(lambda: CPacker().pack(trace_small))
+
+
 @pytest.mark.benchmark(group="encoding.join_encoded", min_time=0.005)
 def test_join_encoded_custom(benchmark):
     benchmark(
@@ -78,6 +111,53 @@ def test_join_encoded_custom(benchmark):
     )
 
 
+def _buffered_encode(traces, encoder_cls=BufferedEncoder):
+    encoder = encoder_cls(max_size=64 << 20, max_item_size=64 << 20)
+    for trace in traces:
+        encoder.put(trace)
+    return encoder.encode()
+
+
+def _join_encode(traces):
+    return trace_encoder.join_encoded([trace_encoder.encode_trace(trace) for trace in traces])
+
+
+@pytest.mark.benchmark(group="encoding.payload", min_time=0.005)
+def test_encode_payload_join_encoded(benchmark):
+    benchmark(_join_encode, [trace_small for _ in range(50)])
+
+
+@pytest.mark.benchmark(group="encoding.payload", min_time=0.005)
+def test_encode_payload_buffered(benchmark):
+    benchmark(_buffered_encode, [trace_small for _ in range(50)])
+
+
+@pytest.mark.benchmark(group="encoding.payload", min_time=0.005)
+def test_encode_payload_buffered_v05(benchmark):
+    benchmark(_buffered_encode, [trace_small for _ in range(50)], BufferedEncoderV05)
+
+
+def _put_concurrently(encoder, trace, nthreads=64, ntraces=50):
+    def _put():
+        for _ in range(ntraces):
+            encoder.put(trace)
+
+    threads = [threading.Thread(target=_put) for _ in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return encoder.encode()
+
+
+@pytest.mark.benchmark(group="encoding.put.threads", min_time=0.005)
+@pytest.mark.parametrize("shards", [1, 4, 16])
+def test_encode_put_threads(benchmark, shards):
+    trace = gen_trace(nspans=10, ntags=5, nmetrics=3)
+    encoder = BufferedEncoder(max_size=64 << 20, max_item_size=64 << 20, shards=shards)
+    benchmark(_put_concurrently, encoder, trace)
+
+
 # import pstats, cProfile
 #
 # from ddtrace.encoding import TraceMsgPackEncoder
@@ -0,0 +1,27 @@
+import pytest
+
+from ddtrace.propagation.http import HTTPPropagator
+
+
+def _headers(names):
+    headers = dict(("Header-%d" % i, "value") for i in range(36))
+    headers.update((name, "1234") for name in names)
+    return headers
+
+
+propagator = HTTPPropagator()
+
+
+@pytest.mark.benchmark(group="propagation.extract", min_time=0.005)
+@pytest.mark.parametrize(
+    "headers",
+    [
+        _headers([]),
+        _headers(["x-datadog-trace-id", "x-datadog-parent-id", "x-datadog-sampling-priority"]),
+        _headers(["HTTP_X_DATADOG_TRACE_ID", "HTTP_X_DATADOG_PARENT_ID", "HTTP_X_DATADOG_SAMPLING_PRIORITY"]),
+        _headers(["X-Datadog-Trace-Id", "X-Datadog-Parent-Id", "X-Datadog-Sampling-Priority"]),
+    ],
+    ids=["none", "lowercase", "wsgi", "mixedcase"],
+)
+def test_extract(benchmark, headers):
+    benchmark(propagator.extract, headers)
@@ -0,0 +1,28 @@
+import threading
+
+import pytest
+
+from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.internal.rate_limiter import ShardedRateLimiter
+
+
+def _contend(limiter, threads, calls):
+    def target():
+        for _ in range(calls):
+            limiter.is_allowed()
+
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+@pytest.mark.benchmark(group="rate_limiter.contention", min_time=0.005)
+@pytest.mark.parametrize("shards", [1, 4, 16, 32])
+def test_is_allowed_32_threads(benchmark, shards):
+    if shards == 1:
+        limiter = RateLimiter(1000)
+    else:
+        limiter = ShardedRateLimiter(1000, shards=shards)
+    benchmark(_contend, limiter, 32, 1000)
@@ -0,0 +1,35 @@
+import re
+
+import pytest
+
+from ddtrace.sampler import DatadogSampler, RateByServiceSampler, SamplingRule
+from ddtrace.span import Span
+from ddtrace.tracer import Tracer
+
+
+def _rules(n):
+    rules = []
+    for i in range(n):
+        if i % 10 == 0:
+            rules.append(SamplingRule(sample_rate=0.5, service=re.compile("regex-svc-%d-.*" % i)))
+        else:
+            rules.append(SamplingRule(sample_rate=0.5, service="svc-%d" % i, name="op-%d" % i))
+    return rules
+
+
+@pytest.mark.benchmark(group="sampler.rules", min_time=0.005)
+@pytest.mark.parametrize("service", ["svc-149", "unknown"])
+def test_match_rules(benchmark, service):
+    sampler = DatadogSampler(rules=_rules(150))
+    span = Span(None, "op-149", service=service)
+    benchmark(sampler._rule_index.match, span)
+
+
+@pytest.mark.benchmark(group="sampler.rate_by_service", min_time=0.005)
+def test_rate_by_service_sample(benchmark):
+    tracer = Tracer()
+    tracer.set_tags({"env": "prod"})
+    sampler = RateByServiceSampler()
+    sampler.update_rate_by_service_sample_rates({"service:svc-%d,env:prod" % i: 0.5 for i in range(100)})
+    span = Span(tracer, "op", service="svc-42")
+    benchmark(sampler.sample, span)
@@ -0,0 +1,89 @@
+import tracemalloc
+
+import mock
+import pytest
+
+from ddtrace import Tracer
+from ddtrace.context import Context
+from ddtrace.span import Span
+
+from tests import DummyWriter, override_global_config
+
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer()
+    tracer.writer = DummyWriter()
+    tracer.set_tags({"team": "apm", "region": "us-east-1", "shard": 42})
+    with override_global_config(dict(env="prod", version="1.0")):
+        yield tracer
+
+
+@pytest.mark.benchmark(group="tracer.start_span", min_time=0.005)
+def test_start_span_root(benchmark, tracer):
+    benchmark(tracer.start_span, "web.request", service="web")
+
+
+@pytest.mark.benchmark(group="tracer.start_span", min_time=0.005)
+def test_start_span_child(benchmark, tracer):
+    root = tracer.start_span("web.request", service="web")
+    benchmark(tracer.start_span, "web.template", child_of=root)
+
+
+def _span_memory(f, n=1000):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        spans = [f() for _ in range(n)]
+        return (tracemalloc.get_traced_memory()[0] - before) // len(spans)
+    finally:
+        tracemalloc.stop()
+
+
+def _new_span():
+    return Span(None, "leaf", service="db", resource="SELECT 1")
+
+
+def _new_tagged_span():
+    span = _new_span()
+    span.set_tag("db.name", "users")
+    span.set_metric("db.rowcount", 1)
+    return span
+
+
+@pytest.mark.benchmark(group="span.alloc", min_time=0.005)
+def test_span_alloc(benchmark):
+    benchmark.extra_info["bytes_per_span"] = _span_memory(_new_span)
+    benchmark(_new_span)
+
+
+@pytest.mark.benchmark(group="span.alloc", min_time=0.005)
+def test_span_alloc_tagged(benchmark):
+    benchmark.extra_info["bytes_per_span"] = _span_memory(_new_tagged_span)
+    benchmark(_new_tagged_span)
+
+
+@pytest.mark.benchmark(group="context", min_time=0.005)
+def test_context_accessors(benchmark):
+    ctx = Context(trace_id=1, span_id=2, sampling_priority=1)
+
+    def _access():
+        ctx.trace_id
+        ctx.span_id
+        ctx.sampling_priority
+        ctx.get_current_span()
+
+    benchmark(_access)
+
+
+@pytest.mark.benchmark(group="context.partial_flush", min_time=0.005)
+def test_partial_flush_long_trace(benchmark):
+    def _trace():
+        tracer = Tracer()
+        tracer.writer = DummyWriter()
+        with mock.patch.object(Context, "_partial_flush_enabled", True):
+            with tracer.trace("job"):
+                for _ in range(10000):
+                    tracer.trace("item").finish()
+
+    benchmark.pedantic(_trace, rounds=3)
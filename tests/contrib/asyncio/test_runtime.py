@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import mock
+
+from ddtrace.contrib.asyncio import monitor_event_loop
+from ddtrace.contrib.asyncio.runtime import EventLoopMonitor
+from ddtrace.internal.runtime.constants import ASYNCIO_LOOP_LAG, ASYNCIO_SLOW_CALLBACK, ASYNCIO_TASKS_PENDING
+from ddtrace.internal.runtime.metric_collectors import EventLoopRuntimeMetricCollector
+from ddtrace.internal.runtime.runtime_metrics import RuntimeWorker
+from ddtrace.vendor.dogstatsd import DogStatsd
+
+from .utils import AsyncioTestCase
+
+
+class TestEventLoopMonitor(AsyncioTestCase):
+    def tearDown(self):
+        EventLoopRuntimeMetricCollector.monitors[:] = []
+        super(TestEventLoopMonitor, self).tearDown()
+
+    def test_metrics(self):
+        async def blocking():
+            time.sleep(0.3)
+
+        async def main():
+            monitor = monitor_event_loop(self.loop, interval=0.02, slow_callback_threshold=0.1)
+            tasks = [asyncio.ensure_future(asyncio.sleep(1)) for _ in range(3)]
+            await asyncio.sleep(0.1)
+            await asyncio.ensure_future(blocking())
+            await asyncio.sleep(0.1)
+            metrics = dict(EventLoopRuntimeMetricCollector().collect())
+            monitor.stop()
+            monitor.join()
+            for task in tasks:
+                task.cancel()
+            return metrics
+
+        metrics = self.loop.run_until_complete(main())
+
+        assert metrics[ASYNCIO_LOOP_LAG]
+        assert max(metrics[ASYNCIO_LOOP_LAG]) >= 0.2
+        # The main task and the sleeping ones
+        assert metrics[ASYNCIO_TASKS_PENDING] == 4
+        ((duration, tags),) = metrics[ASYNCIO_SLOW_CALLBACK]
+        assert duration >= 0.2
+        assert tags == ["coroutine:TestEventLoopMonitor.test_metrics.<locals>.blocking"]
+
+        # The monitor is unregistered once stopped
+        assert EventLoopRuntimeMetricCollector.monitors == []
+        assert EventLoopRuntimeMetricCollector().collect() == []
+
+    def test_closed_loop(self):
+        loop = asyncio.new_event_loop()
+        monitor = monitor_event_loop(loop, interval=0.01)
+        loop.close()
+        monitor.join(1)
+        assert not monitor.is_alive()
+        assert EventLoopRuntimeMetricCollector.monitors == []
+
+    def test_stopped_loop(self):
+        monitor = EventLoopMonitor(self.loop, slow_callback_threshold=0)
+        monitor._sent_ns = 1
+        # The loop is not running
+        monitor.run_periodic()
+        assert monitor._sent_ns is None
+        monitor._ping(1)
+        assert monitor.flush() == ([], 0, [])
+
+    def test_runtime_worker(self):
+        statsd = DogStatsd(disable_telemetry=True)
+        statsd.socket = mock.Mock()
+        worker = RuntimeWorker(statsd)
+
+        monitor = EventLoopMonitor(self.loop)
+        monitor.flush = mock.Mock(return_value=([2000000], 3, [(200000000, "handler")]))
+        EventLoopRuntimeMetricCollector.register(monitor)
+        worker.flush()
+
+        lines = [line for call in statsd.socket.send.call_args_list for line in call[0][0].decode("utf-8").split("\n")]
+        assert ASYNCIO_LOOP_LAG + ":0.002|d" in lines
+        assert ASYNCIO_TASKS_PENDING + ":3|g" in lines
+        assert ASYNCIO_SLOW_CALLBACK + ":0.2|d|#coroutine:handler" in lines
@@ -10,6 +10,7 @@ import ddtrace
 from ddtrace import Tracer, tracer
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.internal.runtime import container
+from ddtrace.vendor.dogstatsd import DogStatsd
 
 from tests import TracerTestCase, snapshot, AnyInt, override_global_config
 
@@ -182,7 +183,8 @@ def test_child_spans():
 def test_metrics():
     with override_global_config(dict(health_metrics_enabled=True)):
         t = Tracer()
-        statsd_mock = mock.Mock()
+        statsd_mock = DogStatsd(disable_telemetry=True)
+        statsd_mock.socket = mock.Mock()
         t.writer.dogstatsd = statsd_mock
         assert t.writer._report_metrics
         with mock.patch("ddtrace.internal.writer.log") as log:
@@ -197,20 +199,14 @@ def test_metrics():
             log.warning.assert_not_called()
             log.error.assert_not_called()
 
-        statsd_mock.increment.assert_has_calls(
-            [
-                mock.call("datadog.tracer.http.requests"),
-            ]
-        )
-        statsd_mock.distribution.assert_has_calls(
-            [
-                mock.call("datadog.tracer.buffer.accepted.traces", 5, tags=[]),
-                mock.call("datadog.tracer.buffer.accepted.spans", 15000, tags=[]),
-                mock.call("datadog.tracer.http.requests", 1, tags=[]),
-                mock.call("datadog.tracer.http.sent.bytes", AnyInt()),
-            ],
-            any_order=True,
-        )
+        metrics = [
+            line for call in statsd_mock.socket.send.call_args_list for line in call[0][0].decode("utf-8").split("\n")
+        ]
+        assert "datadog.tracer.http.requests:1|c" in metrics
+        assert "datadog.tracer.buffer.accepted.traces:5|d" in metrics
+        assert "datadog.tracer.buffer.accepted.spans:15000|d" in metrics
+        assert "datadog.tracer.http.requests:1|d" in metrics
+        assert any(metric.startswith("datadog.tracer.http.sent.bytes:") for metric in metrics)
 
 
 def test_single_trace_too_large():
@@ -320,11 +316,14 @@ def test_bad_payload():
     t = Tracer()
 
     class BadEncoder:
-        def encode_trace(self, spans):
-            return []
+        def __len__(self):
+            return 0
+
+        def put(self, trace):
+            pass
 
-        def join_encoded(self, traces):
-            return "not msgpack"
+        def encode(self):
+            return b"not msgpack", 1
 
     t.writer._encoder = BadEncoder()
     with mock.patch("ddtrace.internal.writer.log") as log:
@@ -10,6 +10,7 @@ import mock
 
 import pytest
 
+from ddtrace.profiling import recorder
 from ddtrace.profiling.collector import memalloc
 from ddtrace.profiling.collector import memory
 from ddtrace.profiling.collector import stack
@@ -594,6 +595,42 @@ def test_ppprof_exporter():
         assert f.read() == str(exports), filename
 
 
+def _profile_samples(profile):
+    """Return the samples of a profile independently of the ids of its tables."""
+    strings = profile.string_table
+    functions = {f.id: (strings[f.filename], strings[f.name]) for f in profile.function}
+    locations = {
+        loc.id: tuple((functions[line.function_id], line.line) for line in loc.line) for loc in profile.location
+    }
+    return sorted(
+        (
+            tuple(locations[location_id] for location_id in sample.location_id),
+            tuple((strings[label.key], strings[label.str]) for label in sample.label),
+            tuple(sample.value),
+        )
+        for sample in profile.sample
+    )
+
+
+def test_pprof_exporter_aggregate():
+    r = recorder.Recorder(aggregate_factory=pprof.PprofAggregate)
+    for events in TEST_EVENTS.values():
+        for event in events:
+            r.push_event(event)
+    events = r.reset()
+    assert list(events) == [pprof.PprofAggregate]
+
+    exp = pprof.PprofExporter()
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+    aggregated = exp.export(events, 1, 7)
+    expected = exp.export(TEST_EVENTS, 1, 7)
+    assert _profile_samples(aggregated) == _profile_samples(expected)
+    assert aggregated.period == expected.period
+    # The aggregate can be exported by several exporters
+    assert exp.export(events, 1, 7) == aggregated
+
+
 def test_pprof_exporter_empty():
     exp = pprof.PprofExporter()
     export = exp.export({}, 0, 1)
@@ -8,6 +8,7 @@ import ddtrace
 from ddtrace.profiling import profiler
 from ddtrace.profiling.collector import stack
 from ddtrace.profiling.exporter import http
+from ddtrace.profiling.exporter import pprof
 
 
 def test_status():
@@ -192,6 +193,12 @@ def test_env_endpoint_url_no_agent(monkeypatch):
     _check_url(prof, "https://intake.profile.datadoghq.eu/v1/input", "123", endpoint_path="/v1/input")
 
 
+def test_aggregate_events(monkeypatch):
+    assert profiler._ProfilerInstance()._recorder.aggregate_factory is None
+    monkeypatch.setenv("DD_PROFILING_AGGREGATE_EVENTS", "true")
+    assert profiler._ProfilerInstance()._recorder.aggregate_factory is pprof.PprofAggregate
+
+
 def test_copy():
     p = profiler._ProfilerInstance(env="123", version="dwq", service="foobar")
     c = p.copy()
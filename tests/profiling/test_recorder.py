@@ -2,6 +2,7 @@
 from ddtrace.profiling import event
 from ddtrace.profiling import recorder
 from ddtrace.profiling.collector import stack
+from ddtrace.profiling.exporter import pprof
 
 import pytest
 
@@ -49,3 +50,30 @@ def test_limit():
     )
     assert r.events[stack.StackExceptionSampleEvent].maxlen == 12
     assert r.events[stack.StackSampleEvent].maxlen == 24
+
+
+def test_aggregate():
+    r = recorder.Recorder(aggregate_factory=pprof.PprofAggregate)
+    r.push_event(event.Event())
+    r.push_events(
+        [
+            stack.StackSampleEvent(
+                thread_id=1,
+                thread_name="MainThread",
+                frames=[("foobar.py", 23, "func1")],
+                nframes=1,
+                sampling_period=10,
+                cpu_time_ns=2,
+                wall_time_ns=3,
+            )
+        ]
+    )
+    assert list(r.events) == [event.Event]
+    events = r.reset()
+    assert len(events[event.Event]) == 1
+    (aggregate,) = events[pprof.PprofAggregate]
+    assert aggregate.nb_event == 1
+    assert aggregate.sum_period == 10
+    (new_aggregate,) = r.reset()[pprof.PprofAggregate]
+    assert new_aggregate is not aggregate
+    assert new_aggregate.nb_event == 0
@@ -3,7 +3,7 @@ import mock
 import pytest
 
 from ddtrace.compat import PY2
-from ddtrace.internal.runtime.container import CGroupInfo, get_container_info
+from ddtrace.internal.runtime.container import CGroupInfo, get_cgroup_file, get_cgroup_paths, get_container_info
 
 from .utils import cgroup_line_valid_test_cases
 
@@ -289,3 +289,54 @@ def test_get_container_info_exception(mock_log, mock_from_line):
 
         # Ensure we logged the exception
         mock_log.debug.assert_called_once_with("Failed to parse cgroup file for pid %r", "self", exc_info=True)
+
+
+@pytest.mark.parametrize(
+    "file_contents,paths",
+    (
+        # cgroup v1
+        (
+            """
+9:name=systemd:/docker/abc
+4:memory:/docker/abc
+2:cpu,cpuacct:/docker/abc
+            """,
+            {"name=systemd": "/docker/abc", "memory": "/docker/abc", "cpu": "/docker/abc", "cpuacct": "/docker/abc"},
+        ),
+        # cgroup v1 and v2 (hybrid)
+        (
+            """
+1:cpu:/
+0::/system.slice/app.service
+            """,
+            {"cpu": "/", "": "/system.slice/app.service"},
+        ),
+        # Missing file
+        (None, {}),
+    ),
+)
+def test_get_cgroup_paths(file_contents, paths):
+    with get_mock_open(read_data=file_contents) as mock_open:
+        if file_contents is None:
+            mock_open.side_effect = FileNotFoundError
+
+        assert get_cgroup_paths() == paths
+        mock_open.assert_called_once_with("/proc/self/cgroup", mode="r")
+
+
+def test_get_cgroup_file(tmpdir):
+    tmpdir.join("cpu/docker/abc/cpu.stat").write("", ensure=True)
+    tmpdir.join("memory/memory.max").write("", ensure=True)
+    tmpdir.join("unified/app/memory.max").write("", ensure=True)
+    mount = str(tmpdir)
+
+    paths = {"cpu": "/docker/abc", "memory": "/docker/abc", "": "/app"}
+    assert get_cgroup_file(paths, "cpu", "cpu.stat", mount=mount) == str(tmpdir.join("cpu/docker/abc/cpu.stat"))
+    # Root of the mount of the controller in a cgroup namespace
+    assert get_cgroup_file(paths, "memory", "memory.max", mount=mount) == str(tmpdir.join("memory/memory.max"))
+    # Unified hierarchy of the hybrid mode
+    assert get_cgroup_file({"": "/app"}, "memory", "memory.max", mount=mount) == str(
+        tmpdir.join("unified/app/memory.max")
+    )
+    assert get_cgroup_file(paths, "cpu", "cpu.max", mount=mount) is None
+    assert get_cgroup_file({}, "cpu", "cpu.stat", mount=mount) is None
@@ -1,13 +1,34 @@
+import functools
+import sys
+
+import mock
+import pytest
+
+from ddtrace.internal.runtime import container
+from ddtrace.internal.runtime.gc_monitor import GCMonitor
 from ddtrace.internal.runtime.metric_collectors import (
     RuntimeMetricCollector,
+    CGroupRuntimeMetricCollector,
+    GCPauseRuntimeMetricCollector,
     GCRuntimeMetricCollector,
+    ProcRuntimeMetricCollector,
     PSUtilRuntimeMetricCollector,
 )
 
 from ddtrace.internal.runtime.constants import (
+    CGROUP_CPU_THROTTLED,
+    CGROUP_CPU_THROTTLED_TIME,
+    CGROUP_MEM_LIMIT,
+    CGROUP_MEM_USAGE,
+    CTX_SWITCH_VOLUNTARY,
+    GC_COLLECTED,
     GC_COUNT_GEN0,
+    GC_PAUSE_GEN2,
     GC_RUNTIME_METRICS,
+    MEM_RSS,
+    PROC_RUNTIME_METRICS,
     PSUTIL_RUNTIME_METRICS,
+    THREAD_COUNT,
 )
 from tests import BaseTestCase
 
@@ -34,6 +55,107 @@ class TestPSUtilRuntimeMetricCollector(BaseTestCase):
             self.assertIsNotNone(value)
 
 
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="/proc is only available on Linux")
+class TestProcRuntimeMetricCollector(BaseTestCase):
+    def test_metrics(self):
+        collector = ProcRuntimeMetricCollector()
+        assert collector.enabled
+        metrics = dict(collector.collect(PROC_RUNTIME_METRICS))
+        assert set(metrics) == PROC_RUNTIME_METRICS
+
+        expected = dict(PSUtilRuntimeMetricCollector().collect(PSUTIL_RUNTIME_METRICS))
+        assert metrics[THREAD_COUNT] == expected[THREAD_COUNT]
+        assert abs(metrics[MEM_RSS] - expected[MEM_RSS]) < 0.1 * expected[MEM_RSS]
+
+    def test_deltas(self):
+        collector = ProcRuntimeMetricCollector()
+        collector.collect()
+        collector.stored_value = dict(collector.stored_value, CTX_SWITCH_VOLUNTARY_TOTAL=0)
+        assert dict(collector.collect())[CTX_SWITCH_VOLUNTARY] >= 0
+
+    def test_status_not_read(self):
+        collector = ProcRuntimeMetricCollector()
+        with mock.patch.object(collector, "_read", wraps=collector._read) as read:
+            metrics = collector.collect([THREAD_COUNT])
+        read.assert_called_once_with(collector.STAT_PATH)
+        assert [key for key, _ in metrics] == [THREAD_COUNT]
+
+    def test_large_file(self):
+        collector = ProcRuntimeMetricCollector()
+        collector._buffer = bytearray(16)
+        assert dict(collector.collect())[THREAD_COUNT] >= 1
+        assert len(collector._buffer) > 16
+
+
+def _cgroup_collector(tmpdir, files, paths):
+    for path, content in files.items():
+        tmpdir.join(path).write(content, ensure=True)
+
+    get_cgroup_file = functools.partial(container.get_cgroup_file, mount=str(tmpdir))
+    with mock.patch.object(container, "get_cgroup_paths", return_value=paths):
+        with mock.patch.object(container, "get_cgroup_file", side_effect=get_cgroup_file):
+            return CGroupRuntimeMetricCollector()
+
+
+def test_cgroup_v1(tmpdir):
+    collector = _cgroup_collector(
+        tmpdir,
+        {
+            "cpu/docker/abc/cpu.stat": "nr_periods 10\nnr_throttled 2\nthrottled_time 5000\n",
+            "memory/docker/abc/memory.usage_in_bytes": "1024\n",
+            "memory/docker/abc/memory.limit_in_bytes": "4096\n",
+        },
+        {"cpu": "/docker/abc", "cpuacct": "/docker/abc", "memory": "/docker/abc"},
+    )
+    assert collector.enabled
+    tmpdir.join("cpu/docker/abc/cpu.stat").write("nr_periods 20\nnr_throttled 5\nthrottled_time 8000\n")
+    assert sorted(collector.collect()) == [
+        (CGROUP_CPU_THROTTLED, 3),
+        (CGROUP_CPU_THROTTLED_TIME, 3000),
+        (CGROUP_MEM_LIMIT, 4096),
+        (CGROUP_MEM_USAGE, 1024),
+    ]
+
+
+def test_cgroup_v1_namespace_unlimited(tmpdir):
+    # The cgroup of the process is the root of the mount in its cgroup namespace
+    collector = _cgroup_collector(
+        tmpdir,
+        {
+            "memory/memory.usage_in_bytes": "1024\n",
+            "memory/memory.limit_in_bytes": "9223372036854771712\n",
+        },
+        {"memory": "/docker/abc"},
+    )
+    assert collector.enabled
+    assert collector.collect() == [(CGROUP_MEM_USAGE, 1024)]
+
+
+def test_cgroup_v2(tmpdir):
+    collector = _cgroup_collector(
+        tmpdir,
+        {
+            "system.slice/app/cpu.stat": "usage_usec 10\nnr_periods 10\nnr_throttled 2\nthrottled_usec 5\n",
+            "system.slice/app/memory.current": "1024\n",
+            "system.slice/app/memory.max": "max\n",
+        },
+        {"": "/system.slice/app"},
+    )
+    assert collector.enabled
+    tmpdir.join("system.slice/app/cpu.stat").write("usage_usec 20\nnr_periods 20\nnr_throttled 3\nthrottled_usec 7\n")
+    assert sorted(collector.collect()) == [
+        (CGROUP_CPU_THROTTLED, 1),
+        (CGROUP_CPU_THROTTLED_TIME, 2000),
+        (CGROUP_MEM_USAGE, 1024),
+    ]
+
+
+def test_cgroup_unavailable(tmpdir):
+    collector = _cgroup_collector(tmpdir, {}, {})
+    assert not collector.enabled
+    assert collector.collect() == []
+
+
 class TestGCRuntimeMetricCollector(BaseTestCase):
     def test_metrics(self):
         collector = GCRuntimeMetricCollector()
@@ -63,3 +185,69 @@ class TestGCRuntimeMetricCollector(BaseTestCase):
         assert len(collected_after) == 1
         assert collected_after[0][0] == "runtime.python.gc.count.gen0"
         assert isinstance(collected_after[0][1], int)
+
+
+@pytest.mark.skipif(not GCMonitor.available(), reason="gc.callbacks requires Python 3.3+")
+class TestGCPauseRuntimeMetricCollector(BaseTestCase):
+    def test_metrics(self):
+        import gc
+
+        collector = GCPauseRuntimeMetricCollector()
+        try:
+            assert collector.enabled
+            collector.collect()
+
+            # A reference cycle is only collected by the garbage collector
+            a = []
+            a.append(a)
+            del a
+            gc.collect()
+
+            metrics = dict(collector.collect())
+            assert metrics[GC_PAUSE_GEN2]
+            assert all(0 < pause < 1 for pause in metrics[GC_PAUSE_GEN2])
+            assert metrics[GC_COLLECTED] >= 1
+
+            # The values are reset by each collection
+            metrics = dict(collector.collect())
+            assert metrics[GC_PAUSE_GEN2] == []
+            assert metrics[GC_COLLECTED] == 0
+        finally:
+            collector.stop()
+        assert not collector.enabled
+
+
+@pytest.mark.skipif(not GCMonitor.available(), reason="gc.callbacks requires Python 3.3+")
+def test_gc_monitor_start_stop():
+    import gc
+
+    monitor = GCMonitor()
+    assert monitor.start()
+    assert monitor.start()
+    assert gc.callbacks.count(monitor._callback) == 1
+
+    pause_ns = monitor.pause_ns
+    gc.collect()
+    assert monitor.pause_ns > pause_ns
+
+    monitor.stop()
+    assert monitor._callback in gc.callbacks
+    monitor.stop()
+    assert monitor._callback not in gc.callbacks
+    monitor.stop()
+
+    pause_ns = monitor.pause_ns
+    gc.collect()
+    assert monitor.pause_ns == pause_ns
+
+
+def test_gc_monitor_max_pauses():
+    monitor = GCMonitor()
+    for _ in range(GCMonitor.MAX_PAUSES + 1):
+        monitor._callback("start", {"generation": 0})
+        monitor._callback("stop", {"generation": 0, "collected": 1, "uncollectable": 0})
+    gen0, gen1, gen2 = monitor.flush_pauses()
+    assert len(gen0) == GCMonitor.MAX_PAUSES
+    assert gen1 == gen2 == []
+    assert monitor.collected == GCMonitor.MAX_PAUSES + 1
+    assert monitor.flush_pauses() == ([], [], [])
@@ -1,15 +1,34 @@
+import gc
+import sys
 import time
 
 import mock
+import pytest
 
 from ddtrace.ext import SpanTypes
 
 from ddtrace.internal.runtime.runtime_metrics import (
     RuntimeTags,
     RuntimeMetrics,
+    RuntimeWorker,
+)
+from ddtrace.internal.runtime.constants import (
+    ASYNCIO_RUNTIME_METRICS,
+    CGROUP_RUNTIME_METRICS,
+    DEFAULT_RUNTIME_METRICS,
+    DISTRIBUTION_RUNTIME_METRICS,
+    GC_PAUSE_GEN2,
+    GC_COUNT_GEN0,
+    SERVICE,
+    ENV,
+)
+from ddtrace.internal.runtime.metric_collectors import (
+    GCPauseRuntimeMetricCollector,
+    ProcRuntimeMetricCollector,
+    PSUtilRuntimeMetricCollector,
 )
-from ddtrace.internal.runtime.constants import DEFAULT_RUNTIME_METRICS, GC_COUNT_GEN0, SERVICE, ENV
 
+from ddtrace.vendor.dogstatsd import DogStatsd
 from tests import TracerTestCase, BaseTestCase
 
 
@@ -54,12 +73,36 @@ class TestRuntimeTags(TracerTestCase):
 class TestRuntimeMetrics(BaseTestCase):
     def test_all_metrics(self):
         metrics = set([k for (k, v) in RuntimeMetrics()])
-        self.assertSetEqual(metrics, DEFAULT_RUNTIME_METRICS)
+        # The cgroup metrics depend on the platform and the event loops are monitored on demand
+        expected = DEFAULT_RUNTIME_METRICS - CGROUP_RUNTIME_METRICS - ASYNCIO_RUNTIME_METRICS
+        assert expected <= metrics <= DEFAULT_RUNTIME_METRICS
 
     def test_one_metric(self):
         metrics = [k for (k, v) in RuntimeMetrics(enabled=[GC_COUNT_GEN0])]
         self.assertEqual(metrics, [GC_COUNT_GEN0])
 
+    def test_psutil_fallback(self):
+        # psutil is used where /proc is not available
+        with mock.patch.object(ProcRuntimeMetricCollector, "STAT_PATH", "/path/does/not/exist"):
+            collectors = [type(c) for c in RuntimeMetrics()._collectors]
+        assert ProcRuntimeMetricCollector not in collectors
+        assert PSUtilRuntimeMetricCollector in collectors
+
+
+@pytest.mark.skipif(sys.version_info < (3, 3), reason="gc.callbacks requires Python 3.3+")
+def test_runtime_worker_distributions():
+    statsd = DogStatsd(disable_telemetry=True)
+    statsd.socket = mock.Mock()
+    worker = RuntimeWorker(statsd)
+    gc.collect()
+    worker.on_shutdown()
+
+    lines = [line for call in statsd.socket.send.call_args_list for line in call[0][0].decode("utf-8").split("\n")]
+    assert any(line.startswith(GC_PAUSE_GEN2 + ":") and line.endswith("|d") for line in lines)
+    # The garbage collector is not monitored anymore once the worker is stopped
+    (collector,) = [c for c in worker._runtime_metrics._collectors if isinstance(c, GCPauseRuntimeMetricCollector)]
+    assert not collector.enabled
+
 
 class TestRuntimeWorker(TracerTestCase):
     def test_tracer_metrics(self):
@@ -91,10 +134,11 @@ class TestRuntimeWorker(TracerTestCase):
 
         # expect all metrics in default set are received
         # DEV: dogstatsd gauges in form "{metric_name}:{metric_value}|g#t{tag_name}:{tag_value},..."
-        assert (
-            DEFAULT_RUNTIME_METRICS & set([gauge.split(":")[0] for packet in received for gauge in packet.split("\n")])
-            == DEFAULT_RUNTIME_METRICS
+        # The distributions are only sent when there are values
+        expected = (
+            DEFAULT_RUNTIME_METRICS - CGROUP_RUNTIME_METRICS - ASYNCIO_RUNTIME_METRICS - DISTRIBUTION_RUNTIME_METRICS
         )
+        assert expected & set([gauge.split(":")[0] for packet in received for gauge in packet.split("\n")]) == expected
 
         # check to last set of metrics returned to confirm tags were set
         for gauge in received[-1:]:
@@ -6,7 +6,8 @@ import pytest
 
 from ddtrace.span import Span
 from ddtrace.context import Context
-from ddtrace.constants import HOSTNAME_KEY
+from ddtrace.constants import HOSTNAME_KEY, SAMPLING_PRIORITY_KEY
+from ddtrace.constants import SPAN_SUMMARY_COUNT_KEY, SPAN_SUMMARY_DURATION_KEY, SPAN_SUMMARY_ERRORS_KEY
 from ddtrace.ext.priority import USER_REJECT, AUTO_REJECT, AUTO_KEEP, USER_KEEP
 
 from .test_tracer import get_dummy_tracer
@@ -135,6 +136,226 @@ class TestTracingContext(BaseTestCase):
         assert 0 == len(ctx._trace)
         assert ctx._current_span is None
 
+    def test_partial_flush(self):
+        ctx = Context(sampling_priority=AUTO_KEEP)
+        root = Span(tracer=None, name='root')
+        ctx.add_span(root)
+        children = []
+        for i in range(4):
+            child = Span(tracer=None, name='child%d' % i, trace_id=root.trace_id, parent_id=root.span_id)
+            child._parent = root
+            ctx.add_span(child)
+            children.append(child)
+
+        with mock.patch.object(Context, '_partial_flush_enabled', True), \
+                mock.patch.object(Context, '_partial_flush_min_spans', 2):
+            children[1].finished = True
+            assert ctx.close_span(children[1]) == (None, None)
+            assert ctx._finished_spans == [children[1]]
+
+            children[3].finished = True
+            trace, sampled = ctx.close_span(children[3])
+            assert trace == [children[1], children[3]]
+            assert sampled is True
+            # the flushed chunk carries the sampling priority
+            assert children[1].get_metric(SAMPLING_PRIORITY_KEY) == AUTO_KEEP
+            assert ctx._trace == [root, children[0], children[2]]
+            assert ctx._finished_spans == []
+
+            children[2].finished = True
+            assert ctx.close_span(children[2]) == (None, None)
+            children[0].finished = True
+            # the chunk holds the spans in the order they finished
+            assert ctx.close_span(children[0]) == ([children[2], children[0]], True)
+            # only the first chunk carries the sampling priority
+            assert children[2].get_metric(SAMPLING_PRIORITY_KEY) is None
+            assert ctx._trace == [root]
+            root.finished = True
+            assert ctx.close_span(root) == ([root], True)
+            assert root.get_metric(SAMPLING_PRIORITY_KEY) == AUTO_KEEP
+            assert ctx._trace == []
+            assert ctx._partially_flushed is False
+
+    def test_partial_flush_root_finished_first(self):
+        ctx = Context()
+        root = Span(tracer=None, name='root')
+        ctx.add_span(root)
+        children = []
+        for i in range(3):
+            child = Span(tracer=None, name='child%d' % i, trace_id=root.trace_id, parent_id=root.span_id)
+            child._parent = root
+            ctx.add_span(child)
+            children.append(child)
+
+        with mock.patch.object(Context, '_partial_flush_enabled', True), \
+                mock.patch.object(Context, '_partial_flush_min_spans', 3):
+            for span in (root, children[0], children[2]):
+                span.finished = True
+                trace, sampled = ctx.close_span(span)
+            assert trace == [root, children[0], children[2]]
+            # the span left open is not the root
+            assert ctx._trace == [children[1]]
+
+    def test_partial_flush_skips_open_spans(self):
+        class OpenSpan(Span):
+            reads = 0
+
+            @property
+            def finished(self):
+                OpenSpan.reads += 1
+                return False
+
+            @finished.setter
+            def finished(self, value):
+                pass
+
+        ctx = Context()
+        root = OpenSpan(tracer=None, name='root')
+        ctx.add_span(root)
+        spans = [root]
+        finished = []
+        for i in range(10):
+            span = OpenSpan(tracer=None, name='open%d' % i, trace_id=root.trace_id, parent_id=root.span_id)
+            span._parent = root
+            ctx.add_span(span)
+            spans.append(span)
+            span = Span(tracer=None, name='child%d' % i, trace_id=root.trace_id, parent_id=root.span_id)
+            span._parent = root
+            ctx.add_span(span)
+            spans.append(span)
+            finished.append(span)
+
+        with mock.patch.object(Context, '_partial_flush_enabled', True), \
+                mock.patch.object(Context, '_partial_flush_min_spans', 5):
+            OpenSpan.reads = 0
+            for span in finished[:5]:
+                span.finished = True
+                trace, sampled = ctx.close_span(span)
+            assert trace == finished[:5]
+            # the open spans are not visited by the flush
+            assert OpenSpan.reads == 0
+            assert ctx._trace == [span for span in spans if span not in finished[:5]]
+            assert ctx.get_current_root_span() is root
+
+    def test_max_spans(self):
+        tracer = get_dummy_tracer()
+        with mock.patch.object(Context, '_max_spans', 3):
+            with tracer.trace('root') as root:
+                with tracer.trace('request'):
+                    with tracer.trace('parent'):
+                        for i in range(100):
+                            with tracer.trace('query', resource='SELECT %d' % (i % 2)) as query:
+                                query.error = int(i < 3)
+                                with tracer.trace('nested', resource='nested'):
+                                    pass
+                        ctx = root.context
+                        assert len(ctx._trace) == 6
+                        assert ctx._overflow_spans == {}
+
+        spans = tracer.writer.pop()
+        assert [s.name for s in spans] == ['root', 'request', 'parent', 'nested', 'query', 'query']
+        assert ctx._trace == []
+        assert ctx._summary_spans == {}
+
+        nested, query_0, query_1 = spans[3:]
+        assert nested.resource == 'nested'
+        assert nested.get_metric(SPAN_SUMMARY_COUNT_KEY) == 100
+        assert nested.get_metric(SPAN_SUMMARY_ERRORS_KEY) == 0
+        assert nested.error == 0
+
+        assert query_0.resource == 'SELECT 0'
+        assert query_0.get_metric(SPAN_SUMMARY_COUNT_KEY) == 50
+        assert query_0.get_metric(SPAN_SUMMARY_ERRORS_KEY) == 2
+        assert query_0.error == 1
+        assert query_1.resource == 'SELECT 1'
+        assert query_1.get_metric(SPAN_SUMMARY_COUNT_KEY) == 50
+        assert query_1.get_metric(SPAN_SUMMARY_ERRORS_KEY) == 1
+
+        for summary in (nested, query_0, query_1):
+            assert summary.trace_id == root.trace_id
+            assert summary.parent_id == root.span_id
+            assert summary.start_ns >= root.start_ns
+            assert 0 < summary.get_metric(SPAN_SUMMARY_DURATION_KEY) <= summary.duration_ns
+            assert summary.start_ns + summary.duration_ns <= root.start_ns + root.duration_ns
+
+    def test_max_spans_current_span(self):
+        tracer = get_dummy_tracer()
+        with mock.patch.object(Context, '_max_spans', 1):
+            with tracer.trace('root') as root:
+                with tracer.trace('child') as child:
+                    assert tracer.current_span() is child
+                    with tracer.trace('grandchild') as grandchild:
+                        assert grandchild.parent_id == child.span_id
+                    assert tracer.current_span() is child
+                assert tracer.current_span() is root
+
+        assert [s.name for s in tracer.writer.pop()] == ['root', 'grandchild', 'child']
+
+    def test_max_spans_flushed_trace(self):
+        # overflow spans finishing after the root span are dropped
+        tracer = get_dummy_tracer()
+        with mock.patch.object(Context, '_max_spans', 1):
+            root = tracer.trace('root')
+            child = tracer.trace('child')
+            root.finish()
+            child.finish()
+
+        assert [s.name for s in tracer.writer.pop()] == ['root']
+        assert root.context._trace == []
+
+    def test_max_spans_flushed_trace_reused_context(self):
+        # overflow spans finishing after the root span do not alter the next trace of the context
+        tracer = get_dummy_tracer()
+        with mock.patch.object(Context, '_max_spans', 1):
+            root = tracer.trace('root')
+            child = tracer.trace('child')
+            root.finish()
+
+            new_root = tracer.trace('new_root')
+            ctx = new_root.context
+            assert ctx is root.context
+            child.finish()
+            assert ctx._trace == [new_root]
+            assert ctx._finished_spans == []
+            assert ctx.get_current_span() is new_root
+            assert ctx._flushed_overflow_spans == {}
+
+            with tracer.trace('new_child') as new_child:
+                assert new_child.parent_id == new_root.span_id
+            new_root.finish()
+
+        # the new child is past the cap of the new trace and summarized
+        assert [s.name for s in tracer.writer.pop()] == ['root', 'new_root', 'new_child']
+
+    def test_max_spans_partial_flush(self):
+        # the children of an overflow span are not sent after a partial flush made room in the trace
+        tracer = get_dummy_tracer()
+        with mock.patch.object(Context, '_max_spans', 3), \
+                mock.patch.object(Context, '_partial_flush_enabled', True), \
+                mock.patch.object(Context, '_partial_flush_min_spans', 2):
+            root = tracer.trace('root')
+            first = tracer.start_span('first', child_of=root)
+            second = tracer.start_span('second', child_of=root)
+            overflow = tracer.start_span('overflow', child_of=root)
+            first.finish()
+            second.finish()
+            assert [s.name for s in tracer.writer.pop()] == ['first', 'second']
+            assert root.context._trace == [root]
+
+            child = tracer.start_span('child', child_of=overflow)
+            assert root.context._trace == [root]
+            child.finish()
+            overflow.finish()
+            root.finish()
+
+        spans = tracer.writer.pop()
+        assert [s.name for s in spans] == ['root', 'child', 'overflow']
+        # the spans past the cap are folded into summary spans
+        for span in spans[1:]:
+            assert span.get_metric(SPAN_SUMMARY_COUNT_KEY) == 1
+            assert span.parent_id == root.span_id
+        assert overflow.span_id not in [s.parent_id for s in spans]
+
     @mock.patch('ddtrace.internal.hostname.get_hostname')
     def test_get_report_hostname_enabled(self, get_hostname):
         get_hostname.return_value = 'test-hostname'
@@ -250,6 +471,49 @@ class TestTracingContext(BaseTestCase):
 
         assert 100 == len(ctx._trace)
 
+    def test_thread_safe_concurrent_access(self):
+        # spans are added and closed from several threads while the
+        # accessors are read without the lock
+        tracer = get_dummy_tracer()
+        ctx = Context()
+        root = tracer.start_span('root', child_of=ctx)
+        stop = threading.Event()
+        errors = []
+
+        def _spans():
+            for _ in range(200):
+                span = tracer.start_span('child', child_of=root)
+                span.finish()
+
+        def _read():
+            while not stop.is_set():
+                try:
+                    assert ctx.trace_id in (None, root.trace_id)
+                    current_span = ctx.get_current_span()
+                    assert current_span is None or current_span.trace_id == root.trace_id
+                    ctx.sampling_priority
+                    ctx.span_id
+                except Exception as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=_read) for _ in range(2)]
+        writers = [threading.Thread(target=_spans) for _ in range(8)]
+        for t in readers + writers:
+            t.start()
+        for t in writers:
+            t.join()
+        root.finish()
+        stop.set()
+        for t in readers:
+            t.join()
+
+        assert errors == []
+        spans = tracer.writer.pop()
+        assert len(spans) == 8 * 200 + 1
+        assert len(set(span.span_id for span in spans)) == len(spans)
+        assert ctx._trace == []
+        assert ctx._finished_spans == []
+
     def test_clone(self):
         ctx = Context()
         ctx.sampling_priority = 2
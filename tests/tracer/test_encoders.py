@@ -3,6 +3,7 @@ import json
 import random
 import string
 import struct
+import threading
 from unittest import TestCase
 
 import msgpack
@@ -11,7 +12,16 @@ import pytest
 from ddtrace.tracer import Tracer
 from ddtrace.span import Span, SpanTypes
 from ddtrace.compat import msgpack_type, string_type
-from ddtrace.encoding import _EncoderBase, JSONEncoder, JSONEncoderV2, MsgpackEncoder
+from ddtrace.encoding import (
+    _EncoderBase,
+    BufferedEncoder,
+    BufferedEncoderV05,
+    JSONEncoder,
+    JSONEncoderV2,
+    MsgpackEncoder,
+)
+from ddtrace.internal.buffer import BufferFull, BufferItemTooLarge
+from ddtrace.internal._encoding import Packer
 
 
 def rands(size=6, chars=string.ascii_uppercase + string.digits):
@@ -304,6 +314,295 @@ def test_custom_msgpack_join_encoded():
     assert decode(ref) == decode(custom)
 
 
+def test_packer_buffer_shrinks_after_large_payload():
+    packer = Packer()
+    initial_size = packer.buffer_size
+
+    trace = gen_trace(nspans=1000)
+    encoded = packer.pack(trace)
+    assert len(encoded) > initial_size
+    assert packer.buffer_size == initial_size
+
+    # The packer is still usable after shrinking its buffer
+    assert decode(packer.pack(trace)) == decode(encoded)
+
+
+def test_packer_reset_after_error():
+    packer = Packer()
+    with pytest.raises(TypeError):
+        packer.pack([1, 2, object()])
+
+    # No bytes of the failed object are left in the reused buffer
+    assert decode(packer.pack([3])) == [3]
+
+
+@pytest.mark.parametrize("size", [0, 255, 256, 65535, 65536])
+def test_packer_use_bin_type(size):
+    data = b"\xff" * size
+    assert msgpack.unpackb(Packer(use_bin_type=True).pack({u"a": data}), raw=False) == {u"a": data}
+    # Bytes are packed as raw strings by default
+    assert Packer().pack(data) == msgpack.packb(data, use_bin_type=False)
+    assert Packer(use_bin_type=True).pack(data) == msgpack.packb(data, use_bin_type=True)
+
+
+def test_custom_msgpack_encode_threads():
+    encoder = MsgpackEncoder()
+    refencoder = RefMsgpackEncoder()
+
+    trace = gen_trace(nspans=50)
+    expected = decode(refencoder.encode_trace(trace))
+    results = []
+
+    def _encode():
+        for _ in range(50):
+            results.append(decode(encoder.encode_trace(trace)))
+
+    threads = [threading.Thread(target=_encode) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 400
+    assert all(r == expected for r in results)
+
+
+@pytest.mark.parametrize("n_traces", [0, 1, 15, 16, 2 ** 16 - 1, 2 ** 16])
+def test_buffered_encoder_encode(n_traces):
+    encoder = BufferedEncoder(max_size=64 << 20, max_item_size=64 << 20)
+    refencoder = RefMsgpackEncoder()
+
+    trace = [Span(None, "span_name", service="my-svc")]
+    trace[0].finish()
+    for _ in range(n_traces):
+        encoder.put(trace)
+    assert len(encoder) == n_traces
+    assert encoder.size == n_traces * len(MsgpackEncoder().encode_trace(trace))
+
+    payload, count = encoder.encode()
+    assert count == n_traces
+    if n_traces:
+        assert isinstance(payload, memoryview)
+        assert decode(payload.tobytes()) == decode(refencoder.encode_traces([trace] * n_traces))
+    else:
+        assert payload is None
+
+    # The buffer is reset after a payload has been sealed
+    assert len(encoder) == 0
+    assert encoder.size == 0
+    assert encoder.encode() == (None, 0)
+
+
+def test_buffered_encoder_payload_outlives_encoder():
+    encoder = BufferedEncoder(max_size=1 << 20, max_item_size=1 << 20)
+    trace = gen_trace(nspans=10)
+    encoder.put(trace)
+    payload, _ = encoder.encode()
+
+    # Reusing the encoder does not affect previously sealed payloads
+    encoder.put(gen_trace(nspans=10))
+    del encoder
+    assert decode(payload.tobytes()) == decode(RefMsgpackEncoder().encode_traces([trace]))
+
+
+def test_buffered_encoder_limits():
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    trace_size = len(MsgpackEncoder().encode_trace(trace))
+    encoder = BufferedEncoder(max_size=trace_size * 2, max_item_size=trace_size)
+
+    with pytest.raises(BufferItemTooLarge) as e:
+        encoder.put(trace * 2)
+    assert e.value.args[0] == trace_size * 2 - 1
+    assert len(encoder) == 0
+    assert encoder.size == 0
+
+    encoder.put(trace)
+    encoder.put(trace)
+    with pytest.raises(BufferFull) as e:
+        encoder.put(trace)
+    assert e.value.args[0] == trace_size
+    assert len(encoder) == 2
+    assert encoder.size == trace_size * 2
+
+    payload, count = encoder.encode()
+    assert count == 2
+    assert decode(payload.tobytes()) == decode(RefMsgpackEncoder().encode_traces([trace, trace]))
+
+
+def test_buffered_encoder_encode_error():
+    encoder = BufferedEncoder(max_size=1 << 20, max_item_size=1 << 20)
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    encoder.put(trace)
+
+    with pytest.raises(TypeError):
+        encoder.put([Span(None, "span_name"), object()])
+
+    # The partially encoded trace is discarded
+    assert len(encoder) == 1
+    payload, _ = encoder.encode()
+    assert decode(payload.tobytes()) == decode(RefMsgpackEncoder().encode_traces([trace]))
+
+
+@pytest.mark.parametrize("shards", [1, 4])
+def test_buffered_encoder_shards_threads(shards):
+    encoder = BufferedEncoder(max_size=64 << 20, max_item_size=64 << 20, shards=shards)
+    assert encoder.shards == shards
+
+    def _put(trace_id):
+        for i in range(100):
+            span = Span(None, "span_name", trace_id=trace_id, span_id=i + 1)
+            span.finish()
+            encoder.put([span])
+
+    threads = [threading.Thread(target=_put, args=(trace_id,)) for trace_id in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(encoder) == 800
+    size = encoder.size
+
+    payload, count = encoder.encode()
+    assert count == 800
+    assert len(payload) == size + 3
+    traces = decode(payload.tobytes())
+    assert len(traces) == 800
+    for trace_id in range(1, 9):
+        span_ids = [t[0][b"span_id"] for t in traces if t[0][b"trace_id"] == trace_id]
+        # Traces from a given thread are kept in order
+        assert span_ids == list(range(1, 101))
+
+    assert len(encoder) == 0
+    assert encoder.size == 0
+
+
+def test_buffered_encoder_shards_limits():
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    trace_size = len(MsgpackEncoder().encode_trace(trace))
+    encoder = BufferedEncoder(max_size=trace_size * 4, max_item_size=trace_size, shards=4)
+
+    # The size of the payload is accounted across shards
+    def _put():
+        encoder.put(trace)
+        encoder.put(trace)
+
+    threads = [threading.Thread(target=_put) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert encoder.size == trace_size * 4
+    with pytest.raises(BufferFull):
+        encoder.put(trace)
+
+    payload, count = encoder.encode()
+    assert count == 4
+    assert decode(payload.tobytes()) == decode(MsgpackEncoder().encode_traces([trace] * 4))
+    encoder.put(trace)
+    assert encoder.size == trace_size
+
+
+def test_buffered_encoder_v05_not_sharded():
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20, shards=4)
+    assert encoder.shards == 1
+
+
+def decode_v05(payload):
+    """Decode a v0.5 payload into the v0.4 representation of traces."""
+    string_table, traces = msgpack.unpackb(payload, raw=True, strict_map_key=False)
+    assert string_table[0] == b""
+
+    def _span(s):
+        span = {
+            b"service": string_table[s[0]],
+            b"name": string_table[s[1]],
+            b"resource": string_table[s[2]],
+            b"trace_id": s[3],
+            b"span_id": s[4],
+            b"parent_id": s[5],
+            b"start": s[6],
+            b"duration": s[7],
+            b"error": s[8],
+        }
+        if s[9]:
+            span[b"meta"] = {string_table[k]: string_table[v] for k, v in s[9].items()}
+        if s[10]:
+            span[b"metrics"] = {string_table[k]: v for k, v in s[10].items()}
+        if s[11]:
+            span[b"type"] = string_table[s[11]]
+        return span
+
+    return [[_span(s) for s in trace] for trace in traces]
+
+
+def test_buffered_encoder_v05():
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    refencoder = BufferedEncoder(max_size=1 << 20, max_item_size=1 << 20)
+
+    traces = [gen_trace(nspans=10, ntags=5, nmetrics=3) for _ in range(3)]
+    for trace in traces:
+        # parent_id is encoded as 0 for root spans
+        trace[0].parent_id = 0
+        encoder.put(trace)
+        refencoder.put(trace)
+    assert len(encoder) == 3
+    assert encoder.size < refencoder.size
+
+    payload, count = encoder.encode()
+    assert count == 3
+    refpayload, _ = refencoder.encode()
+    assert decode_v05(payload.tobytes()) == decode(refpayload.tobytes())
+
+    # The string table is reset with the buffer
+    trace = [Span(None, "span_name", service="my-svc")]
+    trace[0].finish()
+    encoder.put(trace)
+    payload, count = encoder.encode()
+    string_table, _ = msgpack.unpackb(payload.tobytes(), raw=True)
+    assert string_table == [b"", b"my-svc", b"span_name"]
+
+
+def test_buffered_encoder_v05_rollback():
+    trace = [Span(None, "span_name", service="my-svc")]
+    trace[0].finish()
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    encoder.put(trace)
+    size = encoder.size
+
+    # Strings added by a trace that fails to encode are removed from the table
+    with pytest.raises(TypeError):
+        encoder.put([Span(None, "other_span_name", service="other-svc"), object()])
+    assert encoder.size == size
+    assert len(encoder) == 1
+
+    payload, _ = encoder.encode()
+    string_table, traces = msgpack.unpackb(payload.tobytes(), raw=True)
+    assert string_table == [b"", b"my-svc", b"span_name"]
+    assert len(traces) == 1
+
+
+def test_buffered_encoder_v05_limits():
+    trace = [Span(None, "span_name", service="my-svc")]
+    trace[0].finish()
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    encoder.put(trace)
+    trace_size = encoder.size
+
+    # The strings added to the string table count toward the trace size
+    encoder = BufferedEncoderV05(max_size=trace_size, max_item_size=trace_size)
+    encoder.put(trace)
+    with pytest.raises(BufferFull):
+        encoder.put([Span(None, "other_span_name")])
+    with pytest.raises(BufferItemTooLarge):
+        encoder.put([Span(None, "span_name" * 10)])
+    assert encoder.size == trace_size
+
+
 def span_type_span():
     s = Span(None, "span_name")
     s.span_type = SpanTypes.WEB
@@ -328,6 +627,9 @@ def test_msgpack_span_property_variations(span):
 
     trace = [span]
     assert decode(refencoder.encode_trace(trace)) == decode(encoder.encode_trace(trace))
+    # The tags of spans without tags are not allocated by the encoders
+    assert span._meta is None
+    assert span._metrics is None
 
 
 class SubString(str):
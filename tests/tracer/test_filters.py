@@ -1,6 +1,8 @@
 from unittest import TestCase
 
-from ddtrace.filters import FilterRequestsOnUrl
+import mock
+
+from ddtrace.filters import FilterRequestsOnResource, FilterRequestsOnUrl
 from ddtrace.span import Span
 from ddtrace.ext.http import URL
 
@@ -33,3 +35,59 @@ class FilterRequestOnUrlTests(TestCase):
         filtr = FilterRequestsOnUrl([r'http://domain\.example\.com', r'http://anotherdomain\.example\.com'])
         trace = filtr.process_trace([span])
         self.assertIsNotNone(trace)
+
+    def test_root_span_only(self):
+        root = Span(name='Name', tracer=None, span_id=1)
+        root.set_tag(URL, r'http://anotherexample.com')
+        child = Span(name='Name', tracer=None, parent_id=1)
+        child.set_tag(URL, r'http://example.com')
+        filtr = FilterRequestsOnUrl('http://examp.*.com')
+        trace = filtr.process_trace([root, child])
+        self.assertIsNotNone(trace)
+
+    def test_uncombined_patterns(self):
+        # Patterns with groups or flags are matched on their own
+        filtr = FilterRequestsOnUrl([r'http://(a+)\.example\.com/\1', r'(?i)http://UPPER\.example\.com', r'http://b'])
+        self.assertEqual(len(filtr._matcher._fallback), 2)
+        for url, filtered in [
+            ('http://aa.example.com/aa', True),
+            ('http://aa.example.com/a/', False),
+            ('http://upper.example.com', True),
+            ('http://b.example.com', True),
+            ('http://c.example.com', False),
+        ]:
+            span = Span(name='Name', tracer=None)
+            span.set_tag(URL, url)
+            self.assertEqual(filtr.process_trace([span]) is None, filtered, url)
+
+    def test_cache(self):
+        filtr = FilterRequestsOnUrl('http://examp.*.com', cache_size=2)
+        filtr._matcher._combined = mock.Mock(wraps=filtr._matcher._combined)
+        for _ in range(3):
+            span = Span(name='Name', tracer=None)
+            span.set_tag(URL, r'http://example.com')
+            self.assertIsNone(filtr.process_trace([span]))
+        self.assertEqual(filtr._matcher._combined.match.call_count, 1)
+
+
+class FilterRequestsOnResourceTests(TestCase):
+    def test_resource_match(self):
+        span = Span(name='flask.request', resource='GET /health', tracer=None)
+        filtr = FilterRequestsOnResource(resources=[r'GET /health$', r'GET /static/'])
+        self.assertIsNone(filtr.process_trace([span]))
+
+    def test_name_match(self):
+        span = Span(name='celery.run', resource='tasks.add', tracer=None)
+        filtr = FilterRequestsOnResource(names=r'celery\.')
+        self.assertIsNone(filtr.process_trace([span]))
+
+    def test_no_match(self):
+        span = Span(name='flask.request', resource='GET /users', tracer=None)
+        filtr = FilterRequestsOnResource(resources=r'GET /health', names=r'celery\.')
+        self.assertIsNotNone(filtr.process_trace([span]))
+
+    def test_root_span_only(self):
+        root = Span(name='flask.request', resource='GET /users', tracer=None, span_id=1)
+        child = Span(name='flask.request', resource='GET /health', tracer=None, parent_id=1)
+        filtr = FilterRequestsOnResource(resources=r'GET /health')
+        self.assertIsNotNone(filtr.process_trace([root, child]))
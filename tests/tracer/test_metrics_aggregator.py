@@ -0,0 +1,114 @@
+import os
+import socket
+import threading
+
+import mock
+
+from ddtrace.internal.metrics import MetricsAggregator
+from ddtrace.vendor.dogstatsd import DogStatsd
+
+
+def _aggregator(max_payload_size=None, **kwargs):
+    statsd = DogStatsd(disable_telemetry=True, **kwargs)
+    statsd.socket = mock.Mock()
+    return MetricsAggregator(statsd, max_payload_size=max_payload_size)
+
+
+def _packets(aggregator):
+    return [call[0][0].decode("utf-8") for call in aggregator.statsd_client.socket.send.call_args_list]
+
+
+def test_aggregate():
+    aggregator = _aggregator(constant_tags=['env:test'])
+    aggregator.increment('requests')
+    aggregator.increment('requests', 2)
+    aggregator.increment('requests', tags=['type:err'])
+    aggregator.gauge('threads', 2)
+    aggregator.gauge('threads', 4)
+    aggregator.distribution('bytes', 10)
+    aggregator.distribution('bytes', 20)
+    aggregator.flush()
+
+    (packet,) = _packets(aggregator)
+    assert sorted(packet.split('\n')) == [
+        'bytes:10|d|#env:test',
+        'bytes:20|d|#env:test',
+        'requests:1|c|#type:err,env:test',
+        'requests:3|c|#env:test',
+        'threads:4|g|#env:test',
+    ]
+
+    # The metrics are reset once flushed
+    aggregator.statsd_client.socket.send.reset_mock()
+    aggregator.flush()
+    aggregator.statsd_client.socket.send.assert_not_called()
+
+
+def test_namespace():
+    aggregator = _aggregator(namespace='tracer', constant_tags=['env:te st'])
+    aggregator.gauge('threads', 2, tags=['a:b'])
+    aggregator.flush()
+
+    assert _packets(aggregator) == ['tracer.threads:2|g|#a:b,env:te_st']
+
+
+def test_flush_max_payload_size():
+    aggregator = _aggregator(max_payload_size=64)
+    for i in range(20):
+        aggregator.distribution('datadog.tracer.metric', i)
+    aggregator.gauge('a' * 100, 1)
+    aggregator.flush()
+
+    packets = _packets(aggregator)
+    assert len(packets) > 1
+    for packet in packets:
+        assert len(packet) <= 64 or '\n' not in packet
+    lines = [line for packet in packets for line in packet.split('\n')]
+    assert len(lines) == 21
+    assert 'a' * 100 + ':1|g' in lines
+
+
+def test_max_payload_size_transport():
+    assert _aggregator().max_payload_size == 1432
+    assert _aggregator(socket_path='/tmp/dsd.socket').max_payload_size == 8192
+
+
+def test_flush_disabled():
+    with mock.patch.dict(os.environ, {'DD_DOGSTATSD_DISABLE': 'true'}):
+        aggregator = _aggregator()
+    aggregator.increment('requests')
+    aggregator.flush()
+    aggregator.statsd_client.socket.send.assert_not_called()
+
+
+def test_flush_socket_error():
+    aggregator = _aggregator()
+    statsd_socket = aggregator.statsd_client.socket
+    statsd_socket.send.side_effect = socket.error
+    aggregator.increment('requests')
+    aggregator.flush()
+
+    # The packet is dropped and the socket closed
+    statsd_socket.send.assert_called_once()
+    statsd_socket.close.assert_called_once()
+    assert aggregator.statsd_client.socket is None
+
+
+def test_threads():
+    aggregator = _aggregator()
+
+    def _increment():
+        for _ in range(1000):
+            aggregator.increment('requests')
+            aggregator.distribution('bytes', 1)
+
+    threads = [threading.Thread(target=_increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    aggregator.flush()
+
+    lines = [line for packet in _packets(aggregator) for line in packet.split('\n')]
+    assert 'requests:8000|c' in lines
+    assert lines.count('bytes:1|d') == 8000
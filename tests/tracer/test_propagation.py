@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+import pytest
+
 from ddtrace.propagation.utils import get_wsgi_header
 from ddtrace.propagation.http import (
     HTTPPropagator,
@@ -8,6 +10,10 @@ from ddtrace.propagation.http import (
     HTTP_HEADER_SAMPLING_PRIORITY,
     HTTP_HEADER_ORIGIN,
 )
+from ddtrace.context import Context
+from ddtrace.ext.priority import AUTO_KEEP, AUTO_REJECT, USER_KEEP
+from ddtrace.settings import Config
+from tests import override_env, override_global_config
 from tests.tracer.test_tracer import get_dummy_tracer
 
 
@@ -77,3 +83,154 @@ class TestHttpPropagation(TestCase):
 class TestPropagationUtils(object):
     def test_get_wsgi_header(self):
         assert get_wsgi_header("x-datadog-trace-id") == "HTTP_X_DATADOG_TRACE_ID"
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        {
+            "x-datadog-trace-id": "1234",
+            "x-datadog-parent-id": "5678",
+            "x-datadog-sampling-priority": "1",
+            "x-datadog-origin": "synthetics",
+        },
+        {
+            "HTTP_X_DATADOG_TRACE_ID": "1234",
+            "HTTP_X_DATADOG_PARENT_ID": "5678",
+            "HTTP_X_DATADOG_SAMPLING_PRIORITY": "1",
+            "HTTP_X_DATADOG_ORIGIN": "synthetics",
+        },
+        {
+            "X-Datadog-Trace-Id": "1234",
+            "X-Datadog-Parent-Id": "5678",
+            "X-Datadog-Sampling-Priority": "1",
+            "X-Datadog-Origin": "synthetics",
+            "User-Agent": "Mozilla/5.0",
+        },
+        # The first header is in a canonical form but not the others
+        {
+            "x-datadog-trace-id": "1234",
+            "X-Datadog-Parent-Id": "5678",
+            "X-Datadog-Sampling-Priority": "1",
+            "X-Datadog-Origin": "synthetics",
+        },
+        {
+            "HTTP_X_DATADOG_TRACE_ID": "1234",
+            "HTTP_X_DATADOG_PARENT_ID": "5678",
+            "x-datadog-sampling-priority": "1",
+            "X-Datadog-Origin": "synthetics",
+        },
+        {
+            "http_x_datadog_trace_id": "1234",
+            "Http_X_Datadog_Parent_Id": "5678",
+            "x-datadog-sampling-priority": "1",
+            "X-DATADOG-ORIGIN": "synthetics",
+        },
+    ],
+)
+def test_extract_header_forms(headers):
+    context = HTTPPropagator().extract(headers)
+    assert context.trace_id == 1234
+    assert context.span_id == 5678
+    assert context.sampling_priority == 1
+    assert context._dd_origin == "synthetics"
+
+
+def test_extract_no_trace_id():
+    context = HTTPPropagator().extract({"X-Datadog-Sampling-Priority": "2", "Accept": "*/*"})
+    assert not context.trace_id
+    assert not context.span_id
+    assert context.sampling_priority == 2
+
+
+def test_extract_invalid():
+    context = HTTPPropagator().extract({"x-datadog-trace-id": "nope", "x-datadog-parent-id": "5678"})
+    assert context.trace_id is None
+    assert context.span_id is None
+
+
+@pytest.mark.parametrize(
+    "headers,trace_id,span_id,sampling_priority",
+    [
+        ({"x-b3-traceid": "80f198ee56343ba864fe8b2a57d3eff7", "x-b3-spanid": "e457b5a2e4d86bd1"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, None),
+        ({"X-B3-TraceId": "64fe8b2a57d3eff7", "X-B3-SpanId": "e457b5a2e4d86bd1", "X-B3-Sampled": "1"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, AUTO_KEEP),
+        ({"HTTP_X_B3_TRACEID": "64fe8b2a57d3eff7", "HTTP_X_B3_SPANID": "e457b5a2e4d86bd1", "HTTP_X_B3_SAMPLED": "0"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, AUTO_REJECT),
+        ({"x-b3-traceid": "64fe8b2a57d3eff7", "x-b3-spanid": "e457b5a2e4d86bd1", "x-b3-flags": "1"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, USER_KEEP),
+        ({"b3": "80f198ee56343ba864fe8b2a57d3eff7-e457b5a2e4d86bd1-1-05e3ac9a4f6e3b90"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, AUTO_KEEP),
+        ({"b3": "64fe8b2a57d3eff7-e457b5a2e4d86bd1"}, 0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, None),
+        ({"b3": "0"}, None, None, AUTO_REJECT),
+        ({"traceparent": "00-80f198ee56343ba864fe8b2a57d3eff7-e457b5a2e4d86bd1-01"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, AUTO_KEEP),
+        ({"Traceparent": "00-80f198ee56343ba864fe8b2a57d3eff7-e457b5a2e4d86bd1-00"},
+         0x64fe8b2a57d3eff7, 0xe457b5a2e4d86bd1, AUTO_REJECT),
+        # The first configured style found is used
+        ({"x-datadog-trace-id": "1", "x-datadog-parent-id": "2", "x-b3-traceid": "3", "x-b3-spanid": "4"}, 1, 2, None),
+        # Invalid headers are ignored
+        ({"traceparent": "ff-80f198ee56343ba864fe8b2a57d3eff7-e457b5a2e4d86bd1-01", "x-b3-traceid": "3",
+          "x-b3-spanid": "4"}, 3, 4, None),
+        ({}, None, None, None),
+    ],
+)
+def test_extract_styles(headers, trace_id, span_id, sampling_priority):
+    styles = ("Datadog", "tracecontext", "B3", "B3 single header")
+    with override_global_config(dict(_propagation_style_extract=styles)):
+        context = HTTPPropagator().extract(headers)
+    assert context.trace_id == trace_id
+    assert context.span_id == span_id
+    assert context.sampling_priority == sampling_priority
+
+
+def test_extract_styles_not_configured():
+    headers = {"x-b3-traceid": "64fe8b2a57d3eff7", "x-b3-spanid": "e457b5a2e4d86bd1"}
+    context = HTTPPropagator().extract(headers)
+    assert context.trace_id is None
+
+    with override_global_config(dict(_propagation_style_extract=("B3",))):
+        context = HTTPPropagator().extract(headers)
+    assert context.trace_id == 0x64fe8b2a57d3eff7
+
+
+@pytest.mark.parametrize("sampling_priority", [None, AUTO_REJECT, AUTO_KEEP])
+def test_inject_styles(sampling_priority):
+    styles = ("Datadog", "B3", "B3 single header", "tracecontext")
+    context = Context(trace_id=0x64fe8b2a57d3eff7, span_id=0xe457b5a2e4d86bd1, sampling_priority=sampling_priority)
+    headers = {}
+    with override_global_config(dict(_propagation_style_inject=styles)):
+        HTTPPropagator().inject(context, headers)
+
+    sampled = {None: None, AUTO_REJECT: "0", AUTO_KEEP: "1"}[sampling_priority]
+    assert headers[HTTP_HEADER_TRACE_ID] == str(0x64fe8b2a57d3eff7)
+    assert headers[HTTP_HEADER_PARENT_ID] == str(0xe457b5a2e4d86bd1)
+    assert headers["x-b3-traceid"] == "64fe8b2a57d3eff7"
+    assert headers["x-b3-spanid"] == "e457b5a2e4d86bd1"
+    assert headers.get("x-b3-sampled") == sampled
+    assert headers["b3"] == "64fe8b2a57d3eff7-e457b5a2e4d86bd1" + ("-" + sampled if sampled else "")
+    assert headers["traceparent"] == "00-000000000000000064fe8b2a57d3eff7-e457b5a2e4d86bd1-%s" % (
+        "00" if sampling_priority == AUTO_REJECT else "01"
+    )
+
+    # Injected headers can be extracted back with every style
+    for style in styles:
+        with override_global_config(dict(_propagation_style_extract=(style,))):
+            extracted = HTTPPropagator().extract(headers)
+        assert extracted.trace_id == context.trace_id
+        assert extracted.span_id == context.span_id
+
+
+def test_propagation_style_env():
+    with override_env(dict(DD_PROPAGATION_STYLE_EXTRACT="B3, tracecontext", DD_PROPAGATION_STYLE_INJECT="")):
+        config = Config()
+    assert config._propagation_style_extract == ("B3", "tracecontext")
+    assert config._propagation_style_inject == ("datadog",)
+
+
+def test_propagation_style_invalid():
+    headers = {}
+    with override_global_config(dict(_propagation_style_inject=("nope", "B3"))):
+        HTTPPropagator().inject(Context(trace_id=1, span_id=2), headers)
+    assert headers == {"x-b3-traceid": "0000000000000001", "x-b3-spanid": "0000000000000002"}
@@ -1,10 +1,12 @@
 from __future__ import division
 import mock
+import threading
 
 import pytest
 
 from ddtrace import compat
 from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.internal.rate_limiter import ShardedRateLimiter
 
 
 def test_rate_limiter_init():
@@ -189,3 +191,55 @@ def test_rate_liimter_effective_rate_starting_rate():
         assert limiter.effective_rate == 0.75
         assert limiter.current_window == (now + 100.0)
         assert limiter.prev_window_rate == 0.5
+
+
+@pytest.mark.parametrize('rate_limit', [0, -1])
+def test_sharded_rate_limiter_static(rate_limit):
+    limiter = ShardedRateLimiter(rate_limit=rate_limit, shards=4)
+    for _ in range(1000):
+        assert limiter.is_allowed() is (rate_limit < 0)
+
+
+def test_sharded_rate_limiter_threads():
+    limiter = ShardedRateLimiter(rate_limit=100, shards=4)
+    allowed = []
+
+    now = compat.monotonic()
+    with mock.patch('ddtrace.compat.monotonic') as mock_time:
+        mock_time.return_value = now
+
+        def target():
+            allowed.append(sum(limiter.is_allowed() for _ in range(100)))
+
+        threads = [threading.Thread(target=target) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # Each of the 4 shards got a quarter of the budget
+    assert sum(allowed) == 100
+    assert limiter.effective_rate == 100 / 800
+
+
+def test_sharded_rate_limiter_rebalance():
+    limiter = ShardedRateLimiter(rate_limit=100, shards=4)
+
+    now = compat.monotonic()
+    with mock.patch('ddtrace.compat.monotonic') as mock_time:
+        mock_time.return_value = now
+        # All the demand goes to the shard of the current thread
+        assert sum(limiter.is_allowed() for _ in range(1000)) == 25
+        assert limiter.effective_rate == 25 / 1000
+
+        mock_time.return_value = now + 1.0
+        allowed = sum(limiter.is_allowed() for _ in range(1000))
+        # The busy shard gets most of the budget, within the tolerance of the
+        # share kept for idle shards
+        assert 90 <= allowed <= 100
+        assert limiter.prev_window_rate == 25 / 1000
+        assert limiter.current_window == now + 1.0
+
+        mock_time.return_value = now + 2.0
+        # The budget is refilled over the window
+        assert sum(limiter.is_allowed() for _ in range(1000)) <= 101
@@ -9,10 +9,11 @@ import pytest
 from ddtrace.compat import iteritems
 from ddtrace.constants import SAMPLING_PRIORITY_KEY, SAMPLE_RATE_METRIC_KEY
 from ddtrace.constants import SAMPLING_AGENT_DECISION, SAMPLING_RULE_DECISION, SAMPLING_LIMIT_DECISION
-from ddtrace.ext.priority import AUTO_KEEP, AUTO_REJECT
-from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.ext.priority import AUTO_KEEP, AUTO_REJECT, USER_KEEP, USER_REJECT
+from ddtrace.internal.rate_limiter import RateLimiter, ShardedRateLimiter
 from ddtrace.sampler import DatadogSampler, SamplingRule
 from ddtrace.sampler import RateSampler, AllSampler, RateByServiceSampler
+from ddtrace.sampler import TailSampler, TailSamplingRule
 from ddtrace.span import Span
 
 from .. import override_env
@@ -188,6 +189,40 @@ class RateByServiceSamplerTest(unittest.TestCase):
                 rates[k] = v.sample_rate
             assert case == rates, '%s != %s' % (case, rates)
 
+    def test_update_rate_by_service_sample_rates_table(self):
+        tracer = get_dummy_tracer()
+        tracer.configure(sampler=AllSampler())
+        priority_sampler = tracer.priority_sampler
+        table = priority_sampler._table
+
+        priority_sampler.update_rate_by_service_sample_rates({
+            'service:,env:': 0.1,
+            'service:mcnulty,env:dev': 0.25,
+            'service:mc,nulty,env:prod': 0.5,
+            'invalid': 0.75,
+        })
+        # The previous table is left untouched and replaced as a whole
+        assert table is not priority_sampler._table
+        assert list(table.samplers) == ['service:,env:']
+
+        table = priority_sampler._table
+        assert table.get('mcnulty', 'dev').sample_rate == 0.25
+        assert table.get('mc,nulty', 'prod').sample_rate == 0.5
+        assert table.get('mcnulty', None).sample_rate == 0.1
+        assert table.get(None, None).sample_rate == 0.1
+        assert 'invalid' in table.samplers
+        assert ('invalid', '') not in table.by_service
+
+        priority_sampler.set_sample_rate(0.3, service='postgres', env='dev')
+        assert table is not priority_sampler._table
+        assert priority_sampler._table.get('postgres', 'dev').sample_rate == 0.3
+        assert priority_sampler._table.get('mcnulty', 'dev').sample_rate == 0.25
+
+        tracer.set_tags({'env': 'dev'})
+        span = Span(tracer, 'test', service='mcnulty')
+        priority_sampler.sample(span)
+        assert span.get_metric(SAMPLING_AGENT_DECISION) == 0.25
+
 
 @pytest.mark.parametrize(
     'sample_rate,allowed',
@@ -695,6 +730,75 @@ def test_datadog_sampler_sample_rules(mock_is_allowed, dummy_tracer):
         [r.sample.assert_not_called() for r in rules]
 
 
+def test_datadog_sampler_rule_index():
+    rules = [
+        SamplingRule(sample_rate=0.1, service='svc-a', name='op-a'),
+        SamplingRule(sample_rate=0.2, service=re.compile('svc-[bc]')),
+        SamplingRule(sample_rate=0.3, service='svc-b'),
+        SamplingRule(sample_rate=0.4, name='op-b'),
+        SamplingRule(sample_rate=0.5, name=re.compile('op-[ac]')),
+        SamplingRule(sample_rate=0.6, service='svc-a'),
+        SamplingRule(sample_rate=0.7, service=None, name='op-a'),
+        SamplingRule(sample_rate=0.8, service='svc-d', name='op-b'),
+    ]
+    sampler = DatadogSampler(rules=rules)
+
+    services = ['svc-a', 'svc-b', 'svc-c', 'svc-d', 'svc-e', None]
+    names = ['op-a', 'op-b', 'op-c', 'op-d', None]
+    for _ in range(2):
+        for service in services:
+            for name in names:
+                span = Span(None, name, service=service)
+                expected = next((rule for rule in rules if rule.matches(span)), None)
+                assert sampler._rule_index.match(span) is expected, (service, name)
+
+    # Rules without any pattern match everything after the indexed rules
+    sampler.rules = rules + [SamplingRule(sample_rate=0.9)]
+    assert sampler._rule_index.match(Span(None, 'op-e', service='svc-e')) is sampler.rules[-1]
+    assert sampler._rule_index.match(Span(None, 'op-b', service='svc-e')) is rules[3]
+
+
+def test_datadog_sampler_rule_index_cache():
+    rule = SamplingRule(sample_rate=0.5, service=re.compile('svc-'))
+    index = DatadogSampler(rules=[rule])._rule_index
+    index._cache_size = 2
+    for service in ['svc-a', 'svc-b', 'svc-a', 'other']:
+        assert index.match(Span(None, 'op', service=service)) is (rule if service != 'other' else None)
+    assert len(index._cache) <= 2
+
+    # Rules with callables are evaluated every time
+    calls = []
+    rule = SamplingRule(sample_rate=0.5, service=lambda service: calls.append(service))
+    index = DatadogSampler(rules=[rule])._rule_index
+    for _ in range(2):
+        assert index.match(Span(None, 'op', service='svc')) is None
+    assert index._cache is None
+    assert calls == ['svc', 'svc']
+
+
+def test_datadog_sampler_rules_modified_in_place():
+    sampler = DatadogSampler(rules=[SamplingRule(sample_rate=1, service='svc-a')], default_sample_rate=0.5)
+    span = Span(None, 'op', service='svc-b')
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.5
+
+    # The rules are indexed again once changed
+    sampler.rules.append(SamplingRule(sample_rate=0, service='svc-b'))
+    span = Span(None, 'op', service='svc-b')
+    assert not sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0
+
+    sampler.rules[1] = SamplingRule(sample_rate=1, service='svc-b')
+    span = Span(None, 'op', service='svc-b')
+    assert sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 1
+
+    del sampler.rules[1]
+    span = Span(None, 'op', service='svc-b')
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.5
+
+
 def test_datadog_sampler_tracer(dummy_tracer):
     rule = SamplingRule(sample_rate=1.0, name='test.span')
     rule_spy = mock.Mock(spec=rule, wraps=rule)
@@ -877,3 +981,119 @@ def test_datadog_sampler_update_rate_by_service_sample_rates(dummy_tracer):
         for k, v in iteritems(sampler.default_sampler._by_service_samplers):
             rates[k] = v.sample_rate
         assert case == rates, '%s != %s' % (case, rates)
+
+
+def test_datadog_sampler_rate_limit_shards():
+    assert isinstance(DatadogSampler().limiter, RateLimiter)
+    assert isinstance(DatadogSampler(rate_limit_shards=1).limiter, RateLimiter)
+
+    sampler = DatadogSampler(rate_limit=10, rate_limit_shards=4)
+    assert isinstance(sampler.limiter, ShardedRateLimiter)
+    assert sampler.limiter.rate_limit == 10
+
+
+def _tail_trace(tracer=None, spans=1, duration=1.0, error=False):
+    trace = [Span(tracer, 'span-%d' % i, trace_id=12345) for i in range(spans)]
+    trace[0].duration = duration
+    trace[-1].error = int(error)
+    return trace
+
+
+@pytest.mark.parametrize(
+    'rule,trace,matches',
+    [
+        (dict(), dict(), True),
+        (dict(min_duration=1.0), dict(duration=1.0), True),
+        (dict(min_duration=1.0), dict(duration=0.5), False),
+        (dict(error=True), dict(spans=3, error=True), True),
+        (dict(error=True), dict(spans=3), False),
+        (dict(error=False), dict(spans=3), True),
+        (dict(error=False), dict(spans=3, error=True), False),
+        (dict(min_spans=3), dict(spans=3), True),
+        (dict(min_spans=3), dict(spans=2), False),
+        (dict(min_duration=1.0, error=True), dict(duration=2.0, error=True), True),
+        (dict(min_duration=1.0, error=True), dict(duration=2.0), False),
+    ]
+)
+def test_tail_sampling_rule_matches(rule, trace, matches):
+    assert TailSamplingRule(sample_rate=1.0, **rule).matches(_tail_trace(**trace)) is matches
+
+
+def test_tail_sampling_rule_sample_rate():
+    with pytest.raises(ValueError):
+        TailSamplingRule(sample_rate=2.0)
+
+    trace = _tail_trace()
+    assert TailSamplingRule(sample_rate=1.0).sample(trace[0]) is True
+    assert TailSamplingRule(sample_rate=0.0).sample(trace[0]) is False
+
+
+def test_tail_sampler_invalid_rule():
+    with pytest.raises(TypeError):
+        TailSampler([SamplingRule(sample_rate=1.0)])
+
+
+@pytest.mark.parametrize(
+    'sampled,priority,error,expected',
+    [
+        # No rule matched, the decision is kept
+        (True, AUTO_KEEP, False, (True, AUTO_KEEP)),
+        (True, AUTO_REJECT, False, (True, AUTO_REJECT)),
+        (False, None, False, (False, None)),
+        # The first matching rule decides
+        (True, AUTO_REJECT, True, (True, AUTO_KEEP)),
+        (False, None, True, (True, None)),
+        # User decisions are never changed
+        (True, USER_REJECT, True, (True, USER_REJECT)),
+        (True, USER_KEEP, True, (True, USER_KEEP)),
+    ]
+)
+def test_tail_sampler_sample(sampled, priority, error, expected):
+    sampler = TailSampler([TailSamplingRule(sample_rate=1.0, error=True)])
+    assert sampler.sample(_tail_trace(error=error), sampled, priority) == expected
+
+
+def test_tail_sampler_sample_drop():
+    sampler = TailSampler([TailSamplingRule(sample_rate=0.0, min_duration=5.0)])
+    assert sampler.sample(_tail_trace(duration=10.0), True, AUTO_KEEP) == (True, AUTO_REJECT)
+    assert sampler.sample(_tail_trace(duration=1.0), True, AUTO_KEEP) == (True, AUTO_KEEP)
+
+    sampler.drop_rejected = True
+    assert sampler.sample(_tail_trace(duration=10.0), True, AUTO_KEEP) == (False, AUTO_REJECT)
+    assert sampler.sample(_tail_trace(duration=10.0), True, USER_REJECT) == (True, USER_REJECT)
+
+
+def test_tail_sampler_rate_limit():
+    sampler = TailSampler([TailSamplingRule(sample_rate=1.0)], rate_limit=1)
+    with mock.patch('ddtrace.compat.monotonic', return_value=1000.0):
+        assert sampler.sample(_tail_trace(), True, AUTO_REJECT) == (True, AUTO_KEEP)
+        assert sampler.sample(_tail_trace(), True, AUTO_REJECT) == (True, AUTO_REJECT)
+
+
+@pytest.mark.parametrize('drop_rejected', [False, True])
+def test_tail_sampler_tracer(drop_rejected):
+    tracer = get_dummy_tracer()
+    tracer.configure(
+        sampler=DatadogSampler(default_sample_rate=0.0),
+        tail_sampler=TailSampler([TailSamplingRule(sample_rate=1.0, error=True)], drop_rejected=drop_rejected),
+    )
+
+    with tracer.trace('root'):
+        with tracer.trace('child') as child:
+            child.error = 1
+    spans = tracer.writer.pop()
+    assert len(spans) == 2
+    assert spans[0].get_metric(SAMPLING_PRIORITY_KEY) == AUTO_KEEP
+
+    with tracer.trace('root'):
+        with tracer.trace('child'):
+            pass
+    spans = tracer.writer.pop()
+    if drop_rejected:
+        assert spans == []
+    else:
+        assert len(spans) == 2
+        assert spans[0].get_metric(SAMPLING_PRIORITY_KEY) == AUTO_REJECT
+
+    tracer.configure(tail_sampler=False)
+    assert tracer._tail_sampler is None
@@ -601,3 +601,26 @@ def test_span_ignored_exception_subclass():
     assert s.get_tag(errors.ERROR_MSG) is None
     assert s.get_tag(errors.ERROR_TYPE) is None
     assert s.get_tag(errors.ERROR_STACK) is None
+
+
+def test_span_lazy_tags():
+    s = Span(None, None)
+    assert s.get_tag("key") is None
+    assert s.get_metric("key") is None
+    s._remove_tag("key")
+    s.finish()
+    assert s.to_dict().get("meta") is None
+    assert s._meta is None
+    assert s._metrics is None
+
+    s.set_tag("key", "value")
+    s.set_metric("metric", 1)
+    assert s.meta == {"key": "value"}
+    assert s.metrics == {"metric": 1}
+
+    # The dicts can still be replaced and mutated in place
+    s.meta = {"other": "value"}
+    s.metrics.clear()
+    assert s.get_tag("key") is None
+    assert s.get_tag("other") == "value"
+    assert s.get_metric("metric") is None
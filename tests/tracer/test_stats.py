@@ -0,0 +1,265 @@
+import struct
+
+import mock
+import msgpack
+import pytest
+
+from ddtrace.constants import FILTERS_KEY, SPAN_MEASURED_KEY
+from ddtrace.ext import http
+from ddtrace.filters import TraceFilter
+from ddtrace.internal.stats import DDSketch, SpanStatsConcentrator
+from ddtrace.sampler import RateSampler
+
+from .test_tracer import get_dummy_tracer
+
+
+def test_ddsketch_quantiles():
+    sketch = DDSketch()
+    assert sketch.quantile(0.5) is None
+
+    for value in range(1, 10001):
+        sketch.add(value * 1000)
+    sketch.add(0)
+
+    assert sketch.count == 10001
+    assert sketch.zero_count == 1
+    assert sketch.quantile(0) == 0.0
+    for q in (0.25, 0.5, 0.75, 0.99, 1):
+        expected = q * 10000 * 1000
+        assert abs(sketch.quantile(q) - expected) <= expected * 0.011
+
+
+def test_ddsketch_to_proto():
+    sketch = DDSketch()
+    gamma = struct.pack('<d', 1.01 / 0.99)
+    assert sketch.to_proto() == b'\x0a\x09\x09' + gamma + b'\x12\x00'
+
+    sketch.add(1.0)
+    sketch.add(0)
+    proto = sketch.to_proto()
+    # mapping message with gamma, a single bin of index 0 and the zero count
+    assert proto.startswith(b'\x0a\x09\x09')
+    assert b'\x12\x0d\x0a\x0b\x08\x00\x11' in proto
+    assert proto.endswith(b'\x21\x00\x00\x00\x00\x00\x00\xf0\x3f')
+
+
+def _concentrator(tracer=None):
+    return SpanStatsConcentrator(tracer or get_dummy_tracer())
+
+
+class _DropFilter(TraceFilter):
+    def process_trace(self, trace):
+        if trace[0].resource != 'drop':
+            return trace
+
+
+def test_concentrator_started_by_first_trace():
+    tracer = get_dummy_tracer()
+    concentrator = _concentrator(tracer)
+    assert not concentrator.started
+
+    span = tracer.trace('web.request')
+    span.finish()
+    concentrator.add_trace([span])
+    try:
+        assert concentrator.started
+        assert concentrator.is_alive()
+    finally:
+        concentrator.stop()
+        concentrator.join()
+
+
+def test_concentrator_add_trace():
+    tracer = get_dummy_tracer()
+    concentrator = _concentrator(tracer)
+
+    with tracer.trace('web.request', service='web', resource='GET /') as root:
+        root.set_tag(http.STATUS_CODE, 200)
+        with tracer.trace('internal', service='web'):
+            pass
+        with tracer.trace('measured', service='web') as measured:
+            measured.set_tag(SPAN_MEASURED_KEY)
+        with tracer.trace('db.query', service='db', resource='SELECT') as db:
+            db.error = 1
+    trace = tracer.writer.pop()
+    concentrator.add_trace(trace)
+    concentrator.add_trace(trace)
+
+    (bucket,) = concentrator._buckets.values()
+    assert sorted(bucket) == [
+        ('db', 'db.query', 'SELECT', 0, None),
+        ('web', 'measured', 'measured', 0, None),
+        ('web', 'web.request', 'GET /', 200, None),
+    ]
+
+    stats = bucket[('web', 'web.request', 'GET /', 200, None)]
+    assert stats.hits == 2
+    assert stats.top_level_hits == 2
+    assert stats.errors == 0
+    assert stats.duration == 2 * root.duration_ns
+    assert stats.ok_distribution.count == 2
+    assert stats.err_distribution.count == 0
+
+    stats = bucket[('web', 'measured', 'measured', 0, None)]
+    assert stats.hits == 2
+    assert stats.top_level_hits == 0
+
+    stats = bucket[('db', 'db.query', 'SELECT', 0, None)]
+    assert stats.hits == 2
+    assert stats.top_level_hits == 2
+    assert stats.errors == 2
+    assert stats.err_distribution.count == 2
+
+
+def test_concentrator_buckets():
+    tracer = get_dummy_tracer()
+    concentrator = _concentrator(tracer)
+
+    span = tracer.trace('web.request')
+    span.start_ns = 12 * 10 ** 9
+    span.finish(finish_time=13)
+    concentrator.add_trace([span])
+
+    span = tracer.trace('web.request')
+    span.start_ns = 19 * 10 ** 9
+    span.finish(finish_time=21)
+    concentrator.add_trace([span])
+
+    assert sorted(concentrator._buckets) == [10 * 10 ** 9, 20 * 10 ** 9]
+
+    with mock.patch('ddtrace.compat.time_ns', return_value=29 * 10 ** 9):
+        buckets = concentrator._flush_buckets()
+    assert [start for start, _ in buckets] == [10 * 10 ** 9]
+    assert list(concentrator._buckets) == [20 * 10 ** 9]
+
+    with mock.patch('ddtrace.compat.time_ns', return_value=29 * 10 ** 9):
+        buckets = concentrator._flush_buckets(force=True)
+    assert [start for start, _ in buckets] == [20 * 10 ** 9]
+    assert concentrator._buckets == {}
+
+
+def test_concentrator_flush():
+    tracer = get_dummy_tracer()
+    concentrator = _concentrator(tracer)
+
+    with tracer.trace('web.request', service='web', resource='GET /'):
+        pass
+    concentrator.add_trace(tracer.writer.pop())
+
+    with mock.patch.object(tracer.writer, '_send_stats') as send_stats:
+        concentrator.flush()
+        send_stats.assert_not_called()
+
+        concentrator.flush(force=True)
+        send_stats.assert_called_once()
+
+    endpoint, payload = send_stats.call_args[0]
+    assert endpoint == '/v0.6/stats'
+    payload = msgpack.unpackb(payload, raw=False)
+    assert payload['Lang'] == 'python'
+    assert payload['Sequence'] == 1
+    (bucket,) = payload['Stats']
+    assert bucket['Duration'] == 10 * 10 ** 9
+    (stats,) = bucket['Stats']
+    assert stats['Service'] == 'web'
+    assert stats['Name'] == 'web.request'
+    assert stats['Resource'] == 'GET /'
+    assert stats['HTTPStatusCode'] == 0
+    assert stats['Type'] == ''
+    assert stats['Hits'] == 1
+    assert stats['TopLevelHits'] == 1
+    assert stats['Errors'] == 0
+    assert 'Synthetics' not in stats
+    # The sketches are packed as bin, which are not decoded as text
+    assert isinstance(stats['OkSummary'], bytes)
+
+
+def test_concentrator_flush_other_writer():
+    tracer = get_dummy_tracer()
+    tracer.writer = mock.Mock(spec=['write'])
+    concentrator = _concentrator(tracer)
+
+    span = tracer.trace('web.request')
+    span.finish()
+    concentrator.add_trace([span])
+    concentrator.flush(force=True)
+    assert concentrator._buckets == {}
+
+
+def test_tracer_compute_stats():
+    tracer = get_dummy_tracer()
+    tracer.configure(sampler=RateSampler(0.000001), compute_stats=True, priority_sampling=False)
+    concentrator = tracer._stats_concentrator
+    assert concentrator is not None
+    # The concentrator is started with the first trace
+    assert not concentrator.started
+
+    try:
+        with mock.patch.object(concentrator, 'add_trace') as add_trace:
+            with tracer.trace('web.request'):
+                pass
+        # The trace is not sampled but its stats are computed
+        assert tracer.writer.pop() == []
+        add_trace.assert_called_once()
+    finally:
+        tracer.configure(compute_stats=False)
+
+    assert tracer._stats_concentrator is None
+    assert not concentrator.is_alive()
+
+
+@pytest.mark.parametrize('sample_rate', [1, 0.000001])
+def test_tracer_compute_stats_filters(sample_rate):
+    tracer = get_dummy_tracer()
+    tracer.configure(
+        sampler=RateSampler(sample_rate),
+        compute_stats=True,
+        priority_sampling=False,
+        settings={FILTERS_KEY: [_DropFilter()]},
+    )
+    concentrator = tracer._stats_concentrator
+    try:
+        with mock.patch.object(concentrator, 'add_trace') as add_trace:
+            with tracer.trace('web.request', resource='drop'):
+                pass
+            add_trace.assert_not_called()
+
+            with tracer.trace('web.request', resource='keep') as span:
+                pass
+            add_trace.assert_called_once_with([span])
+    finally:
+        tracer.configure(compute_stats=False)
+
+
+@pytest.mark.parametrize('sample_rate', [1, 0.000001])
+def test_tracer_compute_stats_disabled(sample_rate):
+    tracer = get_dummy_tracer()
+    tracer.configure(sampler=RateSampler(sample_rate), compute_stats=True, priority_sampling=False)
+    tracer.enabled = False
+    concentrator = tracer._stats_concentrator
+    try:
+        with mock.patch.object(concentrator, 'add_trace') as add_trace:
+            with tracer.trace('web.request'):
+                pass
+        add_trace.assert_not_called()
+        assert not concentrator.started
+    finally:
+        tracer.configure(compute_stats=False)
+
+
+def test_writer_client_computed_stats_header():
+    tracer = get_dummy_tracer()
+    tracer.configure(compute_stats=True)
+    # The writer is told as soon as the stats are computed by the tracer
+    assert tracer.writer._client_computed_stats is True
+    with mock.patch.object(tracer.writer, '_send_stats'):
+        try:
+            with tracer.trace('web.request'):
+                pass
+            assert tracer.writer._client_computed_stats is True
+        finally:
+            tracer.configure(compute_stats=False)
+
+    with tracer.trace('web.request'):
+        pass
+    assert tracer.writer._client_computed_stats is False
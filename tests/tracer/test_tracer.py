@@ -16,11 +16,14 @@ import pytest
 import ddtrace
 from ddtrace.ext import system
 from ddtrace.context import Context
-from ddtrace.constants import VERSION_KEY, ENV_KEY
+from ddtrace.constants import GC_TIME_KEY, VERSION_KEY, ENV_KEY
+from ddtrace.filters import TraceFilter
 from ddtrace.vendor import six
 
 from tests.subprocesstest import run_in_subprocess
 from tests import TracerTestCase, DummyWriter, DummyTracer, override_global_config
+from ddtrace.internal.runtime import get_runtime_id
+from ddtrace.internal.runtime.gc_monitor import GCMonitor, gc_monitor
 from ddtrace.internal.writer import LogWriter, AgentWriter
 
 
@@ -656,11 +659,11 @@ def test_tracer_fork():
             with capture_failures(errors):
                 assert t._pid != original_pid
                 assert t.writer != original_writer
-                assert t.writer._buffer != original_writer._buffer
+                assert t.writer._encoder != original_writer._encoder
 
         # Assert the trace got written into the correct queue
-        assert len(original_writer._buffer) == 0
-        assert len(t.writer._buffer) == 1
+        assert len(original_writer._encoder) == 0
+        assert len(t.writer._encoder) == 1
 
     # Assert tracer in a new process correctly recreates the writer
     errors = multiprocessing.Queue()
@@ -676,11 +679,11 @@ def test_tracer_fork():
     with t.trace("test", service="test"):
         assert t._pid == original_pid
         assert t.writer == original_writer
-        assert t.writer._buffer == original_writer._buffer
+        assert t.writer._encoder == original_writer._encoder
 
     # Assert the trace got written into the correct queue
-    assert len(original_writer._buffer) == 1
-    assert len(t.writer._buffer) == 1
+    assert len(original_writer._encoder) == 1
+    assert len(t.writer._encoder) == 1
 
 
 def test_tracer_trace_across_fork():
@@ -1163,6 +1166,166 @@ def test_filters():
         assert s.get_tag("boop") == "beep"
 
 
+def test_filters_deferred():
+    t = ddtrace.Tracer()
+    calls = []
+
+    class FilterRecord(TraceFilter):
+        def __init__(self, name, deferred=False):
+            self.name = name
+            self.deferred = deferred
+
+        def process_trace(self, trace):
+            calls.append(self.name)
+            return trace
+
+    deferred = FilterRecord("deferred", deferred=True)
+    inline = FilterRecord("inline")
+    t.configure(settings={"FILTERS": [deferred, inline]})
+    assert t._inline_filters == [inline]
+    assert t._deferred_filters == [deferred]
+
+    t.writer = DummyWriter()
+    # Deferred filters are handed over to the writer when it is set, not on every trace
+    assert t.writer._filters == [deferred]
+    with t.trace("root"):
+        pass
+
+    # and run after the inline ones
+    assert calls == ["inline", "deferred"]
+    assert len(t.writer.pop()) == 1
+
+    # The writer follows the changes of the filters
+    t.configure(settings={"FILTERS": [inline]})
+    assert t.writer._filters == []
+    t.configure(settings={"FILTERS": [deferred, inline]})
+
+    # Writers other than the agent writer run all the filters inline
+    del calls[:]
+    t.writer = mock.Mock(spec=LogWriter)
+    with t.trace("root"):
+        pass
+    assert calls == ["inline", "deferred"]
+    t.writer.write.assert_called_once()
+
+
+def test_span_templates():
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+    t.set_tags({"global": "tag", "answer": 42})
+
+    with override_global_config(dict(env="prod")):
+        with t.trace("root", service="svc") as root:
+            with t.trace("child") as child:
+                pass
+        assert root.get_tag("global") == child.get_tag("global") == "tag"
+        assert root.get_metric("answer") == child.get_metric("answer") == 42
+        assert root.get_tag("env") == child.get_tag("env") == "prod"
+        assert root.get_tag("runtime-id") == get_runtime_id()
+        assert root.get_metric(system.PID) == getpid()
+        assert child.get_tag("runtime-id") is None
+        assert child.get_metric(system.PID) is None
+
+        # Templates are reused across spans and updated along with the tags
+        n_templates = len(t._span_templates)
+        with t.trace("root", service="svc"):
+            pass
+        assert len(t._span_templates) == n_templates
+
+        t.set_tags({"global": "updated"})
+        with t.trace("root", service="svc") as root:
+            pass
+        assert root.get_tag("global") == "updated"
+
+    # and along with the global configuration
+    with override_global_config(dict(env="staging")):
+        with t.trace("root", service="svc") as root:
+            pass
+        assert root.get_tag("env") == "staging"
+
+    with t.trace("root", service="svc") as root:
+        pass
+    assert root.get_tag("env") is None
+
+
+def test_span_templates_tags_modified_in_place():
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+    t.set_tags({"global": "tag"})
+    with t.trace("root", service="svc"):
+        pass
+
+    t.tags["global"] = "updated"
+    with t.trace("root", service="svc") as root:
+        pass
+    assert root.get_tag("global") == "updated"
+
+    del t.tags["global"]
+    with t.trace("root", service="svc") as root:
+        pass
+    assert root.get_tag("global") is None
+
+    # Tags set from a plain dict are tracked too
+    t.tags = {"global": "tag"}
+    t.tags.update({"other": "tag"})
+    with t.trace("root", service="svc") as root:
+        pass
+    assert root.get_tag("global") == root.get_tag("other") == "tag"
+
+    t.tags["service.name"] = "tagged"
+    with t.trace("root", service="svc") as root:
+        pass
+    assert not t._span_templates
+    assert root.service == "tagged"
+
+
+def test_span_templates_tags_with_side_effects():
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+    t.set_tags({"service.name": "tagged"})
+
+    with t.trace("root", service="svc") as root:
+        pass
+    assert not t._span_templates
+    assert root.service == "tagged"
+
+
+@pytest.mark.skipif(not GCMonitor.available(), reason="gc.callbacks requires Python 3.3+")
+def test_gc_span_tag():
+    import gc
+
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+    t.configure(gc_span_tag=True)
+    try:
+        assert t._gc_monitor is gc_monitor
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                gc.collect()
+    finally:
+        t.configure(gc_span_tag=False)
+    assert t._gc_monitor is None
+
+    assert 0 < root.get_metric(GC_TIME_KEY) < root.duration_ns
+    assert child.get_metric(GC_TIME_KEY) is None
+
+    with t.trace("root") as root:
+        gc.collect()
+    assert root.get_metric(GC_TIME_KEY) is None
+
+
+@pytest.mark.skipif(not GCMonitor.available(), reason="gc.callbacks requires Python 3.3+")
+def test_gc_span_tag_disabled_before_finish():
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+    t.configure(gc_span_tag=True)
+    root = t.trace("root")
+    assert root.get_metric(GC_TIME_KEY) is not None
+    t.configure(gc_span_tag=False)
+    root.finish()
+    assert root.get_metric(GC_TIME_KEY) is None
+
+
 def test_early_exit():
     t = ddtrace.Tracer()
     s1 = t.trace("1")
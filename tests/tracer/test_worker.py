@@ -30,6 +30,24 @@ def test_periodic():
     assert results
 
 
+def test_awake():
+    results = []
+
+    class MyWorker(_worker.PeriodicWorkerThread):
+        @staticmethod
+        def run_periodic():
+            results.append(object())
+
+    w = MyWorker(interval=60, daemon=False)
+    w.start()
+    w.awake()
+    while not results:
+        pass
+    w.stop()
+    w.join()
+    assert len(results) == 1
+
+
 def test_on_shutdown():
     results = []
 
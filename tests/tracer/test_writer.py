@@ -1,8 +1,20 @@
+import re
+import threading
+import time
+
 import mock
+import msgpack
+import pytest
 
+from ddtrace.api import Response
+from ddtrace.encoding import BufferedEncoder, BufferedEncoderV05
+from ddtrace.filters import TraceFilter
+from ddtrace.sampler import RateByServiceSampler
 from ddtrace.span import Span
 from ddtrace.internal.writer import AgentWriter, LogWriter, _human_size
-from tests import BaseTestCase, AnyInt
+from ddtrace.vendor.dogstatsd import DogStatsd
+from ddtrace.vendor.six.moves import BaseHTTPServer, socketserver
+from tests import BaseTestCase, override_env
 
 
 class DummyOutput:
@@ -22,11 +34,23 @@ class FailingAPI(object):
         return [Exception("oops")]
 
 
+def _statsd():
+    statsd = DogStatsd(disable_telemetry=True)
+    statsd.socket = mock.Mock()
+    return statsd
+
+
+def _sent_metrics(statsd):
+    """Return the metrics sent by the client, with the values of the byte counts removed."""
+    lines = [line for call in statsd.socket.send.call_args_list for line in call[0][0].decode("utf-8").split("\n")]
+    return [re.sub(r"(\.bytes):\d+", r"\1:*", line) for line in lines]
+
+
 class AgentWriterTests(BaseTestCase):
     N_TRACES = 11
 
     def test_metrics_disabled(self):
-        statsd = mock.Mock()
+        statsd = _statsd()
         writer = AgentWriter(dogstatsd=statsd, report_metrics=False, hostname="asdf", port=1234)
         for i in range(10):
             writer.write(
@@ -35,11 +59,10 @@ class AgentWriterTests(BaseTestCase):
         writer.stop()
         writer.join()
 
-        statsd.increment.assert_not_called()
-        statsd.distribution.assert_not_called()
+        statsd.socket.send.assert_not_called()
 
     def test_metrics_bad_endpoint(self):
-        statsd = mock.Mock()
+        statsd = _statsd()
         writer = AgentWriter(dogstatsd=statsd, report_metrics=True, hostname="asdf", port=1234)
         for i in range(10):
             writer.write(
@@ -48,24 +71,16 @@ class AgentWriterTests(BaseTestCase):
         writer.stop()
         writer.join()
 
-        statsd.increment.assert_has_calls(
-            [
-                mock.call("datadog.tracer.http.requests"),
-            ]
-        )
-        statsd.distribution.assert_has_calls(
-            [
-                mock.call("datadog.tracer.buffer.accepted.traces", 10, tags=[]),
-                mock.call("datadog.tracer.buffer.accepted.spans", 50, tags=[]),
-                mock.call("datadog.tracer.http.requests", 1, tags=[]),
-                mock.call("datadog.tracer.http.errors", 1, tags=["type:err"]),
-                mock.call("datadog.tracer.http.dropped.bytes", AnyInt(), tags=[]),
-            ],
-            any_order=True,
-        )
+        metrics = _sent_metrics(statsd)
+        assert "datadog.tracer.http.requests:1|c" in metrics
+        assert "datadog.tracer.buffer.accepted.traces:10|d" in metrics
+        assert "datadog.tracer.buffer.accepted.spans:50|d" in metrics
+        assert "datadog.tracer.http.requests:1|d" in metrics
+        assert "datadog.tracer.http.errors:1|d|#type:err" in metrics
+        assert "datadog.tracer.http.dropped.bytes:*|d" in metrics
 
     def test_metrics_trace_too_big(self):
-        statsd = mock.Mock()
+        statsd = _statsd()
         writer = AgentWriter(dogstatsd=statsd, report_metrics=True, hostname="asdf", port=1234)
         for i in range(10):
             writer.write(
@@ -77,49 +92,35 @@ class AgentWriterTests(BaseTestCase):
         writer.stop()
         writer.join()
 
-        statsd.increment.assert_has_calls(
-            [
-                mock.call("datadog.tracer.http.requests"),
-            ]
-        )
-        statsd.distribution.assert_has_calls(
-            [
-                mock.call("datadog.tracer.buffer.accepted.traces", 10, tags=[]),
-                mock.call("datadog.tracer.buffer.accepted.spans", 50, tags=[]),
-                mock.call("datadog.tracer.buffer.dropped.traces", 1, tags=["reason:t_too_big"]),
-                mock.call("datadog.tracer.buffer.dropped.bytes", AnyInt(), tags=["reason:t_too_big"]),
-                mock.call("datadog.tracer.http.requests", 1, tags=[]),
-                mock.call("datadog.tracer.http.errors", 1, tags=["type:err"]),
-                mock.call("datadog.tracer.http.dropped.bytes", AnyInt(), tags=[]),
-            ],
-            any_order=True,
-        )
+        metrics = _sent_metrics(statsd)
+        assert "datadog.tracer.http.requests:1|c" in metrics
+        assert "datadog.tracer.buffer.accepted.traces:10|d" in metrics
+        assert "datadog.tracer.buffer.accepted.spans:50|d" in metrics
+        assert "datadog.tracer.buffer.dropped.traces:1|d|#reason:t_too_big" in metrics
+        assert "datadog.tracer.buffer.dropped.bytes:*|d|#reason:t_too_big" in metrics
+        assert "datadog.tracer.http.requests:1|d" in metrics
+        assert "datadog.tracer.http.errors:1|d|#type:err" in metrics
+        assert "datadog.tracer.http.dropped.bytes:*|d" in metrics
 
     def test_metrics_multi(self):
-        statsd = mock.Mock()
+        statsd = _statsd()
         writer = AgentWriter(dogstatsd=statsd, report_metrics=True, hostname="asdf", port=1234)
         for i in range(10):
             writer.write(
                 [Span(tracer=None, name="name", trace_id=i, span_id=j, parent_id=j - 1 or None) for j in range(5)]
             )
         writer.flush_queue()
-        statsd.increment.assert_has_calls(
-            [
-                mock.call("datadog.tracer.http.requests"),
-            ]
-        )
-        statsd.distribution.assert_has_calls(
-            [
-                mock.call("datadog.tracer.buffer.accepted.traces", 10, tags=[]),
-                mock.call("datadog.tracer.buffer.accepted.spans", 50, tags=[]),
-                mock.call("datadog.tracer.http.requests", 1, tags=[]),
-                mock.call("datadog.tracer.http.errors", 1, tags=["type:err"]),
-                mock.call("datadog.tracer.http.dropped.bytes", AnyInt(), tags=[]),
-            ],
-            any_order=True,
-        )
+        # All the metrics are packed into a single datagram
+        statsd.socket.send.assert_called_once()
+        metrics = _sent_metrics(statsd)
+        assert "datadog.tracer.http.requests:1|c" in metrics
+        assert "datadog.tracer.buffer.accepted.traces:10|d" in metrics
+        assert "datadog.tracer.buffer.accepted.spans:50|d" in metrics
+        assert "datadog.tracer.http.requests:1|d" in metrics
+        assert "datadog.tracer.http.errors:1|d|#type:err" in metrics
+        assert "datadog.tracer.http.dropped.bytes:*|d" in metrics
 
-        statsd.reset_mock()
+        statsd.socket.send.reset_mock()
 
         for i in range(10):
             writer.write(
@@ -128,21 +129,374 @@ class AgentWriterTests(BaseTestCase):
         writer.stop()
         writer.join()
 
-        statsd.increment.assert_has_calls(
-            [
-                mock.call("datadog.tracer.http.requests"),
-            ]
-        )
-        statsd.distribution.assert_has_calls(
-            [
-                mock.call("datadog.tracer.buffer.accepted.traces", 10, tags=[]),
-                mock.call("datadog.tracer.buffer.accepted.spans", 50, tags=[]),
-                mock.call("datadog.tracer.http.requests", 1, tags=[]),
-                mock.call("datadog.tracer.http.errors", 1, tags=["type:err"]),
-                mock.call("datadog.tracer.http.dropped.bytes", AnyInt(), tags=[]),
-            ],
-            any_order=True,
-        )
+        metrics = _sent_metrics(statsd)
+        assert "datadog.tracer.http.requests:1|c" in metrics
+        assert "datadog.tracer.buffer.accepted.traces:10|d" in metrics
+        assert "datadog.tracer.buffer.accepted.spans:50|d" in metrics
+        assert "datadog.tracer.http.requests:1|d" in metrics
+        assert "datadog.tracer.http.errors:1|d|#type:err" in metrics
+        assert "datadog.tracer.http.dropped.bytes:*|d" in metrics
+
+
+@pytest.mark.parametrize(
+    "priority_sampler,api_version,endpoint,encoder_cls",
+    [
+        (None, None, "/v0.3/traces", BufferedEncoder),
+        (RateByServiceSampler(), None, "/v0.4/traces", BufferedEncoder),
+        (RateByServiceSampler(), "v0.5", "/v0.5/traces", BufferedEncoderV05),
+        (None, "v0.5", "/v0.5/traces", BufferedEncoderV05),
+    ],
+)
+def test_api_version(priority_sampler, api_version, endpoint, encoder_cls):
+    writer = AgentWriter(priority_sampler=priority_sampler, api_version=api_version)
+    assert writer._endpoint == endpoint
+    assert isinstance(writer._encoder, encoder_cls)
+
+    writer = writer.recreate()
+    assert writer._endpoint == endpoint
+    assert isinstance(writer._encoder, encoder_cls)
+
+
+@pytest.mark.parametrize(
+    "api_version,shards",
+    [(None, 4), ("v0.4", 4), ("v0.5", 1)],
+)
+def test_buffer_shards(api_version, shards):
+    writer = AgentWriter(priority_sampler=RateByServiceSampler(), api_version=api_version)
+    assert writer._encoder.shards == shards
+
+
+def test_api_version_env():
+    with override_env(dict(DD_TRACE_API_VERSION="v0.5")):
+        writer = AgentWriter(priority_sampler=RateByServiceSampler())
+    assert writer._endpoint == "/v0.5/traces"
+
+
+def test_api_version_invalid():
+    with pytest.raises(ValueError):
+        AgentWriter(api_version="v0.1")
+
+
+def test_downgrade_v05():
+    writer = AgentWriter(priority_sampler=RateByServiceSampler(), api_version="v0.5")
+    writer._put = mock.Mock(side_effect=[Response(status=404), Response(status=200)])
+
+    writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+    writer.flush_queue()
+
+    # The v0.5 payload cannot be converted and is dropped on downgrade
+    assert writer._put.call_count == 1
+    assert writer._endpoint == "/v0.4/traces"
+    assert isinstance(writer._encoder, BufferedEncoder)
+    assert not isinstance(writer._encoder, BufferedEncoderV05)
+
+    writer.write([Span(tracer=None, name="name", trace_id=2, span_id=1)])
+    writer.flush_queue()
+
+    assert writer._put.call_count == 2
+    payload, headers = writer._put.call_args[0]
+    assert headers["X-Datadog-Trace-Count"] == "1"
+    [[span]] = msgpack.unpackb(payload.tobytes(), raw=True)
+    assert span[b"trace_id"] == 2
+
+
+def test_downgrade_v05_payload_in_flight():
+    writer = AgentWriter(priority_sampler=RateByServiceSampler(), api_version="v0.5")
+    writer._put = mock.Mock(return_value=Response(status=404))
+
+    writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+    payload, n_traces = writer._encoder.encode()
+    writer._downgrade(None, None)
+    assert writer._endpoint == "/v0.4/traces"
+
+    # A v0.5 payload encoded before the downgrade is still sent to the v0.5
+    # endpoint, then dropped without downgrading the writer again.
+    writer._send_payload(payload, n_traces, endpoint="/v0.5/traces")
+    writer._put.assert_called_once_with(payload, mock.ANY, endpoint="/v0.5/traces")
+    assert writer._endpoint == "/v0.4/traces"
+
+
+def test_downgrade_v04():
+    writer = AgentWriter(priority_sampler=RateByServiceSampler(), api_version="v0.4")
+    writer._put = mock.Mock(side_effect=[Response(status=404), Response(status=200)])
+
+    writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+    writer.flush_queue()
+
+    # v0.3 and v0.4 payloads are the same so the payload is sent again
+    assert writer._put.call_count == 2
+    assert writer._endpoint == "/v0.3/traces"
+    assert writer._put.call_args_list[0][0][0] == writer._put.call_args_list[1][0][0]
+
+
+class _KeepAliveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(self.client_address)
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+        # Close the connection without notifying the client, like an agent
+        # would do with an idle connection.
+        self.close_connection = self.server.close_connections
+
+    @staticmethod
+    def log_message(format, *args):  # noqa: A002
+        pass
+
+
+class _KeepAliveServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), _KeepAliveRequestHandler)
+        self.requests = []
+        self.delay = 0
+        self.close_connections = False
+
+    @property
+    def connections(self):
+        return set(self.requests)
+
+
+@pytest.fixture
+def agent():
+    server = _KeepAliveServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _write_and_flush(writer, trace_id=1):
+    writer.write([Span(tracer=None, name="name", trace_id=trace_id, span_id=1)])
+    writer.flush_queue()
+
+
+def test_keep_alive(agent):
+    writer = AgentWriter(hostname="127.0.0.1", port=agent.server_port, api_version="v0.4")
+    for i in range(3):
+        _write_and_flush(writer, i)
+
+    assert len(agent.requests) == 3
+    assert len(agent.connections) == 1
+
+
+def test_reconnect_closed_connection(agent):
+    agent.close_connections = True
+    writer = AgentWriter(hostname="127.0.0.1", port=agent.server_port, api_version="v0.4")
+    writer._send_payload = mock.Mock(wraps=writer._send_payload)
+    with mock.patch("ddtrace.internal.writer.log") as log:
+        for i in range(3):
+            _write_and_flush(writer, i)
+    log.error.assert_not_called()
+
+    assert len(agent.requests) == 3
+    assert len(agent.connections) == 3
+
+
+def test_connection_not_reused_after_fork(agent):
+    writer = AgentWriter(hostname="127.0.0.1", port=agent.server_port, api_version="v0.4")
+    _write_and_flush(writer)
+
+    with mock.patch("os.getpid", return_value=writer._conn_pid + 1):
+        _write_and_flush(writer)
+
+    assert len(agent.requests) == 2
+    assert len(agent.connections) == 2
+
+
+def test_connection_metrics(agent):
+    writer = AgentWriter(hostname="127.0.0.1", port=agent.server_port, api_version="v0.4", report_metrics=True)
+    writer.dogstatsd = _statsd()
+    for i in range(2):
+        writer.write([Span(tracer=None, name="name", trace_id=i, span_id=1)])
+        writer._send_payload(*writer._encoder.encode())
+
+    assert writer._metrics["http.connections"]["count"] == 1
+    assert writer._metrics["http.requests"]["count"] == 2
+    assert "http.connect.time_ms" in writer._metrics
+    assert "http.send.time_ms" in writer._metrics
+
+
+def test_max_in_flight_requests(agent):
+    agent.delay = 0.5
+    writer = AgentWriter(hostname="127.0.0.1", port=agent.server_port, api_version="v0.4", max_in_flight_requests=2)
+    start = time.time()
+    _write_and_flush(writer, 1)
+    _write_and_flush(writer, 2)
+    # Both payloads are sent concurrently
+    assert time.time() - start < agent.delay
+    senders = list(writer._senders)
+    assert len(senders) == 2
+
+    # The sender threads are reused for the next payloads
+    _write_and_flush(writer, 3)
+    assert writer._senders == senders
+
+    writer.on_shutdown()
+    assert len(agent.requests) == 3
+    assert len(agent.connections) == 2
+    assert not any(thread.is_alive() for thread in senders)
+
+
+def test_metrics_threads():
+    statsd = _statsd()
+    writer = AgentWriter(dogstatsd=statsd, report_metrics=True)
+    writer._send_payload = mock.Mock()
+
+    def _record():
+        for _ in range(1000):
+            writer._metrics_dist("http.requests")
+
+    threads = [threading.Thread(target=_record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Flush the metrics while they are recorded
+    while any(thread.is_alive() for thread in threads):
+        writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+        writer.flush_queue()
+    for thread in threads:
+        thread.join()
+    writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+    writer.flush_queue()
+
+    counts = [
+        int(line.split(":")[1].split("|")[0])
+        for line in _sent_metrics(statsd)
+        if line.startswith("datadog.tracer.http.requests:") and line.endswith("|d")
+    ]
+    assert sum(counts) == 4000
+
+
+def test_flush_interval_backoff():
+    writer = AgentWriter(processing_interval=1, min_processing_interval=0.25, max_processing_interval=5)
+    writer._send_payload = mock.Mock()
+    assert writer.interval == 1
+
+    # The interval backs off while there is nothing to flush
+    for expected in (2, 4, 5, 5):
+        writer.flush_queue()
+        assert writer.interval == expected
+    writer._send_payload.assert_not_called()
+
+    # and goes back to the nominal interval as soon as traces are written
+    writer.write([Span(tracer=None, name="name", trace_id=1, span_id=1)])
+    writer.flush_queue()
+    assert writer.interval == 1
+    writer._send_payload.assert_called_once()
+
+
+def test_flush_interval_high_water_mark():
+    writer = AgentWriter(processing_interval=1, min_processing_interval=0.25, buffer_size=2000, max_payload_size=2000)
+    writer._send_payload = mock.Mock()
+    writer.awake = mock.Mock()
+
+    trace = [Span(tracer=None, name="name", trace_id=1, span_id=i) for i in range(5)]
+    writer.write(trace)
+    writer.awake.assert_not_called()
+
+    # An early flush is requested once the buffer is filled past the threshold
+    while not writer.awake.called:
+        writer.write(trace)
+    assert writer._encoder.size >= 1000
+
+    # The interval shrinks while flushed payloads are above the threshold
+    for expected in (0.5, 0.25, 0.25):
+        writer.flush_queue()
+        assert writer.interval == expected
+        while writer._encoder.size < 1000:
+            writer.write(trace)
+
+
+def test_flush_interval_env():
+    with override_env(dict(DD_TRACE_WRITER_MIN_INTERVAL_SECONDS="0.5", DD_TRACE_WRITER_MAX_INTERVAL_SECONDS="10")):
+        writer = AgentWriter()
+    assert writer._min_processing_interval == 0.5
+    assert writer._max_processing_interval == 10
+
+    writer = writer.recreate()
+    assert writer._min_processing_interval == 0.5
+    assert writer._max_processing_interval == 10
+
+
+class _DeferredFilter(TraceFilter):
+    deferred = True
+
+    def __init__(self):
+        self.batches = []
+
+    def process_traces(self, traces):
+        self.batches.append(len(traces))
+        return [t for t in traces if t[0].trace_id % 2]
+
+
+def test_deferred_filters():
+    writer = AgentWriter()
+    writer._send_payload = mock.Mock()
+    filtr = _DeferredFilter()
+    writer._filters = [filtr]
+
+    for i in range(4):
+        writer.write([Span(tracer=None, name="name", trace_id=i + 1, span_id=1)])
+    # Traces are not filtered nor encoded until the writer flushes
+    assert len(writer._pending) == 4
+    assert len(writer._encoder) == 0
+    assert filtr.batches == []
+
+    writer.flush_queue()
+    assert filtr.batches == [4]
+    assert len(writer._pending) == 0
+    payload, n_traces = writer._send_payload.call_args[0]
+    assert n_traces == 2
+    assert [t[0][b"trace_id"] for t in msgpack.unpackb(payload.tobytes(), raw=True)] == [1, 3]
+
+    # filters are kept when the writer is recreated
+    assert writer.recreate()._filters == [filtr]
+
+
+def test_deferred_filters_broken():
+    class FilterBroken(TraceFilter):
+        deferred = True
+
+        def process_trace(self, trace):
+            raise ValueError()
+
+    writer = AgentWriter()
+    writer._send_payload = mock.Mock()
+    writer._filters = [FilterBroken(), _DeferredFilter()]
+    for i in range(2):
+        writer.write([Span(tracer=None, name="name", trace_id=i + 1, span_id=1)])
+
+    with mock.patch("ddtrace.internal.writer.log") as log:
+        writer.flush_queue()
+    log.error.assert_called_once()
+
+    # A broken filter leaves the traces untouched for the next filters
+    payload, n_traces = writer._send_payload.call_args[0]
+    assert n_traces == 1
+
+
+def test_deferred_filters_pending_full():
+    writer = AgentWriter(max_pending_traces=4, report_metrics=True)
+    writer.dogstatsd = _statsd()
+    writer.awake = mock.Mock()
+    writer._filters = [_DeferredFilter()]
+
+    for i in range(5):
+        writer.write([Span(tracer=None, name="name", trace_id=i + 1, span_id=1)])
+    assert len(writer._pending) == 4
+    writer.awake.assert_called()
+    assert writer._metrics["buffer.dropped.traces"]["count"] == 1
+    assert writer._metrics["buffer.dropped.traces"]["tags"] == ["reason:full"]
 
 
 class LogWriterTests(BaseTestCase):